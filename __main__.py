@@ -2,6 +2,10 @@
 # -*- coding: UTF-8 -*-
 """
 Python 3.8.1
+
+Production: SERVER_WORKERS processes, no reload. uvloop and httptools are
+used when installed (SERVER_LOOP/SERVER_HTTP = 'auto').
+Development: SERVER_RELOAD=true, always one process.
 """
 
 import uvicorn
@@ -14,5 +18,9 @@ if __name__ == '__main__':
         'main:app',
         host=settings.SERVER_HOST,
         port=settings.SERVER_PORT,
-        reload=True
+        reload=settings.SERVER_RELOAD,
+        workers=1 if settings.SERVER_RELOAD else settings.SERVER_WORKERS,
+        loop=settings.SERVER_LOOP,
+        http=settings.SERVER_HTTP,
+        access_log=settings.DEBUG
     )
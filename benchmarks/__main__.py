@@ -0,0 +1,147 @@
+"""
+Offline benchmark of webhook handling and deploys.
+
+Replays the recorded deliveries of the corpus, signed with a benchmark
+GITHUB_SECRET, against the application in this process. git, docker and
+docker-compose are replaced by stubs with simulated latency and transient
+failures, Telegram by a local HTTP server, so no network is used.
+
+    python -m benchmarks --requests 500 --concurrency 20 --output result.json
+    python -m benchmarks --baseline result.json
+
+Exits with 1 when jobs were not finished in time or there are regressions
+against the baseline. Settings not fixed by the benchmark are read from the
+environment as usual, e.g. RATE_LIMIT_PER_MINUTE=30 python -m benchmarks.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import List
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.harness import Benchmark, compare, format_report, get_targets, load_corpus
+from benchmarks.telegram import FakeTelegram
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--corpus', default=os.path.join(ROOT, 'benchmarks', 'corpus'))
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--parallel', type=int, default=2, help='MAX_PARALLEL_DEPLOYS')
+    parser.add_argument('--git-latency', type=float, default=0.05)
+    parser.add_argument('--docker-latency', type=float, default=0.02)
+    parser.add_argument('--compose-latency', type=float, default=0.2)
+    parser.add_argument('--telegram-latency', type=float, default=0.05)
+    parser.add_argument('--fail-rate', type=float, default=0.05, help='transient command failures')
+    parser.add_argument('--retry-delay', type=float, default=0.05)
+    parser.add_argument('--settle-delay', type=float, default=0.2, help='RUN_SETTLE_DELAY')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for jobs')
+    parser.add_argument('--output', help='write the result json here')
+    parser.add_argument('--baseline', help='result json to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--workdir', help='keep state here instead of a temporary directory')
+    parser.add_argument('--verbose', action='store_true', help='application log to stderr')
+    return parser.parse_args(argv)
+
+
+def prepare_environment(workdir: str, args: argparse.Namespace, telegram_url: str) -> None:
+    """Settings of an isolated application in `workdir` and stubs on PATH"""
+
+    bin_path: str = os.path.join(workdir, 'bin')
+    os.makedirs(bin_path, exist_ok=True)
+    stub: str = os.path.join(ROOT, 'benchmarks', 'stub.py')
+    for tool in ('git', 'docker', 'docker-compose'):
+        path: str = os.path.join(bin_path, tool)
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{stub}" {tool} "$@"\n')
+        os.chmod(path, 0o755)
+    targets = get_targets(load_corpus(args.corpus))
+    os.environ.update(
+        ADMINS='[1]',
+        TELEBOT_TOKEN='benchmark',
+        TELEGRAM_API_URL=telegram_url,
+        GITHUB_SECRET='benchmark',
+        LOCATION='benchmark',
+        STAGE='benchmark',
+        STAGES=json.dumps({branch: 'benchmark' for _, branch in targets}),
+        APPLICATIONS=json.dumps(sorted({repository for repository, _ in targets})),
+        CLIENTS='[]',
+        UPDATE='[]',
+        ROUTES_FILE='',
+        DEPLOY_PATH=os.path.join(workdir, 'deploy', '{user}', '{repository}', '{stage}'),
+        CLIENTS_PATH=os.path.join(workdir, 'clients'),
+        MIRRORS_PATH=os.path.join(workdir, 'mirrors'),
+        JOB_LOGS_DIR=os.path.join(workdir, 'job_logs'),
+        LEDGER_FILE=os.path.join(workdir, 'ledger.sqlite3'),
+        LOCKS_DIR=os.path.join(workdir, 'locks'),
+        IMAGES_STATE_FILE=os.path.join(workdir, 'images.json'),
+        BUILD_CACHE_FILE=os.path.join(workdir, 'build_cache.json'),
+        DELIVERY_CACHE_FILE='',
+        CAPTURE_PAYLOADS='false',
+        MAX_PARALLEL_DEPLOYS=str(args.parallel),
+        RETRY_DELAY=str(args.retry_delay),
+        RUN_SETTLE_DELAY=str(args.settle_delay),
+        STUB_LATENCY_GIT=str(args.git_latency),
+        STUB_LATENCY_DOCKER=str(args.docker_latency),
+        STUB_LATENCY_DOCKER_COMPOSE=str(args.compose_latency),
+        STUB_FAIL_RATE=str(args.fail_rate),
+        PATH=bin_path + os.pathsep + os.environ.get('PATH', ''),
+    )
+    # measure the pipeline, not the admission limits, unless asked to
+    os.environ.setdefault('MAX_QUEUE_DEPTH', '0')
+    os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '0')
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    args.corpus = os.path.abspath(args.corpus)
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"No payloads in {args.corpus}", file=sys.stderr)
+        return 2
+    workdir: str = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='benchmark-'))
+    os.makedirs(workdir, exist_ok=True)
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    prepare_environment(workdir, args, telegram.start())
+    # .env and logs of the current directory must not be used
+    cwd: str = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from config import logger
+
+        if not args.verbose:
+            # failed jobs are expected with --fail-rate
+            logger.remove()
+        benchmark = Benchmark(
+            corpus, requests=args.requests, concurrency=args.concurrency, timeout=args.timeout)
+        result: dict = asyncio.run(benchmark.run())
+    finally:
+        telegram.stop()
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    result['telegram'] = dict(telegram.calls)
+    print(format_report(result))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    regressions: List[str] = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+    return 0 if result['drained'] and not regressions else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
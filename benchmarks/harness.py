@@ -0,0 +1,282 @@
+import asyncio
+import datetime
+import glob
+import hashlib
+import hmac
+import json
+import math
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from uuid import uuid4
+
+
+# event and payload of a recorded delivery
+Sample = Tuple[str, dict]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, 0 for no values"""
+
+    if not values:
+        return 0
+    ordered: List[float] = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(values: List[float]) -> dict:
+    return dict(
+        count=len(values),
+        p50=percentile(values, 50),
+        p95=percentile(values, 95),
+        p99=percentile(values, 99),
+        max=max(values, default=0)
+    )
+
+
+def load_corpus(path: str) -> List[Sample]:
+    """Payloads from `path`, named as PayloadCapture dumps them:
+    `<number>-<event>-<delivery>.json`, replayed in name order"""
+
+    samples: List[Sample] = []
+    for file_path in sorted(glob.glob(os.path.join(path, '*.json'))):
+        event: str = os.path.basename(file_path).split('-')[1]
+        with open(file_path, 'r', encoding='utf-8') as f:
+            samples.append((event, json.load(f)))
+    return samples
+
+
+def get_targets(corpus: List[Sample]) -> Set[Tuple[str, str]]:
+    """Repositories and branches the corpus deploys"""
+
+    targets: Set[Tuple[str, str]] = set()
+    for _, data in corpus:
+        workflow: dict = data.get('workflow_job') or data.get('workflow_run') or {}
+        branch: str = workflow.get('head_branch') or data.get('ref', '').split('/')[-1]
+        targets.add((data['repository']['name'], branch))
+    return targets
+
+
+def vary(data: dict, number: int) -> dict:
+    """Copy of the payload for replay round `number`: new commit and
+    workflow run, so rounds are not merged with each other"""
+
+    data = json.loads(json.dumps(data))
+    sha: str = hashlib.sha1(str(number).encode()).hexdigest()
+    if 'after' in data:
+        data['after'] = sha
+    if data.get('workflow_job'):
+        data['workflow_job'].update(head_sha=sha, run_id=number + 1)
+    if data.get('workflow_run'):
+        data['workflow_run'].update(head_sha=sha, id=number + 1)
+    return data
+
+
+def get_signature(body: bytes, secret: str) -> str:
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def get_step_durations(rows: list) -> Iterator[Tuple[str, float]]:
+    """(step, seconds) of finished steps from ledger step rows"""
+
+    started: Dict[str, float] = {}
+    for row in rows:
+        if row['status'] == 'started':
+            started[row['step']] = row['at']
+        elif row['step'] in started:
+            yield row['step'], row['at'] - started.pop(row['step'])
+
+
+def compare(result: dict, baseline: dict, tolerance: float = 0.2, slack: float = 0.005) -> List[str]:
+    """Regressions of the result against the baseline result.
+
+    A p95/p99 is a regression when it is more than `tolerance` (relative)
+    plus `slack` seconds worse, throughput when it dropped by `tolerance`.
+    """
+
+    pairs: List[Tuple[str, dict, Optional[dict]]] = [
+        ('webhook', result['webhook'], baseline.get('webhook')),
+        ('deploy', result['deploy'], baseline.get('deploy')),
+        *(
+            (f'stage {step}', summary, baseline.get('stages', {}).get(step))
+            for step, summary in result['stages'].items()
+        ),
+    ]
+    regressions: List[str] = []
+    for name, current, base in pairs:
+        if not base or not current['count']:
+            continue
+        for key in ('p95', 'p99'):
+            if current[key] > base[key] * (1 + tolerance) + slack:
+                regressions.append(
+                    f"{name} {key}: {current[key] * 1000:.1f} ms, baseline {base[key] * 1000:.1f} ms")
+    if result['throughput'] < baseline.get('throughput', 0) * (1 - tolerance):
+        regressions.append(
+            f"throughput: {result['throughput']:.1f}/s, baseline {baseline['throughput']:.1f}/s")
+    return regressions
+
+
+def format_report(result: dict) -> str:
+    def row(name: str, summary: dict) -> str:
+        return (
+            f"{name:<16}{summary['count']:>7}"
+            + ''.join(f"{summary[key] * 1000:>11.1f}" for key in ('p50', 'p95', 'p99', 'max'))
+        )
+
+    lines: List[str] = [
+        f"Requests: {result['requests']}, concurrency {result['concurrency']}, "
+        f"{result['elapsed']:.2f} s, {result['throughput']:.1f} req/s",
+        f"Responses: {result['statuses']}",
+        f"Jobs: {result['jobs']}",
+        f"Retries: {result['retries']}",
+        f"Telegram calls: {result.get('telegram', {})}",
+        '',
+        f"{'ms':<16}{'count':>7}{'p50':>11}{'p95':>11}{'p99':>11}{'max':>11}",
+        row('webhook', result['webhook']),
+        row('queue wait', result['queue_wait']),
+        row('deploy', result['deploy']),
+        *(row(f'  {step}', summary) for step, summary in result['stages'].items()),
+    ]
+    if not result['drained']:
+        lines.append('\nJobs were not finished before the timeout')
+    return '\n'.join(lines)
+
+
+class Benchmark:
+    """Replays the corpus against the application in this process and
+    collects webhook latency from the client side and job and step
+    durations from the deploy ledger.
+
+    The environment (settings, stub executables on PATH, Telegram stand-in)
+    must be prepared before the first application import.
+    """
+
+    def __init__(
+            self,
+            corpus: List[Sample],
+            requests: int = 100,
+            concurrency: int = 10,
+            timeout: float = 300
+    ):
+        self.corpus: List[Sample] = corpus
+        self.requests: int = requests
+        self.concurrency: int = concurrency
+        self.timeout: float = timeout
+
+    async def run(self) -> dict:
+        import httpx
+
+        from main import app
+
+        await app.router.startup()
+        try:
+            self._prepare_targets()
+            async with httpx.AsyncClient(app=app, base_url='http://benchmark') as client:
+                latencies, statuses, elapsed = await self._replay(client)
+            drained: bool = await self._drain()
+            return dict(
+                requests=self.requests,
+                concurrency=self.concurrency,
+                elapsed=elapsed,
+                throughput=self.requests / elapsed if elapsed else 0,
+                statuses={str(code): count for code, count in sorted(statuses.items())},
+                webhook=summarize(latencies),
+                drained=drained,
+                **await self._collect_jobs()
+            )
+        finally:
+            await app.router.shutdown()
+
+    def _prepare_targets(self) -> None:
+        from services.routing import get_route_key, routing_table
+
+        for _, data in self.corpus:
+            owner, repository, branch = get_route_key(data)
+            target = routing_table.resolve(owner, repository, branch)
+            if not target:
+                continue
+            path: str = target.get_path(owner)
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, '.env'), 'w') as f:
+                f.write('BENCHMARK=1\n')
+
+    async def _replay(self, client) -> Tuple[List[float], Counter, float]:
+        from config import settings
+
+        latencies: List[float] = []
+        statuses: Counter = Counter()
+        numbers: Iterator[int] = iter(range(self.requests))
+
+        async def send() -> None:
+            for number in numbers:
+                event, data = self.corpus[number % len(self.corpus)]
+                body: bytes = json.dumps(vary(data, number // len(self.corpus))).encode()
+                headers: dict = {
+                    'X-Hub-Signature-256': get_signature(body, settings.GITHUB_SECRET),
+                    'User-Agent': 'GitHub-Hookshot/benchmark',
+                    'X-GitHub-Event': event,
+                    'X-GitHub-Delivery': str(uuid4()),
+                    'Content-Type': 'application/json',
+                }
+                started: float = time.perf_counter()
+                response = await client.post('/deploy/', content=body, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+
+        started: float = time.perf_counter()
+        await asyncio.gather(*(send() for _ in range(self.concurrency)))
+        return latencies, statuses, time.perf_counter() - started
+
+    async def _drain(self) -> bool:
+        """Wait for queued jobs and runs waiting to be deployed"""
+
+        from services.jobs import job_queue
+        from services.runs import run_aggregator
+
+        deadline: float = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if job_queue.idle and not run_aggregator.settling:
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    async def _collect_jobs(self) -> dict:
+        from config import settings
+        from services.ledger import ledger
+        from services.metrics import COMMAND_RETRIES
+        from services.routing import get_route_key, routing_table
+
+        await ledger.flush()
+        targets: Set[Tuple[str, str]] = set()
+        for _, data in self.corpus:
+            target = routing_table.resolve(*get_route_key(data))
+            if target:
+                targets.add((target.repository, target.stage))
+        statuses: Counter = Counter()
+        deploys: List[float] = []
+        waits: List[float] = []
+        steps: Dict[str, List[float]] = {}
+        for repository, stage in sorted(targets):
+            for job in ledger.history(repository, stage):
+                statuses[job['status']] += 1
+                created, started, finished = (
+                    datetime.datetime.fromisoformat(job[key]) if job[key] else None
+                    for key in ('created', 'started', 'finished')
+                )
+                if started:
+                    waits.append((started - created).total_seconds())
+                if started and finished:
+                    deploys.append((finished - started).total_seconds())
+                for step, duration in get_step_durations(ledger.steps(job['id'])):
+                    steps.setdefault(step, []).append(duration)
+        return dict(
+            jobs=dict(statuses),
+            queue_wait=summarize(waits),
+            deploy=summarize(deploys),
+            stages={step: summarize(values) for step, values in steps.items()},
+            retries={
+                step: COMMAND_RETRIES.get(step) for step in settings.RETRY_ATTEMPTS
+                if COMMAND_RETRIES.get(step)
+            }
+        )
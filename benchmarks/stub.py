@@ -0,0 +1,46 @@
+"""
+Stand-in for git, docker and docker-compose: `python stub.py <tool> <args>`.
+
+Sleeps STUB_LATENCY_<TOOL> seconds (docker-compose: STUB_LATENCY_DOCKER_COMPOSE)
+with +-50% jitter, and fails with a transient network error with the
+STUB_FAIL_RATE probability. `git clone` and `git init` create the working
+copy with a Dockerfile and a compose file.
+"""
+
+import os
+import random
+import sys
+import time
+
+
+TRANSIENT_ERRORS: dict = {
+    'git': "fatal: unable to access 'https://github.com/': Connection reset by peer",
+    'docker': 'Error response from daemon: toomanyrequests: rate limit exceeded',
+    'docker-compose': 'ERROR: error pulling image configuration: unexpected EOF',
+}
+
+DOCKERFILE: str = 'FROM python:3.8-slim\nCOPY . /app\n'
+COMPOSE: str = 'services:\n  app:\n    build: .\n    image: ${APPNAME}:${VERSION}\n'
+
+
+def create_working_copy(path: str) -> None:
+    os.makedirs(os.path.join(path, '.git'), exist_ok=True)
+    for name, text in (('Dockerfile', DOCKERFILE), ('docker-compose.yml', COMPOSE)):
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(text)
+
+
+def main(tool: str, *args: str) -> int:
+    latency: float = float(os.getenv(f"STUB_LATENCY_{tool.upper().replace('-', '_')}", 0))
+    if latency:
+        time.sleep(latency * random.uniform(0.5, 1.5))
+    if random.random() < float(os.getenv('STUB_FAIL_RATE', 0)):
+        print(TRANSIENT_ERRORS[tool], file=sys.stderr)
+        return 1
+    if tool == 'git' and args and args[0] in ('clone', 'init'):
+        create_working_copy(args[-1])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegram:
+    """Local HTTP server answering Telegram Bot API calls with a message id.
+
+    Every call waits `latency` seconds, calls are counted by method.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency: float = latency
+        self.calls: Counter = Counter()
+        self._message_id: int = 0
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> str:
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def answer(self, method: str) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] += 1
+            self._message_id += 1
+            return {'ok': True, 'result': {'message_id': self._message_id}}
+
+    def _handler(self) -> type:
+        telegram = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                body: bytes = json.dumps(telegram.answer(self.path.rsplit('/', 1)[-1])).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
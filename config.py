@@ -8,16 +8,69 @@ from myloguru.my_loguru import get_logger
 class Settings(BaseSettings):
     SERVER_HOST: str = '127.0.0.1'
     SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 1
+    SERVER_RELOAD: bool = False
+    RESTART_AFTER_UPDATE: bool = True
+    SERVER_LOOP: str = 'auto'
+    SERVER_HTTP: str = 'auto'
     DEBUG: bool = False
     ADMINS: list
     TELEBOT_TOKEN: str
+    TELEGRAM_API_URL: str = 'https://api.telegram.org'
     STAGE: str
     STAGES: dict
     CLIENTS: list = []
     APPLICATIONS: list = []
     GITHUB_SECRET: str
+    API_TOKEN: str = ''
     LOCATION: str
     UPDATE: list = []
+    ROUTES_FILE: str = ''
+    ROUTES_WATCH_INTERVAL: int = 5
+    DEPLOY_PATH: str = '/home/{user}/deploy/{repository}/{stage}'
+    CLIENTS_PATH: str = '/home/deskent/deploy/clients'
+    CLIENTS_RELEASES_KEEP: int = 5
+    MIRRORS_PATH: str = '/home/deskent/deploy/mirrors'
+    MAX_PARALLEL_DEPLOYS: int = 2
+    SUPERSEDE_RUNNING: bool = False
+    COMMAND_TIMEOUT: int = 1800
+    GIT_TIMEOUT: int = 300
+    FETCH_EXACT_COMMIT: bool = False
+    RETRY_ATTEMPTS: dict = {'git': 3, 'build': 3, 'migrations': 2, 'tests': 1, 'run': 3}
+    RETRY_DELAY: float = 5
+    RETRY_BUDGET: int = 600
+    IMAGES_KEEP: int = 3
+    IMAGES_DISK_BUDGET_MB: int = 0
+    IMAGES_STATE_FILE: str = 'images.json'
+    BUILD_CACHE_FILE: str = 'build_cache.json'
+    BUILD_CACHE_SIZE: int = 200
+    DELIVERY_CACHE_SIZE: int = 1000
+    DELIVERY_CACHE_TTL: int = 86400
+    DELIVERY_CACHE_FILE: str = ''
+    CAPTURE_PAYLOADS: bool = False
+    CAPTURE_DIR: str = 'captures'
+    CAPTURE_MAX_FILES: int = 50
+    JOB_LOGS_DIR: str = 'job_logs'
+    JOB_LOGS_KEEP: int = 200
+    JOB_LOG_MAX_BYTES: int = 10 * 2 ** 20
+    JOB_LOG_BACKUPS: int = 1
+    LEDGER_FILE: str = 'ledger.sqlite3'
+    LEDGER_FLUSH_INTERVAL: float = 1
+    LEDGER_MAX_RECOVERIES: int = 2
+    LOCKS_DIR: str = 'locks'
+    MAX_QUEUE_DEPTH: int = 100
+    RATE_LIMIT_PER_MINUTE: float = 0
+    RATE_LIMIT_BURST: int = 20
+    RETRY_AFTER: int = 30
+    RUN_SETTLE_DELAY: float = 30
+    RUN_TTL: int = 3600
+    RUN_MAX: int = 1000
+    RUN_EXPIRE_INTERVAL: float = 60
+    PREFETCH: bool = True
+    PREFETCH_BUILD: bool = False
+    DOCKER_BACKEND: str = 'shell'
+    DOCKER_SOCKET: str = '/var/run/docker.sock'
+    DOCKER_API_VERSION: str = 'v1.41'
 
 BASE_DIR = Path(__file__).parent
 settings = Settings(
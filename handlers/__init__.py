@@ -1 +1,4 @@
 from handlers.root_handlers import root_router
+from handlers.rollback_handlers import rollback_router
+from handlers.metrics_handlers import metrics_router
+from handlers.logs_handlers import logs_router
@@ -0,0 +1,84 @@
+import re
+from typing import AsyncIterator, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Header, Response, status
+from fastapi.responses import StreamingResponse
+
+from handlers.rollback_handlers import check_token
+from services.exceptions import NotFoundError
+from services.job_logs import job_logs
+from services.ledger import ledger
+
+
+logs_router = APIRouter(prefix='/jobs/{job_id}/log', dependencies=[Depends(check_token)])
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Start and end (inclusive) of `bytes=` range or None if it is not satisfiable"""
+
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+@logs_router.get('', tags=['logs'])
+def job_log(job_id: str, range_header: str = Header(None, alias='Range')):
+    """Current part of the job log, byte ranges are supported. Parts
+    rotated away (`.1` ...) are not served"""
+
+    if not job_logs.exists(job_id):
+        raise NotFoundError
+    size: int = job_logs.get_size(job_id)
+    headers: dict = {'Accept-Ranges': 'bytes'}
+    if not size and not range_header:
+        return Response(headers=headers, media_type='text/plain; charset=utf-8')
+    start, end = 0, size - 1
+    status_code: int = status.HTTP_200_OK
+    if range_header:
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={'Content-Range': f'bytes */{size}'}
+            )
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(max(end - start + 1, 0))
+    return StreamingResponse(
+        job_logs.read(job_id, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type='text/plain; charset=utf-8'
+    )
+
+
+@logs_router.get('/stream', tags=['logs'])
+async def job_log_stream(job_id: str, last_event_id: str = Header(None)):
+    """Server-Sent Events with new lines of the job log until the job is finished"""
+
+    if not job_logs.exists(job_id):
+        raise NotFoundError
+    offset: int = int(last_event_id) if (last_event_id or '').isdigit() else 0
+
+    async def events() -> AsyncIterator[str]:
+        # the job may run in another worker
+        async for position, lines in job_logs.follow(
+                job_id, offset, is_active=lambda: ledger.is_active(job_id)):
+            if not lines:
+                yield ': keepalive\n\n'
+                continue
+            data: str = ''.join(f'data: {line}\n' for line in lines)
+            yield f'id: {position}\n{data}\n'
+        yield 'event: end\ndata: \n\n'
+
+    return StreamingResponse(
+        events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services.metrics import registry
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get('/metrics', response_class=PlainTextResponse, tags=['metrics'])
+def metrics():
+    return registry.render()
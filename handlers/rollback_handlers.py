@@ -0,0 +1,55 @@
+import hmac
+
+from fastapi import APIRouter, Depends, Header, status
+from pydantic import BaseModel
+
+from config import settings
+from services.deploy import get_rollback_payload, get_rollback_versions
+from services.exceptions import NotFoundError, UnauthorizedError
+from services.jobs import DeployJob, job_queue
+from services.routing import DeployTarget, routing_table
+
+
+rollback_router = APIRouter(prefix='/rollback')
+
+
+class RollbackRequest(BaseModel):
+    owner: str
+    repository: str
+    stage: str
+    version: str
+
+
+def check_token(authorization: str = Header(None)) -> None:
+    token: str = (authorization or '').replace('Bearer ', '', 1)
+    if not settings.API_TOKEN or not hmac.compare_digest(token, settings.API_TOKEN):
+        raise UnauthorizedError
+
+
+def get_target(owner: str, repository: str, stage: str) -> DeployTarget:
+    target: DeployTarget = routing_table.find(owner, repository, stage)
+    if not target or target.pipeline not in ('docker', 'clients'):
+        raise NotFoundError
+    return target
+
+
+@rollback_router.post(
+    '/', status_code=status.HTTP_202_ACCEPTED, tags=['rollback'], dependencies=[Depends(check_token)])
+async def rollback(data: RollbackRequest):
+    target: DeployTarget = get_target(data.owner, data.repository, data.stage)
+    job: DeployJob = job_queue.submit(
+        DeployJob(
+            kind='rollback',
+            repository_name=target.repository,
+            stage=target.stage,
+            payload=get_rollback_payload(target, data.owner.lower(), data.version)
+        )
+    )
+    return {"result": "ok", "job_id": job.id}
+
+
+@rollback_router.get(
+    '/{owner}/{repository}/{stage}', tags=['rollback'], dependencies=[Depends(check_token)])
+async def rollback_versions(owner: str, repository: str, stage: str):
+    target: DeployTarget = get_target(owner, repository, stage)
+    return {"versions": await get_rollback_versions(target, owner.lower())}
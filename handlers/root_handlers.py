@@ -1,15 +1,26 @@
 import hashlib
 import hmac
-import json
+import time
+from typing import Callable, Optional
 
 from fastapi import APIRouter, Request, Header, Response, status, Depends
 
 from config import logger, settings
-from services.deploy import deploy_or_copy, update_repository
+from services.admission import admission, starts_deploy
+from services.capture import payload_capture
+from services.deliveries import delivery_cache
+from services.exceptions import AdmissionError, NotFoundError
+from services.jobs import DeployJob, get_job_info, submit_payload
+from services.metrics import HOOK_REJECTIONS, REQUEST_LATENCY
+from services.routing import DeployTarget, get_route_key, routing_table
+from services.runs import run_aggregator
+from services.utils import json_loads
 
 
 root_router = APIRouter()
 
+EVENTS: tuple = ('push', 'workflow_run', 'workflow_job')
+
 
 def validate_signature(header, body):
     sha_name, github_signature = header.split('=')
@@ -26,9 +37,13 @@ async def check_hook(
         x_hub_signature_256: str = Header(None),
         user_agent: str = Header(None),
         x_github_event: str = Header(None),
+        x_github_delivery: str = Header(None),
+        x_github_hook_installation_target_type: str = Header(None),
+        x_github_hook_installation_target_id: str = Header(None),
         content_length: int = Header(...)
 ):
-    if x_github_event not in ('push', 'workflow_run', 'workflow_job'):
+    request.state.started = time.monotonic()
+    if x_github_event not in EVENTS:
         logger.error(f"Wrong event: {x_github_event}")
         return {"result": "Event wrong"}
     if content_length > 1_000_000:
@@ -37,9 +52,38 @@ async def check_hook(
     if not user_agent.startswith('GitHub-Hookshot/'):
         logger.error(f"User agent FAIL: {user_agent}")
         return {"result": "User agent fail"}
-    if not validate_signature(header=x_hub_signature_256, body=await request.body()):
+    body: bytes = await request.body()
+    # GitHub does not redeliver refused deliveries, deploys are never shed
+    sheddable: bool = not starts_deploy(x_github_event, body)
+    if sheddable:
+        _admit(admission.check_depth)
+    if not validate_signature(header=x_hub_signature_256, body=body):
         logger.error(f"Wrong content: {x_hub_signature_256}")
         return {"result": "Wrong content"}
+    answer: dict = delivery_cache.get(x_github_delivery)
+    if answer is not None:
+        logger.info(f"Duplicate delivery: {x_github_delivery}")
+        return {"result": "Duplicate delivery", "answer": answer}
+    if sheddable:
+        _admit(
+            admission.check_rate,
+            x_github_hook_installation_target_type, x_github_hook_installation_target_id
+        )
+    payload_capture.capture(x_github_event, x_github_delivery, body)
+    try:
+        request.state.data = json_loads(body)
+    except ValueError as err:
+        logger.error(err)
+        return {"result": "Wrong json"}
+
+
+def _admit(check: Callable, *args) -> None:
+    try:
+        check(*args)
+    except AdmissionError as err:
+        logger.warning(f"Delivery refused: {err.detail}")
+        HOOK_REJECTIONS.inc(err.detail)
+        raise
 
 
 @root_router.get('/', tags=['root'])
@@ -47,24 +91,50 @@ def root():
     return {"root": "OKidoki"}
 
 
-@root_router.post('/', status_code=status.HTTP_200_OK, tags=['deploy'])
+@root_router.post('/', status_code=status.HTTP_202_ACCEPTED, tags=['deploy'])
 async def deploy(
         request: Request,
+        x_github_event: str = Header(None),
+        x_github_delivery: str = Header(None),
         hook_is_not_valid: dict = Depends(check_hook)
 ):
+    try:
+        return await handle_hook(request, x_github_delivery, hook_is_not_valid)
+    finally:
+        event: str = x_github_event if x_github_event in EVENTS else 'other'
+        REQUEST_LATENCY.observe(time.monotonic() - request.state.started, event)
+
+
+async def handle_hook(request: Request, x_github_delivery: str, hook_is_not_valid: dict) -> dict:
     answer: dict = {"result": "ok"}
     if hook_is_not_valid:
         logger.warning(hook_is_not_valid)
-        return answer
+        HOOK_REJECTIONS.inc(hook_is_not_valid['result'])
+        return hook_is_not_valid.get('answer', answer)
 
-    try:
-        data: dict = await request.json()
-        data_str = '\n\n'.join(f"{k}: {v}" for k, v in data.items())
-        logger.debug(f"Data: \n{data_str}")
-        if data['repository']['name'] in settings.UPDATE:
-            update_repository(data)
-        else:
-            deploy_or_copy(data)
-    except json.decoder.JSONDecodeError as err:
-        logger.error(err)
+    data: dict = request.state.data
+    route_key: tuple = get_route_key(data)
+    target: DeployTarget = routing_table.resolve(*route_key)
+    if not target:
+        logger.warning(f"No route: {route_key}")
+        HOOK_REJECTIONS.inc('No route')
+        delivery_cache.set(x_github_delivery, answer)
+        return answer
+    logger.opt(lazy=True).debug(
+        "Data: \n{}", lambda: '\n\n'.join(f"{k}: {v}" for k, v in data.items()))
+    if target.pipeline != 'update' and ('workflow_job' in data or 'workflow_run' in data):
+        job: Optional[DeployJob] = await run_aggregator.add(data, target)
+    else:
+        job = submit_payload(data, target)
+    if job:
+        answer.update(job_id=job.id)
+    delivery_cache.set(x_github_delivery, answer)
     return answer
+
+
+@root_router.get('/jobs/{job_id}', tags=['deploy'])
+def job_status(job_id: str):
+    info: Optional[dict] = get_job_info(job_id)
+    if not info:
+        raise NotFoundError
+    return info
@@ -1,22 +1,57 @@
 from fastapi import FastAPI
 
-from routers import api_router
+from routers import api_router, metrics_router
 from config import logger, settings
+from services.deliveries import delivery_cache
+from services.engine import docker_engine
+from services.jobs import job_queue, recover_jobs
+from services.ledger import ledger
+from services.locks import FileLock, get_lock
+from services.notifier import notifier
+from services.routing import routing_table
+from services.runs import run_aggregator
 from services.utils import send_message_to_admins
 from _resources import __version__, __appname__, __build__
 
 
-@logger.catch
-def get_application() -> FastAPI:
-    """Start func"""
+_startup_lock: FileLock = get_lock('startup', 'notification')
 
+
+async def notify_started() -> None:
+    """Startup message, sent by one worker only. The notifier delivers it
+    in background, so startup does not wait for Telegram."""
+
+    if not _startup_lock.try_acquire():
+        return
     send_message_to_admins(f"{__appname__.title()} started."
                            f"\nBuild:[{__build__}]"
                            f"\nVersion:[{__version__}]"
                            f"\nLocation: [{settings.LOCATION}]"
     )
+
+
+@logger.catch
+def get_application() -> FastAPI:
+    """Start func"""
+
     application = FastAPI()
     application.include_router(api_router)
+    application.include_router(metrics_router)
+    application.add_event_handler('startup', notifier.start)
+    application.add_event_handler('startup', notify_started)
+    application.add_event_handler('startup', delivery_cache.load)
+    application.add_event_handler('startup', routing_table.start)
+    application.add_event_handler('startup', ledger.start)
+    application.add_event_handler('startup', run_aggregator.start)
+    application.add_event_handler('startup', recover_jobs)
+    application.add_event_handler('shutdown', job_queue.stop)
+    application.add_event_handler('shutdown', run_aggregator.stop)
+    application.add_event_handler('shutdown', ledger.stop)
+    application.add_event_handler('shutdown', notifier.stop)
+    application.add_event_handler('shutdown', delivery_cache.save)
+    application.add_event_handler('shutdown', routing_table.stop)
+    application.add_event_handler('shutdown', docker_engine.close)
+    application.add_event_handler('shutdown', _startup_lock.release)
 
     return application
 
@@ -1,6 +1,8 @@
 from fastapi import APIRouter
-from handlers import root_router
+from handlers import root_router, rollback_router, metrics_router, logs_router
 
 
 api_router = APIRouter(prefix="/deploy")
 api_router.include_router(root_router)
+api_router.include_router(rollback_router)
+api_router.include_router(logs_router)
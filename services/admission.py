@@ -0,0 +1,102 @@
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from starlette import status
+
+from config import settings
+from services.exceptions import AdmissionError
+from services.jobs import job_queue
+
+
+COMPLETED = re.compile(rb'"action"\s*:\s*"completed"')
+
+
+def starts_deploy(event: str, body: bytes) -> bool:
+    """Push or a "completed" workflow event, told without parsing the json.
+    GitHub does not redeliver refused deliveries, so these are never rate
+    limited or refused for the queue depth: a refused one is a lost deploy."""
+
+    return event == 'push' or bool(COMPLETED.search(body))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self._rate: float = rate
+        self._capacity: float = capacity
+        self._tokens: float = capacity
+        self._updated: float = time.monotonic()
+
+    def take(self) -> float:
+        """Take one token, return 0 or seconds until a token is available"""
+
+        now: float = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+
+class AdmissionControl:
+    """Decides whether a webhook is accepted before its json is parsed.
+
+    Deliveries not starting a deploy are refused with 503 while
+    `max_depth` jobs wait in the queue, and with 429 when the token bucket
+    of the hook target (a repository, or an organization for organization
+    hooks) is empty. Buckets of the last `max_keys` targets are kept. The
+    rate limit is off with `rate_per_minute` 0. The queue and the buckets
+    are those of the current worker process.
+    """
+
+    def __init__(
+            self,
+            depth: Callable[[], int],
+            max_depth: int = 0,
+            rate_per_minute: float = 0,
+            burst: int = 1,
+            max_keys: int = 1000
+    ):
+        self._depth: Callable[[], int] = depth
+        self._max_depth: int = max_depth
+        self._rate: float = rate_per_minute / 60
+        self._burst: int = max(burst, 1)
+        self._max_keys: int = max_keys
+        self._buckets: 'OrderedDict[Tuple[str, str], TokenBucket]' = OrderedDict()
+
+    def check_depth(self) -> None:
+        if self._max_depth and self._depth() >= self._max_depth:
+            raise AdmissionError(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Deploy queue is full',
+                retry_after=settings.RETRY_AFTER
+            )
+
+    def check_rate(self, target_type: Optional[str], target_id: Optional[str]) -> None:
+        if not self._rate:
+            return
+        key: Tuple[str, str] = (target_type or '', target_id or '')
+        bucket: TokenBucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self._rate, self._burst)
+            if len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        wait: float = bucket.take()
+        if wait:
+            raise AdmissionError(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail='Too many deliveries',
+                retry_after=math.ceil(wait)
+            )
+
+
+admission = AdmissionControl(
+    depth=lambda: job_queue.depth,
+    max_depth=settings.MAX_QUEUE_DEPTH,
+    rate_per_minute=settings.RATE_LIMIT_PER_MINUTE,
+    burst=settings.RATE_LIMIT_BURST
+)
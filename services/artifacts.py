@@ -0,0 +1,147 @@
+import hashlib
+import os
+import re
+import shutil
+import time
+from typing import List
+
+
+OBJECTS_DIR: str = '.objects'
+RELEASES_DIR: str = '.releases'
+LEGACY_RELEASE: str = '0-legacy'
+
+
+def get_file_hash(path: str, chunk_size: int = 2 ** 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_release_name(build: str) -> str:
+    """Release directory name, ordered by creation time"""
+
+    safe_build: str = re.sub(r'[^\w.-]', '_', build)
+    return f"{time.time_ns()}-{safe_build}"
+
+
+def _get_release_time(name: str) -> int:
+    prefix: str = name.split('-', 1)[0]
+    return int(prefix) if prefix.isdigit() else 0
+
+
+class ArtifactStore:
+    """Client archives published under `path`.
+
+    Every file is stored once in `.objects/<sha256>`, read-only. A release
+    is a directory of hardlinks to the objects in `.releases/<name>/` and
+    `<name>` is a symlink to the current release, so downloaders see either
+    the previous or the new set of files, never a mix of them. Unchanged
+    files of a new release are links to the existing objects and cost no
+    writes. The last `keep` releases stay for revert, objects no release
+    links to are removed.
+
+    Files must be on the same filesystem as `path`: published files are
+    moved into the store, not copied. Methods block on the filesystem and
+    must be called under the `clients` lock of `path`.
+    """
+
+    def __init__(self, path: str, keep: int = 5):
+        self.path: str = path
+        self.keep: int = max(keep, 1)
+
+    @property
+    def objects_path(self) -> str:
+        return os.path.join(self.path, OBJECTS_DIR)
+
+    def get_releases_path(self, name: str) -> str:
+        return os.path.join(self.path, RELEASES_DIR, name)
+
+    def get_current(self, name: str) -> str:
+        """Release `name` links to, '' before the first publish"""
+
+        link: str = os.path.join(self.path, name)
+        if not os.path.islink(link):
+            return ''
+        return os.path.basename(os.readlink(link))
+
+    def get_releases(self, name: str) -> List[str]:
+        """Releases of `name`, newest first"""
+
+        path: str = self.get_releases_path(name)
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.listdir(path), key=_get_release_time, reverse=True)
+
+    def publish(self, name: str, files: List[str], release: str) -> str:
+        """Make a release of the current files of `name` with `files` put
+        over them and switch `name` to it"""
+
+        release_path: str = os.path.join(self.get_releases_path(name), release)
+        os.makedirs(release_path)
+        current_path: str = os.path.join(self.path, name)
+        if os.path.isdir(current_path):
+            for entry in os.scandir(current_path):
+                if entry.is_file(follow_symlinks=False):
+                    os.link(entry.path, os.path.join(release_path, entry.name))
+        for file_path in files:
+            target: str = os.path.join(release_path, os.path.basename(file_path))
+            if os.path.exists(target):
+                os.remove(target)
+            os.link(self._store(file_path), target)
+        self.switch(name, release)
+        self.prune(name)
+        return release
+
+    def revert(self, name: str, release: str = '') -> str:
+        """Switch `name` to the `release` or to the one before the current,
+        '' when there is no such release"""
+
+        releases: List[str] = self.get_releases(name)
+        if not release:
+            current: str = self.get_current(name)
+            older: List[str] = releases[releases.index(current) + 1:] if current in releases else []
+            release = older[0] if older else ''
+        if not release or release not in releases:
+            return ''
+        self.switch(name, release)
+        return release
+
+    def switch(self, name: str, release: str) -> None:
+        """Point `name` to the release with a single rename"""
+
+        link: str = os.path.join(self.path, name)
+        temp_link: str = os.path.join(self.path, f'.{name}.tmp')
+        if os.path.lexists(temp_link):
+            os.remove(temp_link)
+        os.symlink(os.path.join(RELEASES_DIR, name, release), temp_link)
+        if os.path.isdir(link) and not os.path.islink(link):
+            # files copied in place before the store was used
+            os.rename(link, os.path.join(self.get_releases_path(name), LEGACY_RELEASE))
+        os.replace(temp_link, link)
+
+    def prune(self, name: str) -> None:
+        current: str = self.get_current(name)
+        for release in self.get_releases(name)[self.keep:]:
+            if release != current:
+                shutil.rmtree(os.path.join(self.get_releases_path(name), release))
+        self.collect_objects()
+
+    def collect_objects(self) -> None:
+        """Remove objects that no release links to"""
+
+        for root, _, files in os.walk(self.objects_path):
+            for file_name in files:
+                file_path: str = os.path.join(root, file_name)
+                if os.stat(file_path).st_nlink == 1:
+                    os.remove(file_path)
+
+    def _store(self, file_path: str) -> str:
+        digest: str = get_file_hash(file_path)
+        object_path: str = os.path.join(self.objects_path, digest[:2], digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.chmod(file_path, 0o444)
+            os.replace(file_path, object_path)
+        return object_path
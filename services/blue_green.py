@@ -0,0 +1,77 @@
+import os
+from typing import Dict, List
+
+import httpx
+from pydantic import BaseModel, validator
+
+from services.utils import load_json, save_json
+
+
+COLORS: tuple = ('blue', 'green')
+STATE_FILE: str = 'blue_green.json'
+
+
+class BlueGreenConfig(BaseModel):
+    """`blue_green` route option.
+
+    The compose file publishes the application on `${APP_PORT}`, which is
+    the port of the color being started. `health_url` may contain `{port}`,
+    without it the docker health status of the containers is checked.
+    Both colors need a port and `upstream_file` is required: without the
+    switch the old color would be stopped with no new one serving.
+    """
+
+    ports: Dict[str, int]
+    health_url: str = ''
+    health_timeout: float = 120
+    health_interval: float = 2
+    upstream_file: str
+    upstream: str = 'server 127.0.0.1:{port};\n'
+    reload: List[str] = []
+    drain: float = 10
+
+    @validator('ports')
+    def check_ports(cls, value: Dict[str, int]) -> Dict[str, int]:
+        missing: List[str] = [color for color in COLORS if not value.get(color)]
+        if missing:
+            raise ValueError(f"no port for {', '.join(missing)}")
+        return value
+
+    @validator('upstream_file')
+    def check_upstream_file(cls, value: str) -> str:
+        if not value:
+            raise ValueError('upstream_file is required')
+        return value
+
+
+def get_active_color(path: str) -> str:
+    """Color serving the target deployed to `path`, '' before the first
+    blue/green deploy"""
+
+    return load_json(os.path.join(path, STATE_FILE), {}).get('color', '')
+
+
+def save_active_color(path: str, color: str, image: str) -> None:
+    save_json(os.path.join(path, STATE_FILE), dict(color=color, image=image))
+
+
+def get_next_color(color: str) -> str:
+    return COLORS[1] if color == COLORS[0] else COLORS[0]
+
+
+def replace_file(path: str, text: str) -> None:
+    """Write the file so that a reader never sees it half written"""
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+async def check_url(url: str, timeout: float = 5) -> bool:
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response: httpx.Response = await client.get(url)
+    except httpx.HTTPError:
+        return False
+    return response.status_code < 400
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import time
+from typing import Set
+
+from config import logger, settings
+
+
+class PayloadCapture:
+    """Opt-in dump of raw webhook bodies for debugging.
+
+    Bodies are written as received, in a thread, and only the last
+    `max_files` dumps are kept.
+    """
+
+    def __init__(self, enabled: bool = False, path: str = 'captures', max_files: int = 50):
+        self.enabled: bool = enabled
+        self._path: str = path
+        self._max_files: int = max_files
+        self._tasks: Set[asyncio.Future] = set()
+
+    def capture(self, event: str, delivery: str, body: bytes) -> None:
+        if not self.enabled:
+            return
+        name = f'{time.time_ns()}-{event}-{delivery or "none"}.json'
+        loop = asyncio.get_event_loop()
+        task = loop.run_in_executor(None, self._write, name, body)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _write(self, name: str, body: bytes) -> None:
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            with open(os.path.join(self._path, name), 'wb') as f:
+                f.write(body)
+            self._rotate()
+        except OSError as err:
+            logger.error(f"Payload capture error: {err}")
+
+    def _rotate(self) -> None:
+        names: list = sorted(os.listdir(self._path))
+        for name in names[:-self._max_files]:
+            try:
+                os.remove(os.path.join(self._path, name))
+            except FileNotFoundError:
+                pass
+
+
+payload_capture = PayloadCapture(
+    enabled=settings.CAPTURE_PAYLOADS,
+    path=settings.CAPTURE_DIR,
+    max_files=settings.CAPTURE_MAX_FILES
+)
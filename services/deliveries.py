@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import logger, settings
+from services.utils import load_json, save_json
+
+
+class DeliveryCache:
+    """Answers for already handled GitHub deliveries (X-GitHub-Delivery).
+
+    Bounded LRU with TTL, optionally saved to a json file between restarts.
+    The cache is per worker process: a delivery handled by another worker
+    is not found here, and the file keeps the cache of the worker stopped
+    last.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 86400, path: str = ''):
+        self._max_size: int = max_size
+        self._ttl: float = ttl
+        self._path: str = path
+        self._items: 'OrderedDict[str, Tuple[float, dict]]' = OrderedDict()
+
+    def get(self, delivery_id: str) -> Optional[dict]:
+        if not delivery_id:
+            return None
+        item: Tuple[float, dict] = self._items.get(delivery_id)
+        if item is None:
+            return None
+        created, answer = item
+        if time.time() - created > self._ttl:
+            del self._items[delivery_id]
+            return None
+        self._items.move_to_end(delivery_id)
+        return answer
+
+    def set(self, delivery_id: str, answer: dict) -> None:
+        if not delivery_id:
+            return
+        self._items[delivery_id] = (time.time(), answer)
+        self._items.move_to_end(delivery_id)
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def load(self) -> None:
+        items: list = load_json(self._path, [])
+        now: float = time.time()
+        for delivery_id, created, answer in items[-self._max_size:]:
+            if now - created <= self._ttl:
+                self._items[delivery_id] = (created, answer)
+        logger.info(f"Delivery cache loaded: {len(self._items)}")
+
+    def save(self) -> None:
+        if not self._path:
+            return
+        save_json(self._path, [
+            [delivery_id, created, answer]
+            for delivery_id, (created, answer) in self._items.items()
+        ])
+
+
+delivery_cache = DeliveryCache(
+    max_size=settings.DELIVERY_CACHE_SIZE,
+    ttl=settings.DELIVERY_CACHE_TTL,
+    path=settings.DELIVERY_CACHE_FILE
+)
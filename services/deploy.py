@@ -1,37 +1,41 @@
-import json
+import asyncio
+import glob
 import os
 import re
-import subprocess
+import shutil
+import time
+from contextlib import contextmanager
 from secrets import token_urlsafe
-from typing import Tuple
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
 
-from pydantic import BaseModel
+from pydantic import ValidationError
 
+from services.artifacts import ArtifactStore, get_release_name
+from services.blue_green import (
+    BlueGreenConfig, check_url, get_active_color, get_next_color, replace_file, save_active_color
+)
+from services.engine import docker_engine
+from services.executor import CommandExecutor, CommandResult
+from services.metrics import STAGE_DURATION
+from services.images import (
+    ImageGC, ImageInfo, get_build_cache_key, get_cached_build, save_cached_build,
+    schedule_image_gc, touch_image
+)
+from services.job_logs import JobLog
+from services.ledger import ledger
+from services.locks import get_lock
+from services.mirror import GitMirror
+from services.prefetch import prefetcher
+from services.restart import schedule_restart
+from services.retry import RetryPolicy, get_retry_policy
+from services.routing import DeployTarget, get_route_key, routing_table
 from services.utils import send_message_to_admins
-from config import logger, settings, BASE_DIR
+from config import logger, settings
 from services.exceptions import (
     WrongVersionException, WrongBuildException, ContainerBuildError, ContainerTestError,
-    ContainerRunError, ContainerPrepareError, MigrationsError
+    ContainerRunError, ContainerPrepareError, MigrationsError, DeployCancelledError
 )
 
-class CommandExecutor(BaseModel):
-    path: str = None
-
-    def run_command(self, command: str, path: str = None) -> int:
-        if not path:
-            path = self.path
-        result: 'subprocess.CompletedProcess' = subprocess.run(
-            [command],
-            shell=True,
-            stderr=open(f'{path}/subprocess.log', 'a', encoding='utf-8')
-        )
-        if result.returncode:
-            logger.error(result)
-        else:
-            logger.debug(result)
-
-        return result.returncode
-
 
 class GitPull(CommandExecutor):
     branch: str
@@ -39,10 +43,24 @@ class GitPull(CommandExecutor):
     user: str
     report: str = ''
     full_path: str = ''
+    sha: str = ''
 
-    def clone_repository(self) -> None:
-        if self.run_command(
-                f'git clone -b {self.branch} git@github.com:{self.user}/{self.repository_name}.git {self.full_path}'
+    @property
+    def remote_url(self) -> str:
+        return f'git@github.com:{self.user}/{self.repository_name}.git'
+
+    def _retry_policy(self, step: str) -> RetryPolicy:
+        return get_retry_policy(step)
+
+    async def run_step(self, step: str, *command: str, **kwargs) -> int:
+        """Run command retrying transient failures by the step policy"""
+
+        return await self._retry_policy(step).run(self, *command, **kwargs)
+
+    async def clone_repository(self) -> None:
+        if await self.run_step(
+                'git', 'git', 'clone', '-b', self.branch, self.remote_url, self.full_path,
+                timeout=settings.GIT_TIMEOUT
         ):
             text = "\nОшибка клонирования"
             self.report += text
@@ -50,17 +68,54 @@ class GitPull(CommandExecutor):
 
         self.report += '\nКлонирование: ОК'
 
-    def pull_repository(self) -> None:
-        if self.run_command(
-                f'cd {self.full_path} '
-                f'&& git checkout {self.branch}'
-                f'&& git pull'
+    async def pull_repository(self) -> None:
+        if (
+                await self.checkout()
+                or await self.run_step(
+                    'git', 'git', 'pull', cwd=self.full_path, timeout=settings.GIT_TIMEOUT)
         ):
             text = f"\nОшибка пулла"
             self.report += text
             raise ContainerBuildError(detail=text)
         self.report += '\nПулл: ОК'
 
+    async def fetch_commit(self) -> None:
+        """Shallow fetch of exactly `sha` and detached checkout of it"""
+
+        status: int = 0
+        if not os.path.exists(os.path.join(self.full_path, '.git')):
+            status = (
+                await self.run_command('git', 'init', self.full_path)
+                or await self.run_command(
+                    'git', 'remote', 'add', 'origin', self.remote_url, cwd=self.full_path)
+            )
+        status = status or (
+            await self.run_step(
+                'git', 'git', 'fetch', '--depth', '1', 'origin', self.sha,
+                cwd=self.full_path, timeout=settings.GIT_TIMEOUT
+            )
+            or await self.run_command(
+                'git', 'checkout', '--force', '--detach', 'FETCH_HEAD', cwd=self.full_path)
+        )
+        if status:
+            text = f"\nОшибка получения коммита {self.sha}"
+            self.report += text
+            raise ContainerBuildError(detail=text)
+        self.report += f'\nКоммит {self.sha[:7]}: ОК'
+
+    async def get_head(self, path: str = None) -> str:
+        """Commit checked out in the working copy, '' if unknown"""
+
+        lines: Optional[List[str]] = await self.read_command(
+            'git', 'rev-parse', 'HEAD', cwd=path or self.full_path)
+        return lines[0].strip() if lines else ''
+
+    async def checkout(self, path: str = None) -> int:
+        return await self.run_command(
+            'git', 'checkout', self.branch,
+            cwd=path or self.full_path, timeout=settings.GIT_TIMEOUT
+        )
+
 
 class Payload(GitPull):
     stage: str
@@ -69,42 +124,120 @@ class Payload(GitPull):
     ssh_url: str
     container: str = ''
     do_migration: bool = False
+    pipeline: str = 'docker'
+    options: dict = {}
+
+    @property
+    def remote_url(self) -> str:
+        return self.ssh_url or super().remote_url
+
+    def _retry_policy(self, step: str) -> RetryPolicy:
+        return get_retry_policy(step, self.options.get('retry_attempts'))
 
 
 class Docker(Payload):
+    is_cancelled: Callable[[], bool] = None
+    job_id: str = ''
+    backend: str = ''
+    message_key: str = ''
 
-    def deploy(self) -> bool:
+    async def deploy(self) -> bool:
         try:
-            if not self._prepare():
-                return False
-            self._build_container()
+            with self._timed('prepare'):
+                if not self._prepare():
+                    return False
+            self._send_progress()
+            self._check_cancelled()
+            with self._timed('build'):
+                await self._build_container()
+            self._send_progress()
             if self.do_migration:
-                self._run_migrations()
-            self._testing_container()
-            self._running_container()
-            self.run_command(f'docker rmi $(docker images -q)')
-            send_message_to_admins(self.report)
+                self._check_cancelled()
+                with self._timed('migrations'):
+                    await self._run_migrations()
+                self._send_progress()
+            self._check_cancelled()
+            with self._timed('tests'):
+                await self._testing_container()
+            self._send_progress()
+            self._check_cancelled()
+            with self._timed('run'):
+                await self._running_container()
+            self._send_progress()
+            await touch_image(self.image)
+            schedule_image_gc(self.repository_name.lower(), self.path, stage=self.stage)
         except (
-                ContainerBuildError, ContainerTestError, ContainerRunError, ContainerPrepareError
+                ContainerBuildError, ContainerTestError, ContainerRunError, ContainerPrepareError,
+                DeployCancelledError
         ) as err:
             text = err.args[0] if err.args else err.detail
             logger.exception(f"{text}: {err}")
-            send_message_to_admins(self.report)
+            self._send_progress()
             raise
         return True
 
+    async def rollback(self) -> bool:
+        """Start the already built image of `version` without rebuilding"""
+
+        try:
+            if not self._prepare():
+                return False
+            if await self.run_command('docker', 'image', 'inspect', self.image):
+                text = f"\nОбраз {self.image} не найден"
+                self.report += text
+                raise ContainerRunError(detail=text)
+            with self._timed('run'):
+                await self._running_container()
+            self.report += "\nОткат: ОК"
+            self._send_progress()
+            await touch_image(self.image)
+        except (ContainerRunError, ContainerPrepareError) as err:
+            logger.exception(f"{err.detail}: {err}")
+            self._send_progress()
+            raise
+        return True
+
+    def _send_progress(self) -> None:
+        # one message per job: a redeploy or a rollback to the same version
+        # must not edit the message of an earlier deploy
+        if not self.message_key:
+            self.message_key = f"deploy-{self.job_id or token_urlsafe(8)}"
+        send_message_to_admins(self.report, key=self.message_key)
+
+    @contextmanager
+    def _timed(self, step: str) -> Iterator[None]:
+        """Record duration and outcome of a pipeline step"""
+
+        ledger.record_step(self.job_id, step, 'started')
+        with STAGE_DURATION.time(self.repository_name, self.stage, step):
+            try:
+                yield
+            except BaseException:
+                ledger.record_step(self.job_id, step, 'failed')
+                raise
+        ledger.record_step(self.job_id, step, 'done')
+
+    def _check_cancelled(self) -> None:
+        if self.is_cancelled and self.is_cancelled():
+            text = "\nДеплой отменен: есть более новая версия"
+            self.report += text
+            raise DeployCancelledError(detail=text)
+
     def _prepare(self) -> bool:
-        if self.repository_name not in settings.APPLICATIONS:
+        if not routing_table.has_repository(self.user, self.repository_name):
             logger.warning(f'Wrong application: {self.repository_name}')
             return False
         if not self.path:
-            self.path = f'/home/{self.user}/deploy/{self.repository_name}/{self.stage}'
+            self.path = settings.DEPLOY_PATH.format(
+                user=self.user, repository=self.repository_name, stage=self.stage)
         if not os.path.exists(self.path):
             text = f'\n{self.path} does not exists.'
             self.report += text
             raise ContainerPrepareError(detail=text)
         self.full_path = os.path.join(self.path, self.repository_name)
         self.container = f'{self.repository_name}-{self.stage}-{self.version}'
+        # a wrong blue/green setup must fail before anything is built
+        self._get_blue_green()
         self.report += (
             f'\nContainer: {self.container}'
             f'\n[build:{self.build}]'
@@ -113,207 +246,455 @@ class Docker(Payload):
         )
         return True
 
-    def _copy_env(self) -> None:
-        if self.run_command(
-            f'cp {self.path}/.env {self.full_path}'
-        ):
+    @property
+    def image(self) -> str:
+        return f"{self.repository_name.lower()}:{self.stage}-{self.version}"
+
+    def _compose_env(self) -> dict:
+        return dict(VERSION=f"{self.stage}-{self.version}", APPNAME=self.repository_name.lower())
+
+    async def _compose(self, *args: str, path: str = None, step: str = '', env: dict = None) -> int:
+        return await self.run_step(
+            step, 'docker-compose', *args,
+            cwd=path or self.full_path, env={**self._compose_env(), **(env or {})}
+        )
+
+    async def _copy_env(self) -> None:
+        if await self.run_command('cp', f'{self.path}/.env', self.full_path):
             text = "\nОшибка копирования .env файла"
             self.report += text
             raise ContainerBuildError(detail=text)
         self.report += '\nКопирование: ОК'
 
-    def _build_container(self) -> int:
-        logger.info(f"Start building container: {self.container}")
+    def _fetch_exact_commit(self) -> bool:
+        return bool(self.sha) and self.options.get('fetch_exact_commit', settings.FETCH_EXACT_COMMIT)
+
+    async def _update_sources(self) -> None:
+        """Bring the working tree to the deployed revision, once per job"""
+
+        if self._fetch_exact_commit():
+            with self._timed('fetch'):
+                await self.fetch_commit()
+            with self._timed('copy_env'):
+                await self._copy_env()
+            return
         if not os.path.exists(self.full_path):
-            self.clone_repository()
-        self._copy_env()
-        self.pull_repository()
+            with self._timed('clone'):
+                await self.clone_repository()
+        with self._timed('copy_env'):
+            await self._copy_env()
+        with self._timed('pull'):
+            await self.pull_repository()
+
+    async def _build_container(self) -> int:
+        logger.info(f"Start building container: {self.container}")
+        await self._update_sources()
         docker_file_path = self.full_path
         if not os.path.exists(docker_file_path):
             docker_file_path = self.path
-        status = -1
-        for _ in range(2):
-            status: int = self.run_command(
-                f'cd {docker_file_path} '
-                f'&& git checkout {self.branch}'
-                f'&& VERSION="{self.stage}-{self.version}" APPNAME="{self.repository_name.lower()}" docker-compose build'
-            )
-            if not status:
-                break
+        # `git pull` may land on a newer commit than the payload sha, the
+        # image is cached for the commit actually built
+        commit: str = await self.get_head() if self.sha else ''
+        cache_key: str = self._get_build_cache_key(docker_file_path, commit) if commit else ''
+        if cache_key and commit == self.sha:
+            await prefetcher.wait(self.repository_name, self.sha)
+        if cache_key and await self._tag_cached_image(cache_key):
+            self.report += f"\nСборка: ОК (кэш)"
+            return 0
+        status: int = await self._build_image(docker_file_path)
         if status == 0:
+            if cache_key:
+                await save_cached_build(cache_key, self.image)
             self.report += f"\nСборка: ОК"
             return status
 
-        text = "\nОшибка сборки"
+        text = "\nОшибка сборки" + self._get_error()
         self.report += text
         logger.debug(f"Docker data: \n{self.dict()}")
         raise ContainerBuildError(detail=text)
 
-    def _run_migrations(self) -> int:
+    def _get_build_cache_key(self, path: str, commit: str) -> str:
+        return get_build_cache_key(commit, path)
+
+    async def _tag_cached_image(self, cache_key: str) -> bool:
+        """Re-tag the image built for the same key instead of building"""
+
+        image: str = get_cached_build(cache_key)
+        if not image:
+            return False
+        if image == self.image:
+            return not await self.run_command('docker', 'image', 'inspect', image)
+        return not await self.run_command('docker', 'tag', image, self.image)
+
+    async def _run_migrations(self) -> int:
         logger.info(f"Start migrations container: {self.container}")
-        status = self.run_command(
-            f'cd {self.full_path} '
-            f'&& git checkout {self.branch}'
-            f'&& VERSION="{self.stage}-{self.version}" APPNAME="{self.repository_name.lower()}" docker-compose run --rm app alembic upgrade head'
-        )
+        status = await self._run_once('migrations', 'alembic', 'upgrade', 'head')
         if status == 0:
             self.report += "\nМиграции: ОК"
             return status
 
-        text = "\nОшибка миграций"
+        text = "\nОшибка миграций" + self._get_error()
         self.report += text
         raise MigrationsError(detail=text)
 
-    def _testing_container(self):
+    async def _testing_container(self):
         logger.info(f"Start testing container: {self.container}")
-        status = self.run_command(
-            f'cd {self.full_path} '
-            f'&& git checkout {self.branch}'
-            f'&& VERSION="{self.stage}-{self.version}" APPNAME="{self.repository_name.lower()}" docker-compose run --rm app pytest -k server tests/'
-        )
+        status = await self._run_once('tests', 'pytest', '-k', 'server', 'tests/')
         if status == 0:
             self.report += "\nТесты: ОК"
             return status
 
-        text = "\nОшибка тестирования"
+        text = "\nОшибка тестирования" + self._get_error()
         self.report += text
         raise ContainerTestError(detail=text)
 
-    def _running_container(self):
+    async def _running_container(self):
         logger.info(f"Starting container: {self.container}")
-        status: int = self.run_command(
-            f'cd {self.full_path}'
-            f'&& docker-compose down --remove-orphans'
-            f'&& VERSION="{self.stage}-{self.version}" APPNAME="{self.repository_name.lower()}" docker-compose up -d'
-            f'&& echo --- Done'
-        )
+        config: Optional[BlueGreenConfig] = self._get_blue_green()
+        if config:
+            return await self._switch_blue_green(config)
+        status: int = await self._recreate()
         if status == 0:
             self.report += f"\nРазвертывание: ОК"
             return status
-        text = "\nОшибка развертывания"
+        text = "\nОшибка развертывания" + self._get_error()
         self.report += text
         raise ContainerRunError(detail=text)
 
+    def _get_blue_green(self) -> Optional[BlueGreenConfig]:
+        if not self.options.get('blue_green'):
+            return None
+        text: str = ''
+        if self.options.get('docker_backend', settings.DOCKER_BACKEND) == 'engine':
+            text = "\nBlue/green работает только с docker-compose, docker_backend=engine"
+        else:
+            try:
+                return BlueGreenConfig(**self.options['blue_green'])
+            except ValidationError as err:
+                text = f"\nОшибка настройки blue_green: {err}"
+        self.report += text
+        raise ContainerPrepareError(detail=text)
+
+    def _get_project(self, color: str) -> str:
+        return f"{self.repository_name.lower()}-{self.stage}-{color}"
+
+    async def _switch_blue_green(self, config: BlueGreenConfig) -> int:
+        """Start the other color next to the running one and switch the
+        proxy to it when it is healthy. The running color is not touched
+        until then, so a failed start costs no downtime."""
+
+        active: str = get_active_color(self.path)
+        color: str = get_next_color(active)
+        project: str = self._get_project(color)
+        port: int = config.ports.get(color, 0)
+        status: int = (
+            await self._compose('-p', project, 'down', '--remove-orphans', step='run')
+            or await self._compose(
+                '-p', project, 'up', '-d', step='run', env=dict(APP_PORT=str(port), COLOR=color))
+        )
+        if status or not await self._wait_healthy(project, config, port):
+            await self._compose('-p', project, 'down', '--remove-orphans', step='run')
+            text = f"\nОшибка развертывания: {color} не готов, работает предыдущая версия"
+            self.report += text
+            raise ContainerRunError(detail=text)
+        if not await self._switch_upstream(config, port):
+            await self._compose('-p', project, 'down', '--remove-orphans', step='run')
+            text = f"\nОшибка переключения на {color}, работает предыдущая версия"
+            self.report += text
+            raise ContainerRunError(detail=text)
+        save_active_color(self.path, color, self.image)
+        self.report += f"\nПереключение: {color}"
+        # requests already sent to the old color have to finish
+        await asyncio.sleep(config.drain)
+        if active:
+            await self._compose('-p', self._get_project(active), 'down', '--remove-orphans', step='run')
+        else:
+            # containers started before blue/green was enabled
+            await self._compose('down', '--remove-orphans', step='run')
+        self.report += f"\nРазвертывание: ОК"
+        return 0
+
+    async def _wait_healthy(self, project: str, config: BlueGreenConfig, port: int) -> bool:
+        deadline: float = time.monotonic() + config.health_timeout
+        while True:
+            if await self._is_healthy(project, config, port):
+                return True
+            if time.monotonic() + config.health_interval > deadline:
+                return False
+            await asyncio.sleep(config.health_interval)
+
+    async def _is_healthy(self, project: str, config: BlueGreenConfig, port: int) -> bool:
+        if config.health_url:
+            return await check_url(config.health_url.format(port=port))
+        containers: List[str] = await self.read_command(
+            'docker-compose', '-p', project, 'ps', '-q', cwd=self.full_path, env=self._compose_env())
+        if not containers:
+            return False
+        states: List[str] = await self.read_command(
+            'docker', 'inspect', '--format',
+            '{{if .State.Health}}{{.State.Health.Status}}{{else}}{{.State.Status}}{{end}}',
+            *containers
+        )
+        # containers without a health check are ready when running
+        return bool(states) and all(state in ('healthy', 'running') for state in states)
+
+    async def _switch_upstream(self, config: BlueGreenConfig, port: int) -> bool:
+        """Write the upstream file and reload the proxy, the previous file
+        is restored if the reload fails"""
+
+        previous: Optional[str] = None
+        if os.path.exists(config.upstream_file):
+            with open(config.upstream_file, 'r', encoding='utf-8') as f:
+                previous = f.read()
+        replace_file(config.upstream_file, config.upstream.format(port=port))
+        if not config.reload or not await self.run_command(*config.reload):
+            return True
+        if previous is None:
+            os.remove(config.upstream_file)
+        else:
+            replace_file(config.upstream_file, previous)
+        return False
+
+    async def _get_backend(self) -> str:
+        """'engine' or 'shell' (docker-compose). The Engine API falls back to
+        docker-compose when the daemon socket does not answer."""
+
+        if not self.backend:
+            self.backend = self.options.get('docker_backend', settings.DOCKER_BACKEND)
+            if self.backend == 'engine' and not await docker_engine.available():
+                logger.warning(f"Docker Engine API is not available, using docker-compose: {self.container}")
+                self.backend = 'shell'
+        return self.backend
+
+    async def _build_image(self, path: str) -> int:
+        if await self._get_backend() == 'engine':
+            return await self._engine('build', docker_engine.build, path, self.image)
+        return await self._compose('build', path=path, step='build')
+
+    async def _run_once(self, step: str, *command: str) -> int:
+        """Run a command in a one-off container of the built image"""
+
+        if await self._get_backend() == 'engine':
+            return await self._engine(
+                step, docker_engine.run, self.image, list(command),
+                env=self._get_container_env(), config=self.options.get('engine_container')
+            )
+        return await self._compose('run', '--rm', 'app', *command, step=step)
+
+    async def _recreate(self) -> int:
+        if await self._get_backend() == 'engine':
+            return await self._engine(
+                'run', docker_engine.recreate, f"{self.repository_name.lower()}-{self.stage}",
+                self.image, env=self._get_container_env(), config=self.options.get('engine_container')
+            )
+        return (
+            await self._compose('down', '--remove-orphans', step='run')
+            or await self._compose('up', '-d', step='run')
+        )
+
+    async def _engine(
+            self, step: str, operation: Callable[..., Awaitable[CommandResult]], *args, **kwargs
+    ) -> int:
+        async def call() -> int:
+            with self._open_log(self.path) as log:
+                return self.record(await operation(*args, log=log, **kwargs))
 
-def get_action_payload(data: dict) -> dict:
-    with open('data.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+        return await self._retry_policy(step).call(self, call, f'engine {step}')
+
+    def _get_container_env(self) -> List[str]:
+        """Variables of the application .env file and of compose"""
+
+        env: dict = {}
+        env_file: str = os.path.join(self.full_path, '.env')
+        if os.path.exists(env_file):
+            with open(env_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    name, sep, value = line.strip().partition('=')
+                    if sep and not name.startswith('#'):
+                        env[name.strip()] = value.strip().strip('"\'')
+        env.update(self._compose_env())
+        return [f'{name}={value}' for name, value in env.items()]
+
+    def _get_error(self) -> str:
+        """Daemon error message of the Engine API backend"""
+
+        if self.backend != 'engine' or not self.results or not self.results[-1].tail:
+            return ''
+        return f": {self.results[-1].tail[-1]}"
+
+
+def get_action_payload(data: dict, target: DeployTarget) -> dict:
     if data.get('action') != 'completed':
         logger.info(f'Action: {data.get("action")}')
         return {}
 
-    workflow_job: dict = data.get("workflow_job", {})
+    # workflow_job, or workflow_run of the whole run
+    workflow: dict = data.get("workflow_job") or data.get("workflow_run") or {}
 
-    if workflow_job.get('conclusion') != 'success':
-        logger.info(f'Conclusion: {workflow_job.get("conclusion")}')
-        return {}
-    branch: str = is_branch_valid(data, workflow_job.get('head_branch'))
-    if not branch:
-        logger.info(f'Wrong branch: {workflow_job.get("head_branch")}')
+    if workflow.get('conclusion') != 'success':
+        logger.info(f'Conclusion: {workflow.get("conclusion")}')
         return {}
 
-    stage: str = settings.STAGES[branch]
-
-    repository_name: str = data.get("repository", {}).get("name")
     user: str = data.get("repository", {}).get("owner", {}).get("login").lower()
     ssh_url: str = data.get("repository", {}).get("ssh_url")
 
-    message: str = data.get("head_commit", {}).get("message", '')
+    head_commit: dict = data.get("head_commit") or workflow.get("head_commit") or {}
+    message: str = head_commit.get("message", '')
     do_migration: bool = '__do_migration__' in message
-    version = build = workflow_job.get('head_sha')
+    sha: str = workflow.get('head_sha', '')
+    version = build = sha
     if message:
         version, build = _get_version_and_build(message)
 
-    action_report(data)
-
     return dict(
-        stage=stage,
-        branch=branch,
+        stage=target.stage,
+        branch=target.branch,
         ssh_url=ssh_url,
-        repository_name=repository_name,
+        repository_name=target.repository,
         version=version,
         build=build,
         user=user,
-        do_migration=do_migration
+        do_migration=do_migration,
+        sha=sha
     )
 
 
-def get_not_action_payload(data: dict) -> dict:
-    branch: str = is_branch_valid(data)
-    if not branch:
-        return {}
-    stage: str = settings.STAGES[branch]
+def get_not_action_payload(data: dict, target: DeployTarget) -> dict:
     ssh_url: str = data.get("repository", {}).get("ssh_url", '')
-    repository_name: str = data.get("repository", {}).get("name")
     message: str = data.get("head_commit", {}).get("message", '')
     do_migration: bool = '__do_migration__' in message
     version, build = _get_version_and_build(message)
     user: str = data.get("repository", {}).get("owner", {}).get("name").lower()
     return dict(
-        stage=stage,
-        branch=branch,
+        stage=target.stage,
+        branch=target.branch,
         ssh_url=ssh_url,
-        repository_name=repository_name,
+        repository_name=target.repository,
         version=version,
         build=build,
         user=user,
-        do_migration=do_migration
+        do_migration=do_migration,
+        sha=data.get('after', '')
     )
 
 
-def deploy_or_copy(data: dict) -> None:
-    if data.get('action'):
-        payload = get_action_payload(data)
+def get_payload(data: dict, target: DeployTarget) -> dict:
+    if target.pipeline == 'update':
+        payload = get_update_payload(data, target)
+    elif data.get('action'):
+        payload = get_action_payload(data, target)
         logger.info(f'\n\nPayload with action: {payload} \n\n')
     else:
-        payload = get_not_action_payload(data)
+        payload = get_not_action_payload(data, target)
+    if payload:
+        payload.update(
+            path=target.get_path(payload['user']),
+            pipeline=target.pipeline,
+            options=target.options
+        )
+        logger.info(f"Result: {payload}")
+    return payload
+
+
+async def deploy_payload(
+        payload: dict, is_cancelled: Callable[[], bool] = None, log: JobLog = None, job_id: str = ''
+) -> None:
+    if payload.get('pipeline') == 'clients':
+        return await _create_clients_archive_files(payload=Docker(log=log, **payload))
+    await Docker(is_cancelled=is_cancelled, log=log, job_id=job_id, **payload).deploy()
+
+
+async def run_payload(
+        kind: str,
+        payload: dict,
+        is_cancelled: Callable[[], bool] = None,
+        log: JobLog = None,
+        job_id: str = ''
+) -> None:
+    if kind == 'update':
+        return await update_repository(payload, log=log)
+    if kind == 'rollback' and payload.get('pipeline') == 'clients':
+        return await _revert_clients_release(payload)
+    if kind == 'rollback':
+        return await Docker(log=log, job_id=job_id, **payload).rollback()
+    await deploy_payload(payload, is_cancelled=is_cancelled, log=log, job_id=job_id)
+
+
+def get_rollback_payload(target: DeployTarget, user: str, version: str) -> dict:
+    return dict(
+        stage=target.stage,
+        branch=target.branch,
+        ssh_url='',
+        repository_name=target.repository,
+        version=version,
+        build=version,
+        user=user,
+        path=target.get_path(user),
+        pipeline=target.pipeline,
+        options=target.options
+    )
+
+
+async def get_rollback_versions(target: DeployTarget, user: str) -> List[dict]:
+    """Images of the target stage (releases of client files) available
+    for rollback, newest first"""
+
+    path: str = target.get_path(user)
+    if not os.path.exists(path):
+        return []
+    if target.pipeline == 'clients':
+        store = ArtifactStore(path)
+        current: str = store.get_current(target.repository)
+        return [
+            dict(version=release, current=release == current)
+            for release in store.get_releases(target.repository)
+        ]
+    images: List[ImageInfo] = await ImageGC(path=path).list_images(target.repository.lower())
+    prefix = f'{target.stage}-'
+    return [
+        dict(version=image.tag[len(prefix):], image=image.name, created=image.created)
+        for image in sorted(images or [], key=lambda item: item.created, reverse=True)
+        if image.tag.startswith(prefix)
+    ]
+
+
+async def deploy_or_copy(data: dict) -> None:
+    target: DeployTarget = routing_table.resolve(*get_route_key(data))
+    if not target:
+        return
+    payload = get_payload(data, target)
     if not payload:
         return
-
-    logger.info(f"Result: {payload}")
-    if payload['repository_name'].endswith('_client'):
-        return _create_clients_archive_files(payload=Docker(**payload))
-    Docker(**payload).deploy()
+    await run_payload(target.pipeline, payload)
 
 
-def action_report(data: dict) -> None:
-    workflow_job: dict = data.get('workflow_job')
-    repository_name: str = data.get("repository", {}).get("name")
-    result: str = workflow_job.get("conclusion")
-    branch: str = workflow_job.get('head_branch')
-    head_sha: str = workflow_job.get('head_sha')
-    text = (
-        f"\nAction result: {result}"
-        f"\nRepository: {repository_name}"
-        f"\nBranch: {branch}"
-        f"\nSHA: {head_sha}"
+def get_update_payload(data: dict, target: DeployTarget) -> dict:
+    # only pushes update the service, CI events of its repository are ignored
+    if 'workflow_job' in data or 'workflow_run' in data:
+        logger.info(f"Update skipped for a workflow event: {target.repository}")
+        return {}
+    repository = data['repository']
+    owner: dict = repository.get('owner') or {}
+    return dict(
+        branch=target.branch,
+        repository_name=repository['name'],
+        user=owner.get('login') or owner.get('name')
     )
-    send_message_to_admins(text)
 
 
-def is_branch_valid(data: dict, branch: str = '') -> str:
-    if not branch:
-        branch: str = data.get("ref", '').split('/')[-1]
-    if branch not in settings.STAGES.keys():
-        logger.warning(f'Wrong branch: {branch}')
-        return ''
-    return branch
-
-
-def update_repository(data: dict) -> None:
-    branch: str = is_branch_valid(data)
-    if not branch:
-        return
-    repository = data['repository']
+async def update_repository(payload: dict, log: JobLog = None) -> None:
     git_pull = GitPull(
-        path=str(BASE_DIR),
-        branch=branch,
-        repository_name=repository['name'],
-        user=repository['owner']['name'],
-        full_path=str(BASE_DIR),
-        report=f"Git pull for {repository['name']}"
+        log=log,
+        full_path=payload['path'],
+        report=f"Git pull for {payload['repository_name']}",
+        **payload
     )
-    git_pull.pull_repository()
+    head: str = await git_pull.get_head()
+    await git_pull.pull_repository()
+    # the service runs without the reloader, new code needs a restart
+    if await git_pull.get_head() != head:
+        send_message_to_admins(f"{git_pull.report}\nПерезапуск сервиса")
+        schedule_restart()
 
 
 def _get_version_and_build(message: str) -> Tuple[str, ...]:
@@ -332,37 +713,42 @@ def _get_version_and_build(message: str) -> Tuple[str, ...]:
     return version[0], build[0]
 
 
-def _create_clients_archive_files(payload: Payload) -> None:
-    if payload.repository_name not in settings.CLIENTS:
-        logger.warning(f'Wrong application: {payload.repository_name}')
-        return
-    path = '/home/deskent/deploy/clients'
+async def _create_clients_archive_files(payload: Payload) -> None:
+    path: str = payload.path
     temp_dir = token_urlsafe(20)
     logger.info(f"Copy files for {payload.repository_name}-{payload.stage}-{payload.build}")
-    rep_path = os.path.join(path, payload.repository_name)
     temp_path = os.path.join(path, temp_dir)
-    status: int = os.system(
-        f'echo --- Creating {rep_path} &&'
-        f'mkdir -p {rep_path} &&'
-        f'echo --- Creating {temp_path} &&'
-        f'mkdir {temp_path} &&'
-        f'echo --- Go to {temp_path} &&'
-        f'cd {temp_path} &&'
-        f'echo --- Cloning {payload.ssh_url} branch {payload.branch} to {temp_path} &&'
-        f'git clone {payload.ssh_url} &&'
-        f'echo --- Go to {payload.repository_name} &&'
-        f'cd {payload.repository_name} &&'
-        f'echo --- Checkout to branch {payload.branch} &&'
-        f'git checkout {payload.branch} &&'
-        f'echo --- Copy files &&'
-        f'cp {temp_path}/{payload.repository_name}/archive/*.* {rep_path} &&'
-        f'cp {temp_path}/{payload.repository_name}/README.md {rep_path} &&'
-        f'echo --- Delete temporary {temp_path} &&'
-        f'cd {path} &&'
-        f'rm -rf {temp_dir} &&'
-        f'echo --- Done'
+    os.makedirs(temp_path)
+    mirror = GitMirror(
+        path=path, ssh_url=payload.ssh_url, repository_name=payload.repository_name, log=payload.log)
+    release: str = ''
+    try:
+        status: int = (
+            await mirror.update()
+            or await mirror.extract(
+                payload.sha or f'refs/heads/{payload.branch}', temp_path, 'archive', 'README.md')
+        )
+        if not status:
+            files: List[str] = glob.glob(os.path.join(temp_path, 'archive', '*.*'))
+            if os.path.exists(os.path.join(temp_path, 'README.md')):
+                files.append(os.path.join(temp_path, 'README.md'))
+            store = ArtifactStore(path, keep=settings.CLIENTS_RELEASES_KEEP)
+            # objects of the store are shared by all targets of the clients directory
+            async with get_lock('clients', path):
+                try:
+                    release = await asyncio.get_event_loop().run_in_executor(
+                        None, store.publish, payload.repository_name, files,
+                        get_release_name(payload.build)
+                    )
+                except OSError as err:
+                    logger.exception(f"Publishing error: {err}")
+                    status = 1
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+    text = (
+        f"Файлы {payload.repository_name}-{payload.stage}-{payload.build} опубликованы"
+        f"\nРелиз: {release}"
     )
-    text = f"Файлы {payload.repository_name}-{payload.stage}-{payload.build} скопированы"
     if status:
         text = (
             f"Ошибка копирования {payload.repository_name}-{payload.stage}-{payload.build}."
@@ -370,3 +756,19 @@ def _create_clients_archive_files(payload: Payload) -> None:
             f"\nBuild: {payload.build}"
         )
     send_message_to_admins(text)
+
+
+async def _revert_clients_release(payload: dict) -> None:
+    """Switch the client files back to the release `version`, to the
+    previous release when it is empty"""
+
+    name: str = f"{payload['repository_name']}-{payload['stage']}"
+    store = ArtifactStore(payload['path'], keep=settings.CLIENTS_RELEASES_KEEP)
+    async with get_lock('clients', payload['path']):
+        release: str = await asyncio.get_event_loop().run_in_executor(
+            None, store.revert, payload['repository_name'], payload['version'])
+    if not release:
+        text = f"Релиз {payload['version']} файлов {name} не найден"
+        send_message_to_admins(text)
+        raise ContainerRunError(detail=text)
+    send_message_to_admins(f"Файлы {name}: откат на релиз {release}")
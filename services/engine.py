@@ -0,0 +1,281 @@
+import asyncio
+import fnmatch
+import io
+import json
+import os
+import tarfile
+import time
+from collections import deque
+from typing import IO, AsyncIterator, Awaitable, Callable, Deque, List, Optional, Tuple
+
+import httpx
+
+from config import settings
+from services.executor import CommandResult
+
+
+class EngineError(Exception):
+    """Error answer of the Docker daemon"""
+
+
+class EngineOutput:
+    """Writes daemon messages to the job log and keeps the last lines"""
+
+    def __init__(self, log: IO, tail_size: int):
+        self.log: IO = log
+        self.tail: Deque[str] = deque(maxlen=tail_size)
+
+    def write(self, text: str) -> None:
+        for line in text.splitlines():
+            if line.strip():
+                self.log.write(f'{line}\n')
+                self.tail.append(line)
+        self.log.flush()
+
+
+def make_build_context(path: str) -> bytes:
+    """Tar of the build directory without .git and .dockerignore patterns.
+
+    As in Docker, the last pattern matching a file wins and `!pattern`
+    brings back files excluded by the patterns before it.
+    """
+
+    patterns: List[Tuple[str, bool]] = [('.git', False)]
+    dockerignore: str = os.path.join(path, '.dockerignore')
+    if os.path.exists(dockerignore):
+        with open(dockerignore, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                negated: bool = line.startswith('!')
+                pattern: str = line[1:].strip().strip('/') if negated else line.strip('/')
+                if pattern:
+                    patterns.append((pattern, negated))
+    # an excluded directory may hold files brought back by `!` patterns
+    has_exceptions: bool = any(negated for _, negated in patterns)
+
+    def ignored(name: str) -> bool:
+        result: bool = False
+        for pattern, negated in patterns:
+            if fnmatch.fnmatch(name, pattern) or name.startswith(f'{pattern}/'):
+                result = not negated
+        return result
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for root, dirs, files in os.walk(path):
+            relative: str = os.path.relpath(root, path)
+            if not has_exceptions:
+                dirs[:] = [
+                    name for name in dirs
+                    if not ignored(os.path.normpath(os.path.join(relative, name)))
+                ]
+            for name in files:
+                name = os.path.normpath(os.path.join(relative, name))
+                if not ignored(name):
+                    tar.add(os.path.join(path, name), arcname=name, recursive=False)
+    return buffer.getvalue()
+
+
+async def read_frames(response: httpx.Response) -> AsyncIterator[Tuple[int, bytes]]:
+    """(stream, data) frames of a multiplexed container output"""
+
+    buffer: bytes = b''
+    async for chunk in response.aiter_bytes():
+        buffer += chunk
+        while len(buffer) >= 8:
+            size: int = int.from_bytes(buffer[4:8], 'big')
+            if len(buffer) < 8 + size:
+                break
+            yield buffer[0], buffer[8:8 + size]
+            buffer = buffer[8 + size:]
+
+
+class DockerEngine:
+    """Docker Engine API client over the daemon unix socket.
+
+    All deploys share one pooled connection. Operations return a
+    CommandResult like the docker-compose commands do: daemon progress and
+    errors go to the job log and the result tail, so logs, metrics and
+    retries work the same way for both backends.
+    """
+
+    def __init__(
+            self,
+            socket: str = '/var/run/docker.sock',
+            api_version: str = 'v1.41',
+            timeout: float = 1800,
+            tail_size: int = 50,
+            transport: httpx.AsyncBaseTransport = None
+    ):
+        self._socket: str = socket
+        self._api_version: str = api_version
+        self._timeout: float = timeout
+        self._tail_size: int = tail_size
+        self._transport: httpx.AsyncBaseTransport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def available(self) -> bool:
+        if self._transport is None and not os.path.exists(self._socket):
+            return False
+        try:
+            response: httpx.Response = await self._get_client().get('/_ping')
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    async def close(self) -> None:
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    async def build(
+            self, path: str, tag: str, log: IO, dockerfile: str = 'Dockerfile', build_args: dict = None
+    ) -> CommandResult:
+        """Build the image with progress streamed to the log"""
+
+        async def build(output: EngineOutput) -> int:
+            context: bytes = await asyncio.get_event_loop().run_in_executor(
+                None, make_build_context, path)
+            params: dict = dict(t=tag, dockerfile=dockerfile, rm=1, forcerm=1)
+            if build_args:
+                params.update(buildargs=json.dumps(build_args))
+            error: str = ''
+            async with self._get_client().stream(
+                    'POST', '/build', params=params, content=context,
+                    headers={'Content-Type': 'application/x-tar'}
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise EngineError(self._get_message(response))
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    item: dict = json.loads(line)
+                    if item.get('error'):
+                        error = item['error']
+                        output.write(error)
+                    elif item.get('stream'):
+                        output.write(item['stream'])
+                    elif item.get('status'):
+                        prefix: str = f"{item['id']}: " if item.get('id') else ''
+                        output.write(f"{prefix}{item['status']} {item.get('progress', '')}")
+            return 1 if error else 0
+
+        return await self._execute(['engine', 'build', tag], log, build)
+
+    async def run(
+            self, image: str, command: List[str], log: IO, env: List[str] = None, config: dict = None
+    ) -> CommandResult:
+        """One-off container, removed when it exits. Ports of `config` are
+        not published, the service may be running."""
+
+        config = {key: value for key, value in (config or {}).items() if key != 'ExposedPorts'}
+        host_config: dict = {
+            key: value for key, value in (config.get('HostConfig') or {}).items()
+            if key not in ('PortBindings', 'RestartPolicy')
+        }
+
+        async def run(output: EngineOutput) -> int:
+            container_id: str = await self._create(
+                dict(config, Image=image, Cmd=command, Env=env or [], HostConfig=host_config))
+            try:
+                await self._request('POST', f'/containers/{container_id}/start', expected=(204, 304))
+                async with self._get_client().stream(
+                        'GET', f'/containers/{container_id}/logs',
+                        params=dict(follow=1, stdout=1, stderr=1)
+                ) as response:
+                    async for _, data in read_frames(response):
+                        output.write(data.decode('utf-8', errors='replace'))
+                answer: httpx.Response = await self._request(
+                    'POST', f'/containers/{container_id}/wait')
+                return answer.json().get('StatusCode', 1)
+            finally:
+                await self._remove(container_id)
+
+        return await self._execute(['engine', 'run', image, *command], log, run)
+
+    async def recreate(
+            self, name: str, image: str, log: IO, env: List[str] = None, config: dict = None
+    ) -> CommandResult:
+        """Replace the service container `name` with a new one of `image`"""
+
+        config = dict(config or {})
+        config['HostConfig'] = {
+            'RestartPolicy': {'Name': 'unless-stopped'}, **(config.get('HostConfig') or {})}
+
+        async def recreate(output: EngineOutput) -> int:
+            await self._remove(name)
+            container_id: str = await self._create(dict(config, Image=image, Env=env or []), name=name)
+            await self._request('POST', f'/containers/{container_id}/start', expected=(204, 304))
+            output.write(f"Container {name} started: {container_id[:12]}")
+            return 0
+
+        return await self._execute(['engine', 'recreate', name, image], log, recreate)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                transport=self._transport or httpx.AsyncHTTPTransport(uds=self._socket),
+                base_url=f'http://docker/{self._api_version}',
+                timeout=httpx.Timeout(self._timeout, connect=10)
+            )
+        return self._client
+
+    async def _execute(
+            self, command: List[str], log: IO, operation: Callable[[EngineOutput], Awaitable[int]]
+    ) -> CommandResult:
+        started: float = time.monotonic()
+        output = EngineOutput(log, self._tail_size)
+        log.write(f"$ {' '.join(command)}\n")
+        timed_out: bool = False
+        try:
+            returncode: int = await operation(output)
+        except httpx.TimeoutException as err:
+            timed_out = True
+            returncode = 1
+            output.write(f"Docker Engine timeout: {err!r}")
+        except (httpx.HTTPError, EngineError, ValueError) as err:
+            returncode = 1
+            output.write(f"Docker Engine error: {err}")
+        return CommandResult(
+            command=command,
+            returncode=returncode,
+            duration=time.monotonic() - started,
+            timed_out=timed_out,
+            tail=list(output.tail)
+        )
+
+    async def _request(
+            self, method: str, url: str, expected: Tuple[int, ...] = (200,), **kwargs
+    ) -> httpx.Response:
+        response: httpx.Response = await self._get_client().request(method, url, **kwargs)
+        if response.status_code not in expected:
+            raise EngineError(self._get_message(response))
+        return response
+
+    async def _create(self, body: dict, name: str = None) -> str:
+        response: httpx.Response = await self._request(
+            'POST', '/containers/create', expected=(201,),
+            params=dict(name=name) if name else None, json=body
+        )
+        return response.json()['Id']
+
+    async def _remove(self, container: str) -> None:
+        await self._request(
+            'DELETE', f'/containers/{container}', expected=(204, 404), params=dict(force=1))
+
+    @staticmethod
+    def _get_message(response: httpx.Response) -> str:
+        try:
+            return response.json().get('message') or response.text
+        except ValueError:
+            return f"{response.status_code} {response.text}"
+
+
+docker_engine = DockerEngine(
+    socket=settings.DOCKER_SOCKET,
+    api_version=settings.DOCKER_API_VERSION,
+    timeout=settings.COMMAND_TIMEOUT
+)
@@ -52,3 +52,16 @@ class MigrationsError(HTTPException):
     def __init__(self, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                  detail='Container migrations error'):
         super().__init__(status_code=status_code, detail=detail)
+
+
+class DeployCancelledError(HTTPException):
+    def __init__(self, status_code=status.HTTP_409_CONFLICT,
+                 detail='Deploy cancelled'):
+        super().__init__(status_code=status_code, detail=detail)
+
+
+class AdmissionError(HTTPException):
+    def __init__(self, status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                 detail='Service overloaded', retry_after: int = 10):
+        super().__init__(
+            status_code=status_code, detail=detail, headers={'Retry-After': str(retry_after)})
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import IO, List, Optional
+
+from pydantic import BaseModel
+
+from config import logger, settings
+from services.job_logs import JobLog
+from services.metrics import COMMAND_DURATION
+
+
+class CommandResult(BaseModel):
+    command: List[str]
+    returncode: int
+    duration: float
+    timed_out: bool = False
+    output: List[str] = []
+    tail: List[str] = []
+
+
+class CommandExecutor(BaseModel):
+    """Runs commands without a shell and streams their output line by line
+    to the job `log`, or to `{path}/subprocess.log` outside of jobs. The
+    last `tail_size` lines of both streams are kept in the result for
+    failure classification. The job log writes in batches by itself, so
+    lines are not flushed one by one."""
+
+    path: str = None
+    timeout: float = settings.COMMAND_TIMEOUT
+    tail_size: int = 50
+    results: List[CommandResult] = []
+    log: JobLog = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    async def run_command(
+            self,
+            *command: str,
+            cwd: str = None,
+            env: dict = None,
+            timeout: float = None,
+            path: str = None,
+            capture: bool = False
+    ) -> int:
+        """Run command, return its exit code. With `capture` stdout lines
+        are also kept in the result's `output`"""
+
+        if not path:
+            path = self.path
+        if timeout is None:
+            timeout = self.timeout
+        if env:
+            env = {**os.environ, **env}
+        started: float = time.monotonic()
+        timed_out = False
+        output: Optional[List[str]] = [] if capture else None
+        tail: deque = deque(maxlen=self.tail_size)
+        with self._open_log(path) as log:
+            log.write(f"$ {' '.join(command)}\n")
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    cwd=cwd,
+                    env=env,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    limit=2 ** 20
+                )
+            except OSError as err:
+                log.write(f"{err}\n")
+                returncode = 127
+            else:
+                try:
+                    returncode = await asyncio.wait_for(
+                        self._communicate(process, log, output, tail), timeout=timeout)
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    returncode = await self._kill(process)
+                    log.write(f"Timeout {timeout}s exceeded\n")
+                except asyncio.CancelledError:
+                    await self._kill(process)
+                    raise
+        result = CommandResult(
+            command=list(command),
+            returncode=returncode,
+            duration=time.monotonic() - started,
+            timed_out=timed_out,
+            output=output or [],
+            tail=list(tail)
+        )
+        return self.record(result)
+
+    def record(self, result: CommandResult) -> int:
+        """Keep the result of a command run by this executor or for it"""
+
+        self.results.append(result)
+        COMMAND_DURATION.observe(
+            result.duration, os.path.basename(result.command[0]),
+            'timeout' if result.timed_out else 'error' if result.returncode else 'ok'
+        )
+        if result.returncode:
+            logger.error(result)
+        else:
+            logger.debug(result)
+        return result.returncode
+
+    async def read_command(self, *command: str, **kwargs) -> Optional[List[str]]:
+        """Stdout lines of the command or None if it failed"""
+
+        if await self.run_command(*command, capture=True, **kwargs):
+            return None
+        return self.results[-1].output
+
+    def _open_log(self, path: str):
+        if self.log:
+            return nullcontext(self.log)
+        return open(f'{path}/subprocess.log', 'a', encoding='utf-8')
+
+    async def _communicate(
+            self,
+            process: 'asyncio.subprocess.Process',
+            log: IO,
+            output: List[str] = None,
+            tail: deque = None
+    ) -> int:
+        await asyncio.gather(
+            self._stream(process.stdout, log, output, tail),
+            self._stream(process.stderr, log, tail=tail)
+        )
+        return await process.wait()
+
+    @staticmethod
+    async def _stream(
+            stream: asyncio.StreamReader, log: IO, output: List[str] = None, tail: deque = None
+    ) -> None:
+        async for line in stream:
+            text: str = line.decode('utf-8', errors='replace')
+            log.write(text)
+            if output is not None:
+                output.append(text.rstrip('\n'))
+            if tail is not None:
+                tail.append(text.rstrip('\n'))
+
+    @staticmethod
+    async def _kill(process: 'asyncio.subprocess.Process') -> int:
+        if process.returncode is None:
+            process.kill()
+        return await process.wait()
@@ -0,0 +1,195 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import re
+import time
+from typing import Dict, List, Optional, Set
+
+from pydantic import BaseModel
+
+from config import logger, settings
+from services.executor import CommandExecutor
+from services.locks import FileLock, get_lock
+from services.metrics import STAGE_DURATION
+from services.utils import load_json, save_json
+
+
+_tasks: Set[asyncio.Future] = set()
+_SIZE_UNITS: Dict[str, int] = {'B': 1, 'KB': 10 ** 3, 'MB': 10 ** 6, 'GB': 10 ** 9, 'TB': 10 ** 12}
+
+
+class ImageInfo(BaseModel):
+    repository: str
+    tag: str
+    id: str
+    created: float
+    size: int
+    last_used: float = 0
+
+    @property
+    def name(self) -> str:
+        return f'{self.repository}:{self.tag}'
+
+    @property
+    def stage(self) -> str:
+        return self.tag.split('-', 1)[0]
+
+
+def parse_size(size: str) -> int:
+    match = re.match(r'([\d.]+)\s*([KMGT]?B)', size.upper())
+    if not match:
+        return 0
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def _get_state_lock(path: str) -> FileLock:
+    """Lock for read-modify-write of the state file, shared by workers"""
+
+    return get_lock('state', os.path.basename(path))
+
+
+async def touch_image(name: str) -> None:
+    """Remember that image `repository:tag` has just been used"""
+
+    if not settings.IMAGES_STATE_FILE:
+        return
+    async with _get_state_lock(settings.IMAGES_STATE_FILE):
+        state: dict = load_json(settings.IMAGES_STATE_FILE, {})
+        state[name] = time.time()
+        save_json(settings.IMAGES_STATE_FILE, state)
+
+
+def get_build_cache_key(sha: str, path: str) -> str:
+    """Commit sha plus hashes of Dockerfile, compose file and the `.env`
+    copied into `path`: the `.env` is a part of the build context"""
+
+    digest = hashlib.sha256(sha.encode())
+    for name in ('Dockerfile', 'docker-compose.yml', 'docker-compose.yaml', '.env'):
+        file_path: str = os.path.join(path, name)
+        if os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                digest.update(name.encode())
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def get_cached_build(key: str) -> str:
+    """Image built earlier for the build cache key"""
+
+    return load_json(settings.BUILD_CACHE_FILE, {}).get(key, '')
+
+
+async def save_cached_build(key: str, image: str) -> None:
+    if not settings.BUILD_CACHE_FILE:
+        return
+    async with _get_state_lock(settings.BUILD_CACHE_FILE):
+        cache: dict = load_json(settings.BUILD_CACHE_FILE, {})
+        cache.pop(key, None)
+        cache[key] = image
+        save_json(
+            settings.BUILD_CACHE_FILE, dict(list(cache.items())[-settings.BUILD_CACHE_SIZE:]))
+
+
+async def forget_cached_build(image: str) -> None:
+    """Drop build cache entries pointing to the image"""
+
+    if not settings.BUILD_CACHE_FILE:
+        return
+    async with _get_state_lock(settings.BUILD_CACHE_FILE):
+        cache: dict = load_json(settings.BUILD_CACHE_FILE, {})
+        save_json(
+            settings.BUILD_CACHE_FILE,
+            {key: value for key, value in cache.items() if value != image}
+        )
+
+
+class ImageGC(CommandExecutor):
+    """Removes old images of one application.
+
+    The last `keep` images of every stage and images used by containers
+    are kept. The rest are removed least recently used first, until the
+    application images fit into `disk_budget` bytes (0 - remove all of them).
+    Only images of the application repository are touched, so base images
+    and their layers stay in cache.
+    """
+
+    keep: int = settings.IMAGES_KEEP
+    disk_budget: int = settings.IMAGES_DISK_BUDGET_MB * 10 ** 6
+
+    async def list_images(self, repository: str) -> Optional[List[ImageInfo]]:
+        lines: List[str] = await self.read_command(
+            'docker', 'image', 'ls', repository,
+            '--format', '{{.Repository}}\t{{.Tag}}\t{{.ID}}\t{{.CreatedAt}}\t{{.Size}}'
+        )
+        if lines is None:
+            return None
+        state: dict = load_json(settings.IMAGES_STATE_FILE, {})
+        images: List[ImageInfo] = []
+        for line in lines:
+            try:
+                name, tag, image_id, created, size = line.split('\t')
+                created_at: float = datetime.datetime.strptime(
+                    created[:19], '%Y-%m-%d %H:%M:%S').timestamp()
+            except ValueError:
+                continue
+            if tag == '<none>':
+                continue
+            images.append(ImageInfo(
+                repository=name, tag=tag, id=image_id, created=created_at,
+                size=parse_size(size), last_used=state.get(f'{name}:{tag}', created_at)
+            ))
+        return images
+
+    async def used_images(self) -> Optional[Set[str]]:
+        lines: List[str] = await self.read_command('docker', 'ps', '-a', '--format', '{{.Image}}')
+        return None if lines is None else set(lines)
+
+    def select(self, images: List[ImageInfo], used: Set[str]) -> List[ImageInfo]:
+        """Images to remove"""
+
+        stages: Dict[str, List[ImageInfo]] = {}
+        for image in sorted(images, key=lambda item: item.last_used, reverse=True):
+            stages.setdefault(image.stage, []).append(image)
+        candidates: List[ImageInfo] = [
+            image
+            for stage_images in stages.values()
+            for image in stage_images[self.keep:]
+            if image.name not in used and image.id not in used
+        ]
+        total: int = sum(image.size for image in images)
+        evicted: List[ImageInfo] = []
+        for image in sorted(candidates, key=lambda item: item.last_used):
+            if self.disk_budget and total <= self.disk_budget:
+                break
+            evicted.append(image)
+            total -= image.size
+        return evicted
+
+    async def collect(self, repository: str) -> List[str]:
+        images: List[ImageInfo] = await self.list_images(repository)
+        used: Set[str] = await self.used_images()
+        if images is None or used is None:
+            return []
+        removed: List[str] = []
+        for image in self.select(images, used):
+            if not await self.run_command('docker', 'rmi', image.name):
+                removed.append(image.name)
+        if removed:
+            logger.info(f"Images removed: {removed}")
+        return removed
+
+
+def schedule_image_gc(repository: str, path: str, stage: str = '') -> None:
+    """Collect images of the repository in background"""
+
+    async def collect() -> None:
+        try:
+            with STAGE_DURATION.time(repository, stage, 'cleanup'):
+                await ImageGC(path=path).collect(repository)
+        except Exception as err:
+            logger.exception(f"Image GC error: {err}")
+
+    task = asyncio.ensure_future(collect())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
@@ -0,0 +1,266 @@
+import asyncio
+import glob
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from config import logger, settings
+
+
+class JobLog:
+    """Buffered log of one job.
+
+    `write` only appends to memory, the buffer is written to the file in a
+    thread every `flush_interval` seconds or when it grows over
+    `buffer_size`. When the file exceeds `max_bytes` it is rotated to
+    `.1`, `.2` ... and only `backups` old parts are kept.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            max_bytes: int = 10 * 2 ** 20,
+            backups: int = 1,
+            flush_interval: float = 0.5,
+            buffer_size: int = 2 ** 16
+    ):
+        self.path: str = path
+        self.closed: bool = False
+        self._max_bytes: int = max_bytes
+        self._backups: int = backups
+        self._flush_interval: float = flush_interval
+        self._buffer_size: int = buffer_size
+        self._buffer: List[str] = []
+        self._buffered: int = 0
+        self._lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    def write(self, text: str) -> None:
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self._buffer_size:
+            asyncio.ensure_future(self.flush_buffer())
+
+    def flush(self) -> None:
+        """File object compatibility, flushing happens in background"""
+
+    async def flush_buffer(self) -> None:
+        async with self._lock:
+            if not self._buffer:
+                return
+            data: str = ''.join(self._buffer)
+            self._buffer, self._buffered = [], 0
+            await asyncio.get_event_loop().run_in_executor(None, self._write_file, data)
+        self._notify()
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush_buffer()
+        self.closed = True
+        self._notify()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait until new data is written or the log is closed"""
+
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush_buffer()
+
+    def _write_file(self, data: str) -> None:
+        encoded: bytes = data.encode('utf-8')
+        try:
+            size: int = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size and size + len(encoded) > self._max_bytes:
+            self._rotate()
+        with open(self.path, 'ab') as f:
+            f.write(encoded)
+
+    def _rotate(self) -> None:
+        for number in range(self._backups, 0, -1):
+            source: str = f'{self.path}.{number - 1}' if number > 1 else self.path
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{number}')
+        if not self._backups:
+            os.remove(self.path)
+
+
+class JobLogStore:
+    """Directory with logs of the last `keep` jobs"""
+
+    def __init__(
+            self,
+            path: str,
+            keep: int = 200,
+            max_bytes: int = 10 * 2 ** 20,
+            backups: int = 1,
+            chunk_size: int = 2 ** 16
+    ):
+        self._path: str = path
+        self._keep: int = keep
+        self._max_bytes: int = max_bytes
+        self._backups: int = backups
+        self._chunk_size: int = chunk_size
+        self._active: Dict[str, JobLog] = {}
+
+    def get_path(self, job_id: str) -> str:
+        return os.path.join(self._path, f'{os.path.basename(job_id)}.log')
+
+    def exists(self, job_id: str) -> bool:
+        return job_id in self._active or os.path.exists(self.get_path(job_id))
+
+    def open(self, job_id: str) -> JobLog:
+        os.makedirs(self._path, exist_ok=True)
+        log = JobLog(self.get_path(job_id), max_bytes=self._max_bytes, backups=self._backups)
+        self._active[job_id] = log
+        log.start()
+        self._prune()
+        return log
+
+    async def close(self, job_id: str) -> None:
+        log: JobLog = self._active.pop(job_id, None)
+        if log:
+            await log.close()
+
+    def get_size(self, job_id: str) -> int:
+        try:
+            return os.path.getsize(self.get_path(job_id))
+        except OSError:
+            return 0
+
+    async def read(self, job_id: str, start: int = 0, end: int = None) -> AsyncIterator[bytes]:
+        """Chunks of bytes start..end (inclusive) of the log"""
+
+        loop = asyncio.get_event_loop()
+        with open(self.get_path(job_id), 'rb') as f:
+            f.seek(start)
+            left: Optional[int] = None if end is None else end - start + 1
+            while left is None or left > 0:
+                size: int = self._chunk_size if left is None else min(self._chunk_size, left)
+                chunk: bytes = await loop.run_in_executor(None, f.read, size)
+                if not chunk:
+                    break
+                if left is not None:
+                    left -= len(chunk)
+                yield chunk
+
+    async def follow(
+            self,
+            job_id: str,
+            offset: int = 0,
+            keepalive: float = 15,
+            is_active: Callable[[], bool] = None,
+            poll_interval: float = 1
+    ) -> AsyncIterator[Tuple[int, List[str]]]:
+        """Complete lines appended to the log after `offset` until the job
+        is finished. Yields (new offset, lines), empty lines list on
+        keepalive timeouts. The log of a job running in another worker is
+        polled while `is_active` is true. When the log is rotated, the rest
+        of the `.1` part is read before the new file; offsets start from 0
+        in the new file."""
+
+        path: str = self.get_path(job_id)
+        loop = asyncio.get_event_loop()
+        waited: float = 0
+        inode: Optional[int] = None
+        while True:
+            log: JobLog = self._active.get(job_id)
+            if log is not None:
+                finished: bool = log.closed
+            else:
+                finished = not (is_active and is_active())
+            data, inode = await loop.run_in_executor(None, self._read_from, path, offset, inode)
+            if data is None:
+                rest: bytes = await loop.run_in_executor(
+                    None, self._read_rotated, path, offset, inode)
+                offset, inode = 0, None
+                if rest:
+                    yield offset, rest.decode('utf-8', errors='replace').splitlines()
+                continue
+            lines_end: int = data.rfind(b'\n') + 1
+            if not lines_end and (len(data) >= self._chunk_size or finished):
+                lines_end = len(data)
+            if lines_end:
+                offset += lines_end
+                waited = 0
+                text: str = data[:lines_end].decode('utf-8', errors='replace')
+                yield offset, text.splitlines()
+                continue
+            if finished:
+                return
+            if log is not None:
+                if not await log.wait(keepalive):
+                    yield offset, []
+                continue
+            await asyncio.sleep(poll_interval)
+            waited += poll_interval
+            if waited >= keepalive:
+                waited = 0
+                yield offset, []
+
+    def _read_from(
+            self, path: str, offset: int, inode: Optional[int]
+    ) -> Tuple[Optional[bytes], Optional[int]]:
+        """Data after `offset` and the inode of the file, None data when
+        the file read before (`inode`) has been rotated"""
+
+        try:
+            with open(path, 'rb') as f:
+                stat: os.stat_result = os.fstat(f.fileno())
+                if inode is not None and stat.st_ino != inode or stat.st_size < offset:
+                    return None, inode
+                f.seek(offset)
+                return f.read(self._chunk_size), stat.st_ino
+        except FileNotFoundError:
+            return b'', inode
+
+    def _read_rotated(self, path: str, offset: int, inode: Optional[int]) -> bytes:
+        """The rest of the rotated part after `offset`, if it is the file
+        read before"""
+
+        try:
+            with open(f'{path}.1', 'rb') as f:
+                if inode is None or os.fstat(f.fileno()).st_ino != inode:
+                    return b''
+                f.seek(offset)
+                return f.read()
+        except FileNotFoundError:
+            return b''
+
+    def _prune(self) -> None:
+        active: set = {log.path for log in self._active.values()}
+        files: List[str] = sorted(
+            (path for path in glob.glob(os.path.join(self._path, '*.log')) if path not in active),
+            key=os.path.getmtime
+        )
+        for path in files[:max(len(files) + len(active) - self._keep, 0)]:
+            for name in glob.glob(f'{path}*'):
+                try:
+                    os.remove(name)
+                except OSError as err:
+                    logger.warning(f"Job log removing error: {err}")
+
+
+job_logs = JobLogStore(
+    path=settings.JOB_LOGS_DIR,
+    keep=settings.JOB_LOGS_KEEP,
+    max_bytes=settings.JOB_LOG_MAX_BYTES,
+    backups=settings.JOB_LOG_BACKUPS
+)
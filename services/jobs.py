@@ -0,0 +1,284 @@
+import asyncio
+import datetime
+import json
+import threading
+from collections import OrderedDict, deque
+from enum import Enum
+from secrets import token_hex
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from config import logger, settings
+from services.deploy import get_payload, run_payload
+from services.exceptions import DeployCancelledError
+from services.job_logs import JobLog, job_logs
+from services.ledger import ledger
+from services.locks import FileLock, get_lock
+from services.metrics import register_gauge
+from services.routing import DeployTarget
+from services.utils import send_message_to_admins
+
+
+class JobStatus(str, Enum):
+    queued = 'queued'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+    superseded = 'superseded'
+    cancelled = 'cancelled'
+
+
+class DeployJob(BaseModel):
+    id: str = Field(default_factory=lambda: token_hex(8))
+    kind: str = 'deploy'
+    repository_name: str
+    stage: str
+    payload: dict = {}
+    status: JobStatus = JobStatus.queued
+    error: str = ''
+    superseded_by: str = ''
+    created: datetime.datetime = Field(default_factory=datetime.datetime.now)
+    started: Optional[datetime.datetime] = None
+    finished: Optional[datetime.datetime] = None
+    _cancel: threading.Event = PrivateAttr(default_factory=threading.Event)
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.repository_name, self.stage
+
+    def supersede(self, job: 'DeployJob') -> None:
+        """Mark job as replaced by the newer one for the same key"""
+
+        self.superseded_by = job.id
+        if self.status == JobStatus.queued:
+            self.status = JobStatus.superseded
+            self.finished = datetime.datetime.now()
+        else:
+            self._cancel.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def info(self) -> dict:
+        return self.dict(exclude={'payload'})
+
+
+class JobQueue:
+    """In-process deploy queue.
+
+    Jobs with the same (repository_name, stage) run one after another,
+    different keys run in parallel, but no more than `max_parallel` at once.
+    A new job replaces not yet started jobs with the same key, and with
+    `supersede_running` also asks the running one to stop at the next
+    stage boundary. `listener` is called on every job status change.
+    Only jobs of this worker process are replaced, jobs of other workers
+    wait for the deploy lock of the same key.
+    """
+
+    def __init__(
+            self,
+            runner: Callable[[DeployJob], Awaitable[None]],
+            max_parallel: int = 1,
+            history: int = 100,
+            supersede_running: bool = False,
+            listener: Callable[[DeployJob], None] = None
+    ):
+        self._runner = runner
+        self._listener = listener
+        self._max_parallel: int = max(max_parallel, 1)
+        self._supersede_running: bool = supersede_running
+        self._history: int = history
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending: Dict[Tuple[str, str], Deque[DeployJob]] = {}
+        self._active: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._running: Dict[Tuple[str, str], DeployJob] = {}
+        self._jobs: 'OrderedDict[str, DeployJob]' = OrderedDict()
+
+    def submit(self, job: DeployJob) -> DeployJob:
+        self._remember(job)
+        pending: Deque[DeployJob] = self._pending.setdefault(job.key, deque())
+        while pending:
+            old_job: DeployJob = pending.popleft()
+            old_job.supersede(job)
+            self._notify(old_job)
+            logger.info(f"Job {old_job.id} superseded by {job.id}")
+        running: DeployJob = self._running.get(job.key)
+        if running and self._supersede_running:
+            running.supersede(job)
+            logger.info(f"Job {running.id} will be cancelled for {job.id}")
+        pending.append(job)
+        self._notify(job)
+        if job.key not in self._active:
+            self._active[job.key] = asyncio.ensure_future(self._drain(job.key))
+        logger.info(f"Job {job.id} queued: {job.key}")
+        return job
+
+    def get(self, job_id: str) -> Optional[DeployJob]:
+        return self._jobs.get(job_id)
+
+    @property
+    def depth(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    @property
+    def idle(self) -> bool:
+        """No job is queued or running"""
+
+        return not self._active
+
+    async def stop(self) -> None:
+        tasks = list(self._active.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _notify(self, job: DeployJob) -> None:
+        if self._listener:
+            self._listener(job)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_parallel)
+        return self._semaphore
+
+    def _remember(self, job: DeployJob) -> None:
+        self._jobs[job.id] = job
+        while len(self._jobs) > self._history:
+            self._jobs.popitem(last=False)
+
+    async def _drain(self, key: Tuple[str, str]) -> None:
+        try:
+            while True:
+                async with self._get_semaphore():
+                    pending: Deque[DeployJob] = self._pending.get(key)
+                    if not pending:
+                        break
+                    await self._run(pending.popleft())
+        finally:
+            if not self._pending.get(key):
+                self._pending.pop(key, None)
+            self._active.pop(key, None)
+
+    async def _run(self, job: DeployJob) -> None:
+        job.status = JobStatus.running
+        job.started = datetime.datetime.now()
+        self._running[job.key] = job
+        self._notify(job)
+        logger.info(f"Job {job.id} started: {job.key}")
+        try:
+            await self._runner(job)
+            job.status = JobStatus.done
+        except DeployCancelledError:
+            job.status = JobStatus.cancelled
+        except Exception as err:
+            job.status = JobStatus.failed
+            job.error = str(getattr(err, 'detail', '') or err)
+            logger.exception(f"Job {job.id} failed: {job.error}")
+        finally:
+            job.finished = datetime.datetime.now()
+            self._running.pop(job.key, None)
+        self._notify(job)
+        logger.info(f"Job {job.id} {job.status.value}: {job.key}")
+
+
+async def run_job(job: DeployJob) -> None:
+    # other workers may deploy the same target
+    async with get_lock('deploy', '-'.join(job.key)):
+        log: JobLog = job_logs.open(job.id)
+        try:
+            await run_payload(
+                job.kind, job.payload, is_cancelled=job.is_cancelled, log=log, job_id=job.id)
+        finally:
+            await job_logs.close(job.id)
+
+
+def submit_payload(data: dict, target: DeployTarget) -> Optional[DeployJob]:
+    """Queue deploy of the webhook data to the target"""
+
+    payload: dict = get_payload(data, target)
+    if not payload:
+        return None
+    return job_queue.submit(
+        DeployJob(
+            kind=target.pipeline,
+            repository_name=target.repository,
+            stage=target.stage,
+            payload=payload
+        )
+    )
+
+
+job_queue = JobQueue(
+    runner=run_job,
+    max_parallel=settings.MAX_PARALLEL_DEPLOYS,
+    supersede_running=settings.SUPERSEDE_RUNNING,
+    listener=ledger.record_job
+)
+register_gauge('deploy_queue_depth', 'Deploy jobs waiting in queue', lambda: job_queue.depth)
+
+
+def get_job_info(job_id: str) -> Optional[dict]:
+    """Job of this worker or, with several workers, of another one from the
+    ledger. The ledger lags behind by LEDGER_FLUSH_INTERVAL."""
+
+    job: Optional[DeployJob] = job_queue.get(job_id)
+    if job:
+        return job.info()
+    row = ledger.get_job(job_id)
+    if not row:
+        return None
+    return dict(
+        id=row['id'],
+        kind=row['kind'],
+        repository_name=row['repository'],
+        stage=row['stage'],
+        status=row['status'],
+        error=row['error'],
+        created=row['created'],
+        started=row['started'],
+        finished=row['finished'],
+        steps=[dict(step=step['step'], status=step['status']) for step in ledger.steps(job_id)]
+    )
+
+
+async def recover_jobs() -> None:
+    """Queue again jobs interrupted by a restart.
+
+    A job is started from the beginning, the build cache makes the
+    repeated build cheap. After LEDGER_MAX_RECOVERIES restarts the job is
+    marked failed, so a job crashing the service is not retried forever.
+    """
+
+    lock: FileLock = get_lock('recovery', 'ledger')
+    if not lock.try_acquire():
+        # another worker is recovering right now
+        return
+    try:
+        _recover_jobs()
+    finally:
+        lock.release()
+
+
+def _recover_jobs() -> None:
+    for row in ledger.interrupted():
+        was_running: bool = row['status'] == JobStatus.running.value
+        if row['recoveries'] >= settings.LEDGER_MAX_RECOVERIES:
+            ledger.mark_recovered(row['id'], JobStatus.failed.value)
+            send_message_to_admins(
+                f"Деплой {row['repository']}-{row['stage']} прерван перезапуском и не будет повторен")
+            continue
+        ledger.mark_recovered(row['id'], JobStatus.queued.value)
+        job: DeployJob = job_queue.submit(
+            DeployJob(
+                id=row['id'],
+                kind=row['kind'],
+                repository_name=row['repository'],
+                stage=row['stage'],
+                payload=json.loads(row['payload'])
+            )
+        )
+        if was_running:
+            send_message_to_admins(
+                f"Деплой {job.repository_name}-{job.stage} был прерван перезапуском, повтор")
+        logger.info(f"Job {job.id} recovered: {job.key}")
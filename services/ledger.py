@@ -0,0 +1,303 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from config import logger, settings
+from services.locks import get_lock
+
+if TYPE_CHECKING:
+    from services.jobs import DeployJob
+
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    version TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT NOT NULL DEFAULT '',
+    created TEXT,
+    started TEXT,
+    finished TEXT,
+    recoveries INTEGER NOT NULL DEFAULT 0,
+    owner INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_target ON jobs (repository, stage, version);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS steps (
+    job_id TEXT NOT NULL,
+    step TEXT NOT NULL,
+    status TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS steps_job ON steps (job_id);
+CREATE TABLE IF NOT EXISTS workflow_jobs (
+    repository TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    result TEXT NOT NULL,
+    data TEXT NOT NULL DEFAULT '',
+    at REAL NOT NULL,
+    PRIMARY KEY (repository, run_id, attempt, name)
+);
+CREATE TABLE IF NOT EXISTS workflow_runs (
+    repository TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    conclusion TEXT NOT NULL,
+    at REAL NOT NULL,
+    PRIMARY KEY (repository, run_id, attempt)
+);
+"""
+
+UPSERT_JOB: str = """
+INSERT INTO jobs (
+    id, kind, repository, stage, version, payload, status, error, created, started, finished, owner
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    status = excluded.status,
+    error = excluded.error,
+    started = excluded.started,
+    finished = excluded.finished,
+    owner = excluded.owner
+"""
+
+UPSERT_WORKFLOW_JOB: str = """
+INSERT INTO workflow_jobs (repository, run_id, attempt, name, result, data, at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (repository, run_id, attempt, name) DO UPDATE SET
+    result = excluded.result,
+    data = CASE WHEN excluded.data != '' THEN excluded.data ELSE data END,
+    at = excluded.at
+"""
+
+JobRow = Tuple[str, ...]
+# repository, run id, run attempt
+RunKey = Tuple[str, int, int]
+
+
+def _is_alive(pid: int) -> bool:
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class DeployLedger:
+    """SQLite journal of deploy jobs and their pipeline steps.
+
+    Records are collected in memory and written in one transaction every
+    `flush_interval` seconds, or sooner when `batch_size` records are
+    waiting, so the pipeline never waits for the disk. Every job row
+    keeps the pid of the worker owning it, jobs left queued or running by
+    a worker which is not alive anymore are returned by `interrupted`.
+    """
+
+    def __init__(self, path: str = '', flush_interval: float = 1, batch_size: int = 100):
+        self._path: str = path
+        self._flush_interval: float = flush_interval
+        self._batch_size: int = batch_size
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, JobRow] = {}
+        self._steps: List[tuple] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._connection is not None
+
+    def open(self) -> None:
+        if not self._path or self._connection:
+            return
+        self._connection = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(SCHEMA)
+            columns: List[str] = [
+                row['name'] for row in self._connection.execute('PRAGMA table_info(jobs)')]
+            if 'owner' not in columns:
+                self._connection.execute(
+                    'ALTER TABLE jobs ADD COLUMN owner INTEGER NOT NULL DEFAULT 0')
+
+    async def start(self) -> None:
+        if self._path:
+            # workers starting together must not create the schema at once
+            async with get_lock('ledger', self._path):
+                self.open()
+        if self.enabled:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def record_job(self, job: 'DeployJob') -> None:
+        if not self.enabled:
+            return
+        # only the latest state of a job is written
+        self._jobs[job.id] = (
+            job.id, job.kind, job.repository_name, job.stage,
+            str(job.payload.get('version', '')), json.dumps(job.payload),
+            job.status.value, job.error,
+            *(
+                value.isoformat() if value else None
+                for value in (job.created, job.started, job.finished)
+            ),
+            os.getpid()
+        )
+        self._check_batch()
+
+    def record_step(self, job_id: str, step: str, status: str) -> None:
+        if not self.enabled or not job_id:
+            return
+        self._steps.append((job_id, step, status, time.time()))
+        self._check_batch()
+
+    async def flush(self) -> None:
+        if not self.enabled or not (self._jobs or self._steps):
+            return
+        jobs, self._jobs = list(self._jobs.values()), {}
+        steps, self._steps = self._steps, []
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, jobs, steps)
+        except sqlite3.Error as err:
+            logger.error(f"Ledger writing error: {err}")
+
+    def interrupted(self) -> List[sqlite3.Row]:
+        """Jobs which were queued or running when their worker stopped"""
+
+        rows: List[sqlite3.Row] = self._select(
+            "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY created")
+        return [row for row in rows if not _is_alive(row['owner'])]
+
+    def history(self, repository: str, stage: str, version: str = None) -> List[sqlite3.Row]:
+        if version is None:
+            return self._select(
+                'SELECT * FROM jobs WHERE repository = ? AND stage = ? ORDER BY created DESC',
+                repository, stage
+            )
+        return self._select(
+            'SELECT * FROM jobs WHERE repository = ? AND stage = ? AND version = ?'
+            ' ORDER BY created DESC',
+            repository, stage, version
+        )
+
+    def get_job(self, job_id: str) -> Optional[sqlite3.Row]:
+        rows: List[sqlite3.Row] = self._select('SELECT * FROM jobs WHERE id = ?', job_id)
+        return rows[0] if rows else None
+
+    def is_active(self, job_id: str) -> bool:
+        """Job is queued or running in a worker which is alive"""
+
+        row: Optional[sqlite3.Row] = self.get_job(job_id)
+        return bool(row) and row['status'] in ('queued', 'running') and _is_alive(row['owner'])
+
+    def steps(self, job_id: str) -> List[sqlite3.Row]:
+        return self._select('SELECT * FROM steps WHERE job_id = ? ORDER BY at', job_id)
+
+    def mark_recovered(self, job_id: str, status: str) -> int:
+        """Count one more recovery of the job, return the count"""
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE jobs SET recoveries = recoveries + 1, status = ?, owner = ? WHERE id = ?',
+                (status, os.getpid(), job_id)
+            )
+            row = self._connection.execute(
+                'SELECT recoveries FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row['recoveries'] if row else 0
+
+    def record_workflow_job(self, run: RunKey, name: str, result: str, data: dict = None) -> None:
+        """Result of a job of the workflow run, written at once: workers
+        receiving other events of the run read it with `get_workflow_run`"""
+
+        if not self.enabled:
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                UPSERT_WORKFLOW_JOB,
+                (*run, name, result, json.dumps(data) if data else '', time.time())
+            )
+
+    def get_workflow_run(self, run: RunKey) -> Tuple[Dict[str, str], dict, str]:
+        """Job results, payload of a succeeded job and conclusion of the
+        run recorded by all workers"""
+
+        jobs: Dict[str, str] = {}
+        data: dict = {}
+        for row in self._select(
+                'SELECT name, result, data FROM workflow_jobs'
+                ' WHERE repository = ? AND run_id = ? AND attempt = ? ORDER BY at',
+                *run
+        ):
+            jobs[row['name']] = row['result']
+            if row['data']:
+                data = json.loads(row['data'])
+        rows: List[sqlite3.Row] = self._select(
+            'SELECT conclusion FROM workflow_runs WHERE repository = ? AND run_id = ? AND attempt = ?',
+            *run
+        )
+        return jobs, data, rows[0]['conclusion'] if rows else ''
+
+    def finish_workflow_run(self, run: RunKey, conclusion: str) -> bool:
+        """Claim the run for this worker, False if another one finished it"""
+
+        if not self.enabled:
+            return True
+        with self._lock, self._connection:
+            cursor: sqlite3.Cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO workflow_runs VALUES (?, ?, ?, ?, ?)',
+                (*run, conclusion, time.time())
+            )
+        return cursor.rowcount == 1
+
+    def expire_workflow_runs(self, before: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM workflow_jobs WHERE at < ?', (before,))
+            self._connection.execute('DELETE FROM workflow_runs WHERE at < ?', (before,))
+
+    def _check_batch(self) -> None:
+        if len(self._jobs) + len(self._steps) >= self._batch_size:
+            asyncio.ensure_future(self.flush())
+
+    def _select(self, query: str, *args) -> List[sqlite3.Row]:
+        if not self.enabled:
+            return []
+        with self._lock:
+            return self._connection.execute(query, args).fetchall()
+
+    def _write(self, jobs: List[JobRow], steps: List[tuple]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(UPSERT_JOB, jobs)
+            self._connection.executemany('INSERT INTO steps VALUES (?, ?, ?, ?)', steps)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+
+ledger = DeployLedger(path=settings.LEDGER_FILE, flush_interval=settings.LEDGER_FLUSH_INTERVAL)
@@ -0,0 +1,71 @@
+import asyncio
+import fcntl
+import os
+import re
+import time
+from typing import Optional
+
+from config import settings
+from services.metrics import LOCK_WAIT
+
+
+class FileLock:
+    """Exclusive flock(2) on a file, shared by all processes of the host.
+
+    The lock is polled without blocking, so waiting does not stop the event
+    loop. Two FileLock objects of one process exclude each other too. The
+    wait time is observed in LOCK_WAIT with the `kind` label.
+    """
+
+    def __init__(self, path: str, kind: str = '', poll_interval: float = 0.1):
+        self.path: str = path
+        self._kind: str = kind
+        self._poll_interval: float = poll_interval
+        self._fd: Optional[int] = None
+
+    def try_acquire(self) -> bool:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd: int = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    async def acquire(self) -> None:
+        started: float = time.monotonic()
+        while not self.try_acquire():
+            await asyncio.sleep(self._poll_interval)
+        LOCK_WAIT.observe(time.monotonic() - started, self._kind)
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def is_locked(self) -> bool:
+        """Whether somebody else holds the lock now"""
+
+        if self._fd is not None:
+            return False
+        if not self.try_acquire():
+            return True
+        self.release()
+        return False
+
+    async def __aenter__(self) -> 'FileLock':
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.release()
+
+
+def get_lock(kind: str, name: str) -> FileLock:
+    """Lock `name` of the `kind` (deploy, clients, mirror, state) in LOCKS_DIR"""
+
+    file_name: str = re.sub(r'[^\w.-]', '_', f"{kind}-{name.strip('/')}")
+    return FileLock(os.path.join(settings.LOCKS_DIR, f'{file_name}.lock'), kind=kind)
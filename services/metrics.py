@@ -0,0 +1,146 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs: List[str] = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind: str = ''
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labels: Tuple[str, ...] = labels
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        return super().render() + [
+            f'{self.name}{_format_labels(self.labels, labels)} {value}'
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Metric):
+    """Gauge whose value is read from `function` at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        super().__init__(name, documentation)
+        self._function: Callable[[], float] = function
+
+    def render(self) -> List[str]:
+        return super().render() + [f'{self.name} {self._function()}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._buckets: Tuple[float, ...] = buckets
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts: List[float] = self._values.get(labels)
+        if counts is None:
+            # bucket counters with +Inf, then sum and count
+            counts = self._values[labels] = [0] * (len(self._buckets) + 3)
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def count(self, *labels: str) -> float:
+        counts: List[float] = self._values.get(labels)
+        return counts[-1] if counts else 0
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started: float = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, *labels)
+
+    def render(self) -> List[str]:
+        lines: List[str] = super().render()
+        for labels, counts in self._values.items():
+            cumulative: float = 0
+            for bound, count in zip((*self._buckets, '+Inf'), counts):
+                cumulative += count
+                le: str = _format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            label_text: str = _format_labels(self.labels, labels)
+            lines.append(f'{self.name}_sum{label_text} {counts[-2]}')
+            lines.append(f'{self.name}_count{label_text} {counts[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+registry = Registry()
+
+REQUEST_LATENCY: Histogram = registry.register(Histogram(
+    'webhook_request_seconds', 'Webhook handling time', labels=('event',)))
+HOOK_REJECTIONS: Counter = registry.register(Counter(
+    'webhook_rejections_total', 'Rejected webhooks', labels=('reason',)))
+STAGE_DURATION: Histogram = registry.register(Histogram(
+    'deploy_stage_seconds', 'Deploy pipeline stage duration',
+    labels=('repository', 'stage', 'step')))
+COMMAND_DURATION: Histogram = registry.register(Histogram(
+    'subprocess_seconds', 'Subprocess wall time', labels=('command', 'status')))
+COMMAND_RETRIES: Counter = registry.register(Counter(
+    'subprocess_retries_total', 'Commands rerun after a transient failure', labels=('step',)))
+LOCK_WAIT: Histogram = registry.register(Histogram(
+    'lock_wait_seconds', 'Time spent waiting for a deploy lock', labels=('kind',)))
+TELEGRAM_LATENCY: Histogram = registry.register(Histogram(
+    'telegram_request_seconds', 'Telegram API request time', labels=('method', 'status')))
+
+
+def register_gauge(name: str, documentation: str, function: Callable[[], float]) -> None:
+    registry.register(Gauge(name, documentation, function))
+
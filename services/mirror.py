@@ -0,0 +1,51 @@
+import os
+
+from config import settings
+from services.executor import CommandExecutor
+from services.locks import get_lock
+from services.retry import get_retry_policy
+
+
+class GitMirror(CommandExecutor):
+    """Long-lived bare mirror of a repository.
+
+    The first call clones it, the next ones only fetch new objects, and
+    files are taken from it with `git archive` without any checkout.
+    """
+
+    ssh_url: str
+    repository_name: str
+    mirrors_path: str = settings.MIRRORS_PATH
+
+    @property
+    def mirror_path(self) -> str:
+        return os.path.join(self.mirrors_path, f'{self.repository_name}.git')
+
+    async def update(self) -> int:
+        async with get_lock('mirror', self.mirror_path):
+            if os.path.exists(self.mirror_path):
+                return await get_retry_policy('git').run(
+                    self, 'git', '--git-dir', self.mirror_path, 'fetch', '--prune', 'origin',
+                    timeout=settings.GIT_TIMEOUT
+                )
+            os.makedirs(self.mirrors_path, exist_ok=True)
+            return await get_retry_policy('git').run(
+                self, 'git', 'clone', '--mirror', self.ssh_url, self.mirror_path,
+                timeout=settings.GIT_TIMEOUT
+            )
+
+    async def extract(self, revision: str, destination: str, *paths: str) -> int:
+        """Unpack `paths` at `revision` into `destination`"""
+
+        archive_path: str = os.path.join(destination, '.extract.tar')
+        try:
+            return (
+                await self.run_command(
+                    'git', '--git-dir', self.mirror_path, 'archive',
+                    '--output', archive_path, revision, '--', *paths
+                )
+                or await self.run_command('tar', '-xf', archive_path, '-C', destination)
+            )
+        finally:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
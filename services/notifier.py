@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from config import logger, settings
+from services.metrics import TELEGRAM_LATENCY
+
+
+class TelegramNotifier:
+    """Sends messages to admins from a background queue.
+
+    All requests go through one pooled HTTP client and fan out to admins
+    concurrently. Messages sent with the same `key` are merged: the first
+    one is sent, the next ones edit it in place, and only the latest text
+    for a key is delivered if several are waiting in the queue.
+    """
+
+    MAX_LENGTH: int = 4096
+    MAX_KEYS: int = 100
+
+    def __init__(
+            self,
+            token: str,
+            admins: List[int],
+            api_url: str = 'https://api.telegram.org',
+            retries: int = 3,
+            timeout: float = 5,
+            chat_interval: float = 1,
+            global_interval: float = 1 / 30,
+            transport: httpx.AsyncBaseTransport = None
+    ):
+        self._token: str = token
+        self._admins: List[int] = admins
+        self._api_url: str = api_url
+        self._retries: int = retries
+        self._timeout: float = timeout
+        self._chat_interval: float = chat_interval
+        self._global_interval: float = global_interval
+        self._transport: httpx.AsyncBaseTransport = transport
+        self._buffer: Deque[Tuple[str, str]] = deque()
+        self._queue: Optional[asyncio.Queue] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._latest: Dict[str, str] = {}
+        self._messages: Dict[str, Dict[int, int]] = {}
+        self._chat_sent: Dict[int, float] = {}
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._global_lock: Optional[asyncio.Lock] = None
+        self._global_sent: float = 0
+
+    def send(self, text: str, key: str = '') -> None:
+        """Queue message for all admins without waiting for delivery"""
+
+        if key:
+            queued: bool = key in self._latest
+            self._latest[key] = text
+            if queued:
+                return
+        item: Tuple[str, str] = (text, key)
+        if self._queue is None:
+            self._buffer.append(item)
+            return
+        self._queue.put_nowait(item)
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._global_lock = asyncio.Lock()
+        self._client = httpx.AsyncClient(
+            base_url=f'{self._api_url}/bot{self._token}',
+            timeout=self._timeout,
+            transport=self._transport
+        )
+        while self._buffer:
+            self._queue.put_nowait(self._buffer.popleft())
+        self._worker = asyncio.ensure_future(self._work())
+
+    async def stop(self, timeout: float = 10) -> None:
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Telegram messages left in queue: {self._queue.qsize()}")
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        await self._client.aclose()
+        self._worker = self._queue = self._client = None
+
+    async def _work(self) -> None:
+        while True:
+            text, key = await self._queue.get()
+            try:
+                if key:
+                    text = self._latest.pop(key, text)
+                await asyncio.gather(
+                    *(self.send_to_chat(chat_id, text, key) for chat_id in self._admins)
+                )
+            except Exception as err:
+                logger.exception(f"Telegram worker error: {err}")
+            finally:
+                self._queue.task_done()
+
+    async def send_to_chat(self, chat_id: int, text: str, key: str = '') -> int:
+        text = text[-self.MAX_LENGTH:]
+        message_id: int = self._messages.get(key, {}).get(chat_id) if key else None
+        method = 'sendMessage'
+        data: dict = dict(chat_id=chat_id, text=text)
+        if message_id:
+            method = 'editMessageText'
+            data.update(message_id=message_id)
+        for attempt in range(self._retries):
+            await self._wait_rate_limit(chat_id)
+            started: float = time.monotonic()
+            try:
+                response: httpx.Response = await self._client.post(f'/{method}', json=data)
+            except httpx.HTTPError as err:
+                TELEGRAM_LATENCY.observe(time.monotonic() - started, method, 'error')
+                logger.error(f"telegram id: {chat_id}\n message: {text}\n requests error: {err}")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            TELEGRAM_LATENCY.observe(time.monotonic() - started, method, str(response.status_code))
+            if response.status_code == 429:
+                retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+                logger.warning(f"Telegram rate limit, retry after {retry_after}s")
+                await asyncio.sleep(retry_after)
+                continue
+            if response.status_code >= 500:
+                await asyncio.sleep(2 ** attempt)
+                continue
+            if response.status_code == 400 and message_id:
+                # Message is not modified or was deleted: nothing to edit
+                return response.status_code
+            if key and response.status_code == 200 and not message_id:
+                result: dict = response.json().get('result', {})
+                self._messages.setdefault(key, {})[chat_id] = result.get('message_id')
+                while len(self._messages) > self.MAX_KEYS:
+                    self._messages.pop(next(iter(self._messages)))
+            logger.info(f"telegram id: {chat_id}\n message: {text}")
+            return response.status_code
+
+        logger.error(f"telegram id: {chat_id}\n message: {text}\n retries exceeded")
+        return -1
+
+    async def _wait_rate_limit(self, chat_id: int) -> None:
+        lock: asyncio.Lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            delay: float = self._chat_sent.get(chat_id, 0) + self._chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._chat_sent[chat_id] = time.monotonic()
+        async with self._global_lock:
+            delay: float = self._global_sent + self._global_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._global_sent = time.monotonic()
+
+
+notifier = TelegramNotifier(
+    token=settings.TELEBOT_TOKEN,
+    admins=settings.ADMINS,
+    api_url=settings.TELEGRAM_API_URL
+)
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import re
+import shutil
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import logger, settings
+from services.executor import CommandExecutor
+from services.images import forget_cached_build, get_build_cache_key, save_cached_build
+from services.locks import FileLock, get_lock
+from services.retry import get_retry_policy
+from services.routing import DeployTarget
+
+
+PrefetchKey = Tuple[str, str]
+
+
+def parse_base_images(dockerfile: List[str], compose: List[str]) -> List[str]:
+    """Images referenced by FROM lines and compose `image:` keys, except
+    build stages and images named by variables"""
+
+    images: List[str] = []
+    stages: Set[str] = {'scratch'}
+    for line in dockerfile:
+        match = re.match(r'\s*FROM\s+(?:--\S+\s+)*(\S+)(?:\s+AS\s+(\S+))?', line, re.IGNORECASE)
+        if not match:
+            continue
+        image, stage = match.groups()
+        if image.lower() not in stages and '$' not in image and image not in images:
+            images.append(image)
+        if stage:
+            stages.add(stage.lower())
+    for line in compose:
+        match = re.match(r'\s*image:\s*["\']?([^"\'\s]+)', line)
+        if match and '$' not in match.group(1) and match.group(1) not in images:
+            images.append(match.group(1))
+    return images
+
+
+class Prefetch(CommandExecutor):
+    """Warm-up of a target for a commit which is still checked by CI.
+
+    Fetches the commit into the working copy without checking it out and
+    pulls base images. With `build` also builds the image from a temporary
+    worktree under a `prefetch-` tag and puts it into the build cache, so
+    the deploy only re-tags it.
+    """
+
+    repository_name: str
+    stage: str
+    sha: str
+    full_path: str
+    build: bool = False
+
+    @property
+    def image(self) -> str:
+        return f"{self.repository_name.lower()}:prefetch-{self.sha[:12]}"
+
+    @property
+    def worktree(self) -> str:
+        return os.path.join(self.path, f'.prefetch-{self.sha[:12]}')
+
+    async def run(self) -> None:
+        if not os.path.exists(os.path.join(self.full_path, '.git')):
+            return
+        # a running deploy of the target owns the working copy
+        lock: FileLock = get_lock('deploy', f'{self.repository_name}-{self.stage}')
+        if not lock.try_acquire():
+            logger.info(f"Prefetch skipped, target is busy: {self.image}")
+            return
+        try:
+            if await get_retry_policy('git').run(
+                    self, 'git', 'fetch', 'origin', self.sha,
+                    cwd=self.full_path, timeout=settings.GIT_TIMEOUT
+            ):
+                return
+            if self.build and await self.run_command(
+                    'git', 'worktree', 'add', '--force', '--detach', self.worktree, self.sha,
+                    cwd=self.full_path
+            ):
+                return
+        finally:
+            lock.release()
+        try:
+            await self._pull_base_images()
+            if self.build:
+                await self._build_image()
+        finally:
+            if self.build:
+                await self._remove_worktree()
+
+    async def discard(self) -> None:
+        await forget_cached_build(self.image)
+        await self.run_command('docker', 'rmi', self.image)
+
+    async def _pull_base_images(self) -> None:
+        names: List[str] = await self.read_command(
+            'git', 'ls-tree', '--name-only', self.sha, cwd=self.full_path) or []
+        files: Dict[str, List[str]] = {}
+        for name in ('Dockerfile', 'docker-compose.yml', 'docker-compose.yaml'):
+            if name in names:
+                files[name] = await self.read_command(
+                    'git', 'show', f'{self.sha}:{name}', cwd=self.full_path) or []
+        images: List[str] = parse_base_images(
+            files.get('Dockerfile', []),
+            files.get('docker-compose.yml', []) + files.get('docker-compose.yaml', [])
+        )
+        for image in images:
+            await get_retry_policy('build').run(self, 'docker', 'pull', image)
+
+    async def _build_image(self) -> None:
+        env_file: str = os.path.join(self.path, '.env')
+        if os.path.exists(env_file):
+            shutil.copy(env_file, self.worktree)
+        status: int = await get_retry_policy('build').run(
+            self, 'docker-compose', 'build', cwd=self.worktree,
+            env=dict(VERSION=f"prefetch-{self.sha[:12]}", APPNAME=self.repository_name.lower())
+        )
+        if not status:
+            await save_cached_build(get_build_cache_key(self.sha, self.worktree), self.image)
+            logger.info(f"Prefetched image: {self.image}")
+
+    async def _remove_worktree(self) -> None:
+        await self.run_command(
+            'git', 'worktree', 'remove', '--force', self.worktree, cwd=self.full_path)
+        shutil.rmtree(self.worktree, ignore_errors=True)
+
+
+class Prefetcher:
+    """Starts prefetches when CI starts and throws them away when it fails"""
+
+    def __init__(self, max_items: int = 100):
+        self._max_items: int = max_items
+        self._items: 'OrderedDict[PrefetchKey, Prefetch]' = OrderedDict()
+        self._tasks: Dict[PrefetchKey, asyncio.Task] = {}
+
+    def start(self, target: DeployTarget, data: dict) -> None:
+        if target.pipeline != 'docker' or not target.options.get('prefetch', settings.PREFETCH):
+            return
+        workflow: dict = data.get('workflow_job') or data.get('workflow_run') or {}
+        user: str = ((data.get('repository') or {}).get('owner') or {}).get('login', '').lower()
+        key: PrefetchKey = (target.repository, workflow.get('head_sha', ''))
+        if not key[1] or not user or key in self._items:
+            return
+        path: str = target.get_path(user)
+        prefetch = Prefetch(
+            path=path,
+            full_path=os.path.join(path, target.repository),
+            repository_name=target.repository,
+            stage=target.stage,
+            sha=key[1],
+            build=target.options.get('prefetch_build', settings.PREFETCH_BUILD)
+        )
+        self._items[key] = prefetch
+        while len(self._items) > self._max_items:
+            self._items.popitem(last=False)
+        task = asyncio.ensure_future(self._run(prefetch))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def wait(self, repository: str, sha: str) -> None:
+        """Wait for a prefetch of the commit, without cancelling it"""
+
+        task: Optional[asyncio.Task] = self._tasks.get((repository, sha))
+        if task:
+            await asyncio.wait({task})
+
+    def discard(self, target: DeployTarget, sha: str) -> None:
+        key: PrefetchKey = (target.repository, sha)
+        prefetch: Optional[Prefetch] = self._items.pop(key, None)
+        if not prefetch:
+            return
+        task: Optional[asyncio.Task] = self._tasks.get(key)
+        if task:
+            task.cancel()
+        if prefetch.build:
+            asyncio.ensure_future(self._discard(prefetch, task))
+
+    @staticmethod
+    async def _run(prefetch: Prefetch) -> None:
+        try:
+            await prefetch.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logger.exception(f"Prefetch error: {err}")
+
+    @staticmethod
+    async def _discard(prefetch: Prefetch, task: Optional[asyncio.Task]) -> None:
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            await prefetch.discard()
+        except Exception as err:
+            logger.exception(f"Prefetch discard error: {err}")
+        logger.info(f"Prefetch discarded: {prefetch.image}")
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,21 @@
+import asyncio
+import os
+import signal
+
+from config import logger, settings
+
+
+def schedule_restart(delay: float = 1) -> None:
+    """Stop the server gracefully so that the process manager starts it
+    again with the pulled code.
+
+    With several workers SIGTERM goes to the uvicorn supervisor, which
+    stops all of them. The reloader of SERVER_RELOAD restarts by itself.
+    The delay lets the current job be recorded as finished.
+    """
+
+    if settings.SERVER_RELOAD or not settings.RESTART_AFTER_UPDATE:
+        return
+    pid: int = os.getppid() if settings.SERVER_WORKERS > 1 else os.getpid()
+    logger.info(f"Restart after update: SIGTERM to {pid} in {delay}s")
+    asyncio.get_event_loop().call_later(delay, os.kill, pid, signal.SIGTERM)
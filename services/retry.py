@@ -0,0 +1,93 @@
+import asyncio
+import re
+import time
+from typing import Awaitable, Callable, List, Pattern
+
+from pydantic import BaseModel
+
+from config import logger, settings
+from services.executor import CommandExecutor, CommandResult
+from services.metrics import COMMAND_RETRIES
+
+
+# Errors that will not go away on the next attempt
+PERMANENT: Pattern = re.compile(
+    r'dockerfile parse error|unknown instruction|syntaxerror|no such file or directory'
+    r'|permission denied|authentication failed|repository not found|manifest unknown'
+    r'|couldn\'t find remote ref|not a git repository|merge conflict',
+    re.IGNORECASE
+)
+# Network, registry and daemon hiccups
+TRANSIENT: Pattern = re.compile(
+    r'temporary failure in name resolution|could not resolve host|name or service not known'
+    r'|no such host|connection (reset|refused|timed out)|i/o timeout|tls handshake timeout'
+    r'|operation timed out|net/http: request canceled|toomanyrequests|too many requests'
+    r'|service unavailable|bad gateway|gateway time-?out|unexpected eof|early eof'
+    r'|remote end hung up|rpc failed|error pulling image|cannot connect to the docker daemon'
+    r'|docker daemon.*(busy|not responding)|device or resource busy'
+    r'|ssh: connect to host .* (timed out|refused)',
+    re.IGNORECASE
+)
+
+
+def is_transient(result: CommandResult) -> bool:
+    """Whether the failed command is worth running again"""
+
+    if result.timed_out:
+        return True
+    text: str = '\n'.join(result.tail)
+    if PERMANENT.search(text):
+        return False
+    return bool(TRANSIENT.search(text))
+
+
+class RetryPolicy(BaseModel):
+    """Reruns a command while it fails with a transient error.
+
+    Waits `delay` seconds multiplied by `factor` after every attempt and
+    gives up when the next attempt would start after `budget` seconds.
+    """
+
+    step: str = ''
+    attempts: int = 1
+    delay: float = settings.RETRY_DELAY
+    factor: float = 2
+    budget: float = settings.RETRY_BUDGET
+
+    async def run(self, executor: CommandExecutor, *command: str, **kwargs) -> int:
+        return await self.call(
+            executor, lambda: executor.run_command(*command, **kwargs), ' '.join(command))
+
+    async def call(
+            self, executor: CommandExecutor, function: Callable[[], Awaitable[int]], name: str
+    ) -> int:
+        """Retry `function`, which returns a status and records its result
+        in the executor"""
+
+        started: float = time.monotonic()
+        delay: float = self.delay
+        status: int = 0
+        for attempt in range(1, self.attempts + 1):
+            status = await function()
+            if not status:
+                return status
+            if attempt == self.attempts or not is_transient(executor.results[-1]):
+                return status
+            if time.monotonic() - started + delay > self.budget:
+                logger.warning(f"Retry budget exceeded: {self.step}: {name}")
+                return status
+            logger.warning(
+                f"Transient failure, retry {attempt}/{self.attempts - 1} in {delay}s: "
+                f"{self.step}: {name}"
+            )
+            COMMAND_RETRIES.inc(self.step)
+            await asyncio.sleep(delay)
+            delay *= self.factor
+        return status
+
+
+def get_retry_policy(step: str, attempts: dict = None) -> RetryPolicy:
+    """Policy of the pipeline step, `attempts` overrides RETRY_ATTEMPTS"""
+
+    attempts = {**settings.RETRY_ATTEMPTS, **(attempts or {})}
+    return RetryPolicy(step=step, attempts=attempts.get(step, 1))
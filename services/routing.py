@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import signal
+from typing import Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from config import logger, settings, BASE_DIR
+
+
+class DeployTarget(BaseModel):
+    """Where and how a (owner, repository, branch) is deployed"""
+
+    owner: str = '*'
+    repository: str
+    branch: str
+    stage: str
+    pipeline: str = 'docker'
+    path: str = ''
+    options: dict = {}
+
+    def get_path(self, user: str) -> str:
+        path: str = self.path
+        if not path:
+            path = {
+                'clients': settings.CLIENTS_PATH,
+                'update': str(BASE_DIR),
+            }.get(self.pipeline, settings.DEPLOY_PATH)
+        return path.format(user=user, repository=self.repository, stage=self.stage)
+
+
+def get_route_key(data: dict) -> Tuple[str, str, str]:
+    """Owner, repository and branch of a webhook payload"""
+
+    repository: dict = data.get('repository') or {}
+    owner: dict = repository.get('owner') or {}
+    workflow: dict = data.get('workflow_job') or data.get('workflow_run') or {}
+    branch: str = workflow.get('head_branch') or data.get('ref', '').split('/')[-1]
+    return (
+        (owner.get('login') or owner.get('name') or '').lower(),
+        repository.get('name', ''),
+        branch or ''
+    )
+
+
+class RoutingTable:
+    """Index of deploy targets keyed by (owner, repository, branch).
+
+    Targets are read from the json file `path` if it is set, otherwise they
+    are built from STAGES, APPLICATIONS, CLIENTS and UPDATE settings. The
+    index is swapped as a whole on reload, so running jobs are not affected.
+    """
+
+    def __init__(self, path: str = ''):
+        self._path: str = path
+        self._mtime: float = 0
+        self._index: Dict[Tuple[str, str, str], DeployTarget] = {}
+        self._repositories: Set[Tuple[str, str]] = set()
+        self._watcher: Optional[asyncio.Task] = None
+
+    def resolve(self, owner: str, repository: str, branch: str) -> Optional[DeployTarget]:
+        index = self._index
+        return index.get((owner.lower(), repository, branch)) or index.get(('*', repository, branch))
+
+    def find(self, owner: str, repository: str, stage: str) -> Optional[DeployTarget]:
+        """Target of the repository deployed to `stage`"""
+
+        for (target_owner, name, _), target in self._index.items():
+            if name == repository and target.stage == stage and target_owner in (owner.lower(), '*'):
+                return target
+
+    def has_repository(self, owner: str, repository: str) -> bool:
+        repositories = self._repositories
+        return (owner.lower(), repository) in repositories or ('*', repository) in repositories
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def load(self) -> bool:
+        try:
+            targets: List[DeployTarget] = self._read_file() if self._path else self._from_settings()
+        except (OSError, TypeError, ValueError, ValidationError) as err:
+            logger.error(f"Routes loading error: {err}")
+            return False
+        self._index = {
+            (target.owner.lower(), target.repository, target.branch): target
+            for target in targets
+        }
+        self._repositories = {(owner, repository) for owner, repository, _ in self._index}
+        logger.info(f"Routes loaded: {len(self._index)}")
+        return True
+
+    def reload_if_changed(self) -> None:
+        try:
+            mtime: float = os.stat(self._path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    async def start(self) -> None:
+        self.load()
+        try:
+            asyncio.get_event_loop().add_signal_handler(signal.SIGHUP, self.load)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass
+        if self._path and settings.ROUTES_WATCH_INTERVAL:
+            self._watcher = asyncio.ensure_future(self._watch(settings.ROUTES_WATCH_INTERVAL))
+
+    async def stop(self) -> None:
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
+
+    def _read_file(self) -> List[DeployTarget]:
+        self._mtime = os.stat(self._path).st_mtime
+        with open(self._path, 'r', encoding='utf-8') as f:
+            routes: list = json.load(f)
+        targets: List[DeployTarget] = []
+        for route in routes:
+            branches: dict = route.pop('branches', None) or settings.STAGES
+            for branch, stage in branches.items():
+                targets.append(DeployTarget(branch=branch, stage=stage, **route))
+        return targets
+
+    @staticmethod
+    def _from_settings() -> List[DeployTarget]:
+        pipelines: dict = {
+            **{name: 'docker' for name in settings.APPLICATIONS},
+            **{name: 'clients' for name in settings.CLIENTS},
+            **{name: 'update' for name in settings.UPDATE},
+        }
+        return [
+            DeployTarget(repository=name, branch=branch, stage=stage, pipeline=pipeline)
+            for name, pipeline in pipelines.items()
+            for branch, stage in settings.STAGES.items()
+        ]
+
+
+routing_table = RoutingTable(path=settings.ROUTES_FILE)
+routing_table.load()
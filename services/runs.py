@@ -0,0 +1,291 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from config import logger, settings
+from services.jobs import submit_payload
+from services.ledger import DeployLedger, RunKey, ledger
+from services.prefetch import prefetcher
+from services.routing import DeployTarget
+from services.utils import send_message_to_admins
+
+
+FAILED: Tuple[str, ...] = ('failure', 'cancelled', 'timed_out', 'startup_failure', 'action_required')
+PASSED: Tuple[str, ...] = ('success', 'skipped', 'neutral')
+
+
+class WorkflowRun(BaseModel):
+    repository: str
+    run_id: int
+    branch: str = ''
+    sha: str = ''
+    target: DeployTarget
+    # job name: conclusion of completed jobs, status of the others
+    jobs: Dict[str, str] = {}
+    data: dict = {}
+    conclusion: str = ''
+    created: float
+    started: bool = False
+    done: bool = False
+
+    def report(self) -> str:
+        jobs: str = ''.join(f"\n  {name}: {result}" for name, result in self.jobs.items())
+        return (
+            f"\nWorkflow run: {self.conclusion}"
+            f"\nRepository: {self.repository}"
+            f"\nBranch: {self.branch}"
+            f"\nSHA: {self.sha}"
+            f"\nJobs:{jobs}"
+        )
+
+
+class RunAggregator:
+    """Collects workflow_job/workflow_run events of one workflow run and
+    deploys it once.
+
+    With the `required_jobs` route option the run is deployed as soon as
+    all of those jobs succeeded. Without it, it is deployed on the
+    workflow_run "completed" event, or `settle_delay` seconds after the
+    last job event if all jobs seen so far succeeded. A run is deployed
+    only with the payload of a succeeded job or of the "completed" event.
+    Any failed job fails the run. Each run sends one summary. Runs not
+    finished in `ttl` seconds are dropped every `expire_interval` seconds
+    after `start`. `on_start` is called for the first event of a run still
+    in progress, `on_failure` when the run fails.
+
+    Workers receive different events of one run. With the `ledger` job
+    results are shared through it and the worker finishing the run claims
+    it there, so the run is deployed or failed once with all its jobs.
+    Ledger queries run in the default executor.
+    """
+
+    def __init__(
+            self,
+            on_success: Callable[[dict, DeployTarget], Any],
+            on_start: Callable[[DeployTarget, dict], Any] = None,
+            on_failure: Callable[[DeployTarget, str], Any] = None,
+            settle_delay: float = 30,
+            ttl: float = 3600,
+            max_runs: int = 1000,
+            ledger: DeployLedger = None,
+            expire_interval: float = 60
+    ):
+        self._on_success = on_success
+        self._on_start = on_start
+        self._on_failure = on_failure
+        self._settle_delay: float = settle_delay
+        self._ttl: float = ttl
+        self._max_runs: int = max_runs
+        self._ledger: Optional[DeployLedger] = ledger
+        self._expire_interval: float = expire_interval
+        self._runs: 'OrderedDict[RunKey, WorkflowRun]' = OrderedDict()
+        self._timers: Dict[RunKey, asyncio.TimerHandle] = {}
+        self._settles: Set[asyncio.Future] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def add(self, data: dict, target: DeployTarget) -> Any:
+        """Register the event. Returns result of `on_success` if the run
+        is deployed by this event."""
+
+        workflow_job: dict = data.get('workflow_job') or {}
+        workflow: dict = workflow_job or data.get('workflow_run') or {}
+        key: RunKey = (
+            target.repository,
+            workflow_job.get('run_id') or workflow.get('id', 0),
+            workflow.get('run_attempt', 1)
+        )
+        run: WorkflowRun = self._runs.get(key)
+        if run is None:
+            run = self._runs[key] = WorkflowRun(
+                repository=target.repository,
+                run_id=key[1],
+                branch=workflow.get('head_branch', ''),
+                sha=workflow.get('head_sha', ''),
+                target=target,
+                created=time.time()
+            )
+            while len(self._runs) > self._max_runs:
+                self._drop(next(iter(self._runs)))
+        if run.done:
+            return None
+        action: str = data.get('action', '')
+        if not run.started and action != 'completed':
+            run.started = True
+            self._call(self._on_start, target, data)
+        if workflow_job:
+            name: str = workflow_job.get('name', '')
+            conclusion: str = workflow_job.get('conclusion') or ''
+            run.jobs[name] = conclusion if action == 'completed' else action
+            if conclusion == 'success':
+                run.data = data
+            await self._share(
+                key, name, run.jobs[name], run.data if conclusion == 'success' else None)
+            if run.done:
+                return None
+        elif action == 'completed':
+            if workflow.get('conclusion') == 'success':
+                run.data = run.data or data
+                return await self._finish(key, 'success')
+            return await self._finish(key, workflow.get('conclusion') or 'failure')
+        return await self._check(key)
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    @property
+    def settling(self) -> int:
+        """Runs waiting for `settle_delay` before the deploy"""
+
+        return len(self._timers) + len(self._settles)
+
+    def _get_state(self, run: WorkflowRun) -> str:
+        """'failure', 'passed' when all jobs passed or 'pending'"""
+
+        required: list = run.target.options.get('required_jobs') or []
+        jobs: Dict[str, str] = (
+            {name: run.jobs.get(name, '') for name in required} if required else run.jobs)
+        if any(result in FAILED for result in jobs.values()):
+            return 'failure'
+        if all(result in PASSED for result in jobs.values()):
+            return 'passed'
+        return 'pending'
+
+    async def _check(self, key: RunKey) -> Any:
+        run: Optional[WorkflowRun] = self._runs.get(key)
+        # dropped while the ledger was queried
+        if run is None:
+            return None
+        state: str = self._get_state(run)
+        if state == 'failure':
+            return await self._finish(key, 'failure')
+        # nothing to deploy before a job succeeded, e.g. on "requested" events
+        if state == 'pending' or not run.data:
+            self._cancel_timer(key)
+            return None
+        if run.target.options.get('required_jobs'):
+            return await self._finish(key, 'success')
+        # later jobs of the run may not be queued yet
+        self._cancel_timer(key)
+        self._timers[key] = asyncio.get_event_loop().call_later(
+            self._settle_delay, self._start_settle, key)
+
+    def _start_settle(self, key: RunKey) -> None:
+        self._timers.pop(key, None)
+        task: asyncio.Future = asyncio.ensure_future(self._settle(key))
+        self._settles.add(task)
+        task.add_done_callback(self._settles.discard)
+
+    async def _settle(self, key: RunKey) -> None:
+        run: Optional[WorkflowRun] = self._runs.get(key)
+        if run is None or run.done:
+            return
+        # other workers may have received new jobs of the run meanwhile
+        await self._refresh(key)
+        if run.done or key in self._timers:
+            return
+        state: str = self._get_state(run)
+        if state == 'failure':
+            await self._finish(key, 'failure')
+        elif state == 'passed' and run.data:
+            await self._finish(key, 'success')
+
+    async def _finish(self, key: RunKey, conclusion: str) -> Any:
+        self._cancel_timer(key)
+        run: WorkflowRun = self._runs[key]
+        run.done = True
+        run.conclusion = conclusion
+        if self._ledger is not None and not await self._execute(
+                self._ledger.finish_workflow_run, key, conclusion):
+            return None
+        send_message_to_admins(run.report(), key=f'run-{run.repository}-{run.run_id}')
+        if conclusion != 'success':
+            self._call(self._on_failure, run.target, run.sha)
+            return None
+        if run.data:
+            return self._call(self._on_success, run.data, run.target)
+
+    async def _share(self, key: RunKey, name: str, result: str, data: Optional[dict]) -> None:
+        if self._ledger is None or not self._ledger.enabled:
+            return
+        await self._execute(self._ledger.record_workflow_job, key, name, result, data)
+        await self._refresh(key)
+
+    async def _refresh(self, key: RunKey) -> None:
+        """Merge the state of the run recorded by other workers"""
+
+        if self._ledger is None or not self._ledger.enabled:
+            return
+        jobs, data, conclusion = await self._execute(self._ledger.get_workflow_run, key)
+        run: Optional[WorkflowRun] = self._runs.get(key)
+        if run is None:
+            return
+        run.jobs.update(jobs)
+        run.data = run.data or data
+        if conclusion:
+            self._cancel_timer(key)
+            run.done = True
+            run.conclusion = conclusion
+
+    @staticmethod
+    async def _execute(func: Callable, *args) -> Any:
+        """Run a blocking ledger query in the default executor"""
+
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    @staticmethod
+    def _call(callback: Optional[Callable], *args) -> Any:
+        if callback is None:
+            return None
+        try:
+            return callback(*args)
+        except Exception as err:
+            logger.exception(f"Workflow run callback error: {err}")
+
+    def _cancel_timer(self, key: RunKey) -> None:
+        timer: Optional[asyncio.TimerHandle] = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+    def _drop(self, key: RunKey) -> None:
+        self._cancel_timer(key)
+        run: WorkflowRun = self._runs.pop(key)
+        if not run.done:
+            logger.warning(f"Workflow run {run.run_id} of {run.repository} expired: {run.jobs}")
+
+    async def _expire(self) -> None:
+        deadline: float = time.time() - self._ttl
+        for key in [key for key, run in self._runs.items() if run.created < deadline]:
+            self._drop(key)
+        if self._ledger is not None and self._ledger.enabled:
+            await self._execute(self._ledger.expire_workflow_runs, deadline)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._expire_interval)
+            try:
+                await self._expire()
+            except Exception as err:
+                logger.exception(f"Workflow runs expiring error: {err}")
+
+
+run_aggregator = RunAggregator(
+    on_success=submit_payload,
+    on_start=prefetcher.start,
+    on_failure=prefetcher.discard,
+    settle_delay=settings.RUN_SETTLE_DELAY,
+    ttl=settings.RUN_TTL,
+    max_runs=settings.RUN_MAX,
+    ledger=ledger,
+    expire_interval=settings.RUN_EXPIRE_INTERVAL
+)
@@ -1,26 +1,45 @@
-import requests
+import json
+import os
+import tempfile
+from typing import Any
 
-from config import settings, logger
+from config import logger, settings
+from services.notifier import notifier
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+
+def send_message_to_admins(text: str, key: str = '') -> None:
+    """Queue message to all admins. Messages with the same key
+    are merged into one message edited in place."""
 
-def send_message_to_admins(text: str) -> None:
     text = f'[Slarti][{settings.LOCATION}]: {text}'
-    for admin in settings.ADMINS:
-        send_message_to_user(telegram_id=admin, text=text)
+    notifier.send(text, key=key)
 
 
-def send_message_to_user(telegram_id: int, text: str) -> int:
-    """
-    The function of sending the message with the result of the script
-    """
-    url: str = f"https://api.telegram.org/bot{settings.TELEBOT_TOKEN}/sendMessage?chat_id={telegram_id}&text={text}"
+def load_json(path: str, default: Any = None) -> Any:
+    if not path or not os.path.exists(path):
+        return default
     try:
-        response = requests.get(url, timeout=5)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as err:
+        logger.error(f"{path} loading error: {err}")
+    return default
 
-        logger.info(f"telegram id: {telegram_id}\n message: {text}")
 
-        return response.status_code
-    except Exception as err:
-        logger.error(f"telegram id: {telegram_id}\n message: {text}\n requests error: {err}")
+def save_json(path: str, data: Any) -> None:
+    """Write json to a unique temporary file and replace `path` with it"""
 
-    return -1
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', prefix=f'.{os.path.basename(path)}.')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
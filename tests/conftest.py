@@ -1,4 +1,9 @@
+import hashlib
+import hmac
+import json
 import os
+import subprocess
+from typing import Callable
 
 import pytest
 from dotenv import load_dotenv
@@ -18,6 +23,56 @@ USERNAME: str = os.getenv('TEST_USERNAME')
 REPONAME: str = os.getenv('TEST_REPONAME')
 
 
+@pytest.fixture
+def aiolib() -> str:
+    return 'asyncio'
+
+
+@pytest.fixture(autouse=True)
+def locks_dir(tmp_path, monkeypatch) -> str:
+    from config import settings
+
+    monkeypatch.setattr(settings, 'LOCKS_DIR', str(tmp_path / 'locks'))
+    return settings.LOCKS_DIR
+
+
+@pytest.fixture
+def git() -> Callable[..., str]:
+    """Runs git in `cwd` with a test identity, returns its stdout"""
+
+    def run(*args, cwd) -> str:
+        return subprocess.run(
+            ['git', '-c', 'user.name=test', '-c', 'user.email=test@test', *args],
+            cwd=cwd, check=True, capture_output=True, text=True
+        ).stdout.strip()
+
+    return run
+
+
+@pytest.fixture
+def docker_scripts() -> dict:
+    """Extra shell lines of the fake executables by name, a test module
+    overrides it to change their answers or to add executables"""
+
+    return {}
+
+
+@pytest.fixture
+def fake_docker(tmp_path, monkeypatch, docker_scripts) -> str:
+    """docker, docker-compose and `docker_scripts` executables on PATH
+    appending `<name> <arguments>` to the returned calls file"""
+
+    bin_path = tmp_path / 'bin'
+    bin_path.mkdir()
+    calls = tmp_path / 'calls'
+    for name in {'docker', 'docker-compose', *docker_scripts}:
+        script = bin_path / name
+        script.write_text(f'#!/bin/sh\necho {name} "$@" >> {calls}\n{docker_scripts.get(name, "")}')
+        script.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    return str(calls)
+
+
 @pytest.fixture
 def username() -> str:
     return USERNAME
@@ -40,3 +95,45 @@ def payload(username, repo_name) -> dict:
         user=username,
         path=f'/home/{username}/deploy'
     )
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+
+    return TestClient(app)
+
+
+@pytest.fixture
+def push_data(username, repo_name) -> dict:
+    return {
+        "ref": "refs/heads/deskent",
+        "after": "0" * 40,
+        "repository": {
+            "name": repo_name,
+            "ssh_url": f'git@github.com:{username}/{repo_name}.git',
+            "owner": {"name": username, "login": username}
+        },
+        "head_commit": {"message": "Update [version:test-1.0] [build:test-1.0]"}
+    }
+
+
+def get_hook_headers(body: bytes, event: str = 'push', delivery: str = '') -> dict:
+    signature = hmac.new(os.getenv('GITHUB_SECRET').encode(), body, hashlib.sha256).hexdigest()
+    return {
+        'X-Hub-Signature-256': f'sha256={signature}',
+        'User-Agent': 'GitHub-Hookshot/test',
+        'X-GitHub-Event': event,
+        'X-GitHub-Delivery': delivery,
+        'Content-Type': 'application/json'
+    }
+
+
+@pytest.fixture
+def hook_request(client):
+    def post(data: dict, **kwargs):
+        body: bytes = json.dumps(data).encode()
+        return client.post('/deploy/', data=body, headers=get_hook_headers(body, **kwargs))
+
+    return post
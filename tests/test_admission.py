@@ -0,0 +1,82 @@
+import pytest
+
+from services import admission as admission_module
+from services.admission import AdmissionControl, TokenBucket, starts_deploy
+from services.exceptions import AdmissionError
+from tests.conftest import get_hook_headers
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, capacity=2)
+
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 1
+
+
+def test_rate_limit_per_target():
+    control = AdmissionControl(depth=lambda: 0, rate_per_minute=60, burst=1)
+    control.check_rate('repository', '1')
+    control.check_rate('repository', '2')
+
+    with pytest.raises(AdmissionError) as err:
+        control.check_rate('repository', '1')
+
+    assert err.value.status_code == 429
+    assert err.value.headers['Retry-After'] == '1'
+
+
+def test_queue_depth():
+    depth: list = [0]
+    control = AdmissionControl(depth=lambda: depth[0], max_depth=2)
+    control.check_depth()
+    depth[0] = 2
+
+    with pytest.raises(AdmissionError) as err:
+        control.check_depth()
+
+    assert err.value.status_code == 503
+
+
+def test_storm_is_shed_before_parsing(client, monkeypatch):
+    control = AdmissionControl(depth=lambda: 0, rate_per_minute=1, burst=1)
+    monkeypatch.setattr(admission_module.admission, 'check_rate', control.check_rate)
+    parsed: list = []
+    monkeypatch.setattr('handlers.root_handlers.json_loads', lambda body: parsed.append(body) or {})
+
+    def post(delivery: str, event: str = 'workflow_job', action: str = 'in_progress'):
+        body = f'{{"action": "{action}"}}'.encode()
+        headers = get_hook_headers(body, event, delivery)
+        headers['X-GitHub-Hook-Installation-Target-ID'] = '42'
+        return client.post('/deploy/', data=body, headers=headers)
+
+    first = post('storm-1')
+    second = post('storm-2')
+
+    assert first.status_code == 202
+    assert second.status_code == 429
+    assert int(second.headers['Retry-After']) > 0
+    assert len(parsed) == 1
+    # deliveries starting a deploy are never rate limited
+    assert post('storm-3', action='completed').status_code == 202
+    assert post('storm-4', event='push', action='').status_code == 202
+
+
+def test_starts_deploy():
+    assert starts_deploy('push', b'{}')
+    assert starts_deploy('workflow_run', b'{"action":"completed","workflow_run":{}}')
+    assert not starts_deploy('workflow_job', b'{"action":"queued","workflow_job":{}}')
+
+
+def test_full_queue_keeps_deploy_deliveries(client, monkeypatch):
+    control = AdmissionControl(depth=lambda: 5, max_depth=5)
+    monkeypatch.setattr(admission_module.admission, 'check_depth', control.check_depth)
+    monkeypatch.setattr('handlers.root_handlers.json_loads', lambda body: {})
+
+    def post(delivery: str, action: str):
+        body = f'{{"action": "{action}"}}'.encode()
+        return client.post(
+            '/deploy/', data=body, headers=get_hook_headers(body, 'workflow_run', delivery))
+
+    assert post('full-1', 'in_progress').status_code == 503
+    assert post('full-2', 'completed').status_code == 202
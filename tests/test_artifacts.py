@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from services import deploy
+from services.artifacts import LEGACY_RELEASE, ArtifactStore
+from services.deploy import run_payload
+from services.exceptions import ContainerRunError
+
+
+@pytest.fixture
+def store(tmp_path) -> ArtifactStore:
+    return ArtifactStore(str(tmp_path / 'clients'), keep=2)
+
+
+def make_files(tmp_path, name: str, **files) -> list:
+    """Extracted files of a build, on the filesystem of the store"""
+
+    path = tmp_path / 'clients' / f'extract-{name}'
+    path.mkdir(parents=True)
+    for file_name, text in files.items():
+        (path / file_name).write_text(text)
+    return [str(path / file_name) for file_name in files]
+
+
+def publish(store: ArtifactStore, tmp_path, release: str, **files) -> str:
+    return store.publish('app', make_files(tmp_path, release, **files), release)
+
+
+def read_current(store: ArtifactStore) -> dict:
+    path = os.path.join(store.path, 'app')
+    return {name: open(os.path.join(path, name)).read() for name in sorted(os.listdir(path))}
+
+
+def test_releases_share_unchanged_files(store, tmp_path):
+    publish(store, tmp_path, '1-a', **{'app.zip': 'v1', 'README.md': 'readme'})
+    first = os.stat(os.path.join(store.path, 'app', 'README.md')).st_ino
+
+    publish(store, tmp_path, '2-b', **{'app.zip': 'v2', 'README.md': 'readme'})
+
+    assert os.path.islink(os.path.join(store.path, 'app'))
+    assert store.get_current('app') == '2-b'
+    assert read_current(store) == {'README.md': 'readme', 'app.zip': 'v2'}
+    assert os.stat(os.path.join(store.path, 'app', 'README.md')).st_ino == first
+    assert len([name for _, _, files in os.walk(store.objects_path) for name in files]) == 3
+
+
+def test_new_release_keeps_files_of_previous(store, tmp_path):
+    publish(store, tmp_path, '1-a', **{'win.zip': 'win', 'mac.zip': 'mac'})
+    publish(store, tmp_path, '2-b', **{'win.zip': 'win2'})
+
+    assert read_current(store) == {'mac.zip': 'mac', 'win.zip': 'win2'}
+
+
+def test_old_releases_and_objects_removed(store, tmp_path):
+    for number in range(1, 5):
+        publish(store, tmp_path, f'{number}-a', **{'app.zip': f'v{number}'})
+
+    assert store.get_releases('app') == ['4-a', '3-a']
+    objects = [name for _, _, files in os.walk(store.objects_path) for name in files]
+    assert len(objects) == 2
+
+
+def test_revert(store, tmp_path):
+    publish(store, tmp_path, '1-a', **{'app.zip': 'v1'})
+    publish(store, tmp_path, '2-b', **{'app.zip': 'v2'})
+
+    assert store.revert('app') == '1-a'
+    assert read_current(store) == {'app.zip': 'v1'}
+    assert store.revert('app', '2-b') == '2-b'
+    assert read_current(store) == {'app.zip': 'v2'}
+    assert store.revert('app', '7-x') == ''
+    assert store.get_current('app') == '2-b'
+
+
+def test_files_copied_in_place_become_release(store, tmp_path):
+    legacy = tmp_path / 'clients' / 'app'
+    legacy.mkdir(parents=True)
+    (legacy / 'old.zip').write_text('old')
+
+    publish(store, tmp_path, '1-a', **{'app.zip': 'v1'})
+
+    assert read_current(store) == {'app.zip': 'v1', 'old.zip': 'old'}
+    assert store.get_releases('app') == ['1-a', LEGACY_RELEASE]
+    assert store.revert('app') == LEGACY_RELEASE
+    assert read_current(store) == {'old.zip': 'old'}
+
+
+async def test_clients_rollback_job(store, tmp_path, monkeypatch):
+    messages: list = []
+    monkeypatch.setattr(deploy, 'send_message_to_admins', messages.append)
+    publish(store, tmp_path, '1-a', **{'app.zip': 'v1'})
+    publish(store, tmp_path, '2-b', **{'app.zip': 'v2'})
+    payload = dict(
+        repository_name='app', stage='dev', path=store.path, pipeline='clients', version='1-a')
+
+    await run_payload('rollback', payload)
+
+    assert read_current(store) == {'app.zip': 'v1'}
+    assert messages == ['Файлы app-dev: откат на релиз 1-a']
+    with pytest.raises(ContainerRunError):
+        await run_payload('rollback', dict(payload, version='9-z'))
@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.harness import (
+    compare, get_step_durations, get_targets, load_corpus, percentile, summarize, vary
+)
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS: str = os.path.join(ROOT, 'benchmarks', 'corpus')
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3
+    assert percentile([], 50) == 0
+
+
+def test_corpus():
+    corpus = load_corpus(CORPUS)
+
+    assert [event for event, _ in corpus] == [
+        'push', 'workflow_job', 'workflow_job', 'workflow_job', 'workflow_run']
+    assert get_targets(corpus) == {('app', 'main'), ('service', 'main')}
+
+
+def test_vary_makes_new_run():
+    event, data = load_corpus(CORPUS)[-1]
+    first, second = vary(data, 1), vary(data, 2)
+
+    assert first['workflow_run']['id'] != second['workflow_run']['id']
+    assert first['workflow_run']['head_sha'] != second['workflow_run']['head_sha']
+    assert data['workflow_run']['id'] == 100
+
+
+def test_step_durations():
+    rows = [
+        dict(step='build', status='started', at=1.0),
+        dict(step='pull', status='started', at=1.5),
+        dict(step='pull', status='done', at=2.0),
+        dict(step='build', status='failed', at=4.0),
+        dict(step='run', status='started', at=5.0),
+    ]
+
+    assert list(get_step_durations(rows)) == [('pull', 0.5), ('build', 3.0)]
+
+
+def test_compare():
+    baseline = dict(
+        throughput=100, webhook=summarize([0.01] * 10), deploy=summarize([1.0] * 10),
+        stages={'build': summarize([0.5] * 10)}
+    )
+    result = dict(
+        throughput=95, webhook=summarize([0.012] * 10), deploy=summarize([1.5] * 10),
+        stages={'build': summarize([0.5] * 10), 'clone': summarize([0.1])}
+    )
+
+    assert compare(result, baseline) == [
+        'deploy p95: 1500.0 ms, baseline 1000.0 ms', 'deploy p99: 1500.0 ms, baseline 1000.0 ms']
+    assert len(compare(dict(result, throughput=50), baseline)) == 3
+
+
+def test_benchmark_run(tmp_path):
+    output = tmp_path / 'result.json'
+    process = subprocess.run(
+        [
+            sys.executable, '-m', 'benchmarks', '--requests', '5', '--concurrency', '2',
+            '--compose-latency', '0', '--git-latency', '0', '--docker-latency', '0',
+            '--telegram-latency', '0', '--fail-rate', '0', '--output', str(output)
+        ],
+        cwd=ROOT, capture_output=True, text=True, timeout=120
+    )
+
+    assert process.returncode == 0, process.stdout + process.stderr
+    result = json.loads(output.read_text())
+    assert result['statuses'] == {'202': 5}
+    assert result['webhook']['count'] == 5
+    assert result['jobs'] == {'done': 2}
+    assert {'clone', 'build', 'tests', 'run'} <= set(result['stages'])
+    assert result['telegram']['sendMessage']
@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+from services.blue_green import get_active_color, get_next_color
+from services.deploy import Docker
+from services.exceptions import ContainerPrepareError, ContainerRunError
+
+
+@pytest.fixture
+def docker_scripts(monkeypatch) -> dict:
+    """`docker-compose ps` answers with a container, `docker inspect` with
+    $HEALTH, the upstream reload exits with $RELOAD_STATUS"""
+
+    monkeypatch.setenv('HEALTH', 'healthy')
+    monkeypatch.setenv('RELOAD_STATUS', '0')
+    return {
+        'docker-compose': 'case "$*" in *" ps -q"*) echo container-1 ;; esac\n',
+        'docker': 'echo "$HEALTH"\n',
+        'reload': 'exit $RELOAD_STATUS\n',
+    }
+
+
+def get_docker(tmp_path, version: str = '1', **options) -> Docker:
+    path = tmp_path / 'deploy'
+    (path / 'App').mkdir(parents=True, exist_ok=True)
+    blue_green = dict(
+        ports={'blue': 8001, 'green': 8002}, upstream_file=str(tmp_path / 'upstream.conf'),
+        reload=['reload'], drain=0, health_timeout=0.1, health_interval=0.05, **options
+    )
+    return Docker(
+        path=str(path), full_path=str(path / 'App'), repository_name='App', user='user',
+        branch='dev', stage='dev', version=version, build=version, ssh_url='',
+        options=dict(blue_green=blue_green)
+    )
+
+
+def read_calls(path: str) -> list:
+    with open(path) as f:
+        lines = f.read().splitlines()
+    os.remove(path)
+    return lines
+
+
+def test_next_color():
+    assert get_next_color('') == 'blue'
+    assert get_next_color('blue') == 'green'
+    assert get_next_color('green') == 'blue'
+
+
+async def test_switch_between_colors(tmp_path, fake_docker):
+    docker = get_docker(tmp_path)
+    await docker._running_container()
+
+    assert read_calls(fake_docker) == [
+        'docker-compose -p app-dev-blue down --remove-orphans',
+        'docker-compose -p app-dev-blue up -d',
+        'docker-compose -p app-dev-blue ps -q',
+        'docker inspect --format {{if .State.Health}}{{.State.Health.Status}}'
+        '{{else}}{{.State.Status}}{{end}} container-1',
+        'reload',
+        # containers of the deploy before blue/green
+        'docker-compose down --remove-orphans',
+    ]
+    assert (tmp_path / 'upstream.conf').read_text() == 'server 127.0.0.1:8001;\n'
+    assert get_active_color(docker.path) == 'blue'
+    assert 'Переключение: blue' in docker.report
+
+    docker = get_docker(tmp_path, version='2')
+    await docker._running_container()
+
+    calls = read_calls(fake_docker)
+    assert calls[1] == 'docker-compose -p app-dev-green up -d'
+    assert calls[-1] == 'docker-compose -p app-dev-blue down --remove-orphans'
+    assert (tmp_path / 'upstream.conf').read_text() == 'server 127.0.0.1:8002;\n'
+    assert get_active_color(docker.path) == 'green'
+
+
+async def test_unhealthy_color_keeps_running_one(tmp_path, fake_docker, monkeypatch):
+    await get_docker(tmp_path)._running_container()
+    read_calls(fake_docker)
+    monkeypatch.setenv('HEALTH', 'starting')
+    docker = get_docker(tmp_path, version='2')
+
+    with pytest.raises(ContainerRunError):
+        await docker._running_container()
+
+    calls = read_calls(fake_docker)
+    assert calls[-1] == 'docker-compose -p app-dev-green down --remove-orphans'
+    assert 'reload' not in calls
+    assert not any('app-dev-blue' in call for call in calls)
+    assert (tmp_path / 'upstream.conf').read_text() == 'server 127.0.0.1:8001;\n'
+    assert get_active_color(docker.path) == 'blue'
+    assert 'работает предыдущая версия' in docker.report
+
+
+async def test_failed_reload_restores_upstream(tmp_path, fake_docker, monkeypatch):
+    await get_docker(tmp_path)._running_container()
+    read_calls(fake_docker)
+    monkeypatch.setenv('RELOAD_STATUS', '1')
+
+    with pytest.raises(ContainerRunError):
+        await get_docker(tmp_path, version='2')._running_container()
+
+    assert read_calls(fake_docker)[-1] == 'docker-compose -p app-dev-green down --remove-orphans'
+    assert (tmp_path / 'upstream.conf').read_text() == 'server 127.0.0.1:8001;\n'
+    assert get_active_color(str(tmp_path / 'deploy')) == 'blue'
+
+
+@pytest.mark.parametrize('blue_green, options, error', [
+    (dict(upstream_file=''), {}, 'upstream_file'),
+    (dict(ports={'blue': 8001}), {}, 'no port for green'),
+    ({}, dict(docker_backend='engine'), 'docker-compose'),
+])
+def test_wrong_setup_fails_before_build(tmp_path, blue_green, options, error):
+    docker = get_docker(tmp_path)
+    docker.options['blue_green'].update(blue_green)
+    docker.options.update(options)
+
+    with pytest.raises(ContainerPrepareError) as err:
+        docker._get_blue_green()
+
+    assert error in err.value.detail
@@ -0,0 +1,20 @@
+import asyncio
+
+from services.capture import PayloadCapture
+
+
+async def test_capture_keeps_last_files(tmp_path):
+    capture = PayloadCapture(enabled=True, path=str(tmp_path), max_files=2)
+    for index in range(3):
+        capture.capture('push', f'delivery-{index}', b'{}')
+        await asyncio.gather(*capture._tasks)
+
+    names = sorted(path.name for path in tmp_path.iterdir())
+    assert len(names) == 2
+    assert names[-1].endswith('push-delivery-2.json')
+
+
+def test_capture_disabled(tmp_path):
+    PayloadCapture(path=str(tmp_path)).capture('push', 'delivery', b'{}')
+
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,44 @@
+import time
+
+from services.deliveries import DeliveryCache
+
+
+def test_get_returns_stored_answer():
+    cache = DeliveryCache()
+    cache.set('delivery-1', {"result": "ok"})
+
+    assert cache.get('delivery-1') == {"result": "ok"}
+    assert cache.get('delivery-2') is None
+    assert cache.get(None) is None
+
+
+def test_oldest_delivery_evicted():
+    cache = DeliveryCache(max_size=2)
+    cache.set('1', {})
+    cache.set('2', {})
+    cache.get('1')
+    cache.set('3', {})
+
+    assert cache.get('2') is None
+    assert cache.get('1') == {}
+    assert len(cache) == 2
+
+
+def test_expired_delivery():
+    cache = DeliveryCache(ttl=0)
+    cache.set('1', {})
+    time.sleep(0.01)
+
+    assert cache.get('1') is None
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'deliveries.json')
+    cache = DeliveryCache(path=path)
+    cache.set('1', {"job_id": "abc"})
+    cache.save()
+
+    loaded = DeliveryCache(path=path)
+    loaded.load()
+
+    assert loaded.get('1') == {"job_id": "abc"}
@@ -1,5 +1,12 @@
+import asyncio
+import os
+import signal
+
 import pytest
-from services.deploy import Docker, ContainerBuildError, ContainerPrepareError
+from config import settings
+from services import deploy, restart
+from services.deploy import Docker, ContainerBuildError, ContainerPrepareError, update_repository
+from services.images import get_build_cache_key, get_cached_build, save_cached_build
 
 
 def test_prepare_error_wrong_repository(payload):
@@ -15,29 +22,139 @@ def test_prepare_error_wrong_path(payload):
         obj._prepare()
 
 
-def test_build_wrong_branch(payload):
+async def test_build_wrong_branch(payload):
     payload.update(branch='error')
     obj = Docker(**payload)
     obj._prepare()
     with pytest.raises(ContainerBuildError):
-        obj._build_container()
+        await obj._build_container()
 
 
 @pytest.mark.full
-def test_build_container_ok(payload):
+async def test_build_container_ok(payload):
     obj = Docker(**payload)
     obj._prepare()
-    assert obj._build_container() == 0
+    assert await obj._build_container() == 0
 
 
 @pytest.mark.full
-def test_testing_container_ok(payload):
+async def test_testing_container_ok(payload):
     obj = Docker(**payload)
     obj._prepare()
-    obj._build_container()
-    assert obj._testing_container() == 0
+    await obj._build_container()
+    assert await obj._testing_container() == 0
 
 
 @pytest.mark.full
-def test_docker_deploy_ok(payload):
-    assert Docker(**payload).deploy() is True
+async def test_docker_deploy_ok(payload):
+    assert await Docker(**payload).deploy() is True
+
+
+async def test_fetch_commit_checks_out_exact_sha(payload, tmp_path, git):
+    origin = tmp_path / 'origin'
+    origin.mkdir()
+    git('init', '-b', 'main', cwd=origin)
+    for text in ('v1', 'v2'):
+        (origin / 'version.txt').write_text(text)
+        git('add', '.', cwd=origin)
+        git('commit', '-m', text, cwd=origin)
+    sha = git('rev-parse', 'HEAD', cwd=origin)
+    payload.update(
+        path=str(tmp_path), ssh_url=f'file://{origin}', sha=sha,
+        full_path=str(tmp_path / 'app')
+    )
+    obj = Docker(**payload)
+
+    await obj.fetch_commit()
+
+    assert (tmp_path / 'app' / 'version.txt').read_text() == 'v2'
+    assert git('rev-parse', 'HEAD', cwd=tmp_path / 'app') == sha
+
+
+async def test_build_cache_retags_image(payload, tmp_path, monkeypatch, fake_docker):
+    monkeypatch.setattr(settings, 'BUILD_CACHE_FILE', str(tmp_path / 'build_cache.json'))
+    (tmp_path / 'Dockerfile').write_text('FROM python:3.8')
+    payload.update(path=str(tmp_path), sha='a' * 40)
+    obj = Docker(**payload)
+    key = obj._get_build_cache_key(str(tmp_path), obj.sha)
+
+    assert await obj._tag_cached_image(key) is False
+    await save_cached_build(key, 'repo:prod-test-1.0')
+    assert await obj._tag_cached_image(key) is True
+    with open(fake_docker) as f:
+        assert f.read() == 'docker tag repo:prod-test-1.0 repo:dev-test-1.0\n'
+
+    (tmp_path / 'Dockerfile').write_text('FROM python:3.9')
+    assert obj._get_build_cache_key(str(tmp_path), obj.sha) != key
+
+    key = obj._get_build_cache_key(str(tmp_path), obj.sha)
+    (tmp_path / '.env').write_text('DEBUG=1')
+    assert obj._get_build_cache_key(str(tmp_path), obj.sha) != key
+
+
+async def test_build_cache_key_of_pulled_commit(payload, tmp_path, monkeypatch, fake_docker, git):
+    monkeypatch.setattr(settings, 'BUILD_CACHE_FILE', str(tmp_path / 'build_cache.json'))
+    origin = tmp_path / 'origin'
+    origin.mkdir()
+    (origin / 'Dockerfile').write_text('FROM python:3.8')
+    git('init', '-b', 'deskent', cwd=origin)
+    git('add', '.', cwd=origin)
+    git('commit', '-m', 'old', cwd=origin)
+    old = git('rev-parse', 'HEAD', cwd=origin)
+    git('clone', str(origin), 'app', cwd=tmp_path)
+    (tmp_path / '.env').write_text('')
+    git('commit', '--allow-empty', '-m', 'new', cwd=origin)
+    new = git('rev-parse', 'HEAD', cwd=origin)
+    payload.update(path=str(tmp_path), full_path=str(tmp_path / 'app'), sha=old)
+    obj = Docker(**payload)
+
+    assert await obj._build_container() == 0
+
+    path = str(tmp_path / 'app')
+    assert get_cached_build(get_build_cache_key(new, path)) == obj.image
+    assert not get_cached_build(get_build_cache_key(old, path))
+
+
+async def test_update_restarts_service_on_new_commits(tmp_path, git, monkeypatch):
+    restarts: list = []
+    monkeypatch.setattr(deploy, 'schedule_restart', lambda: restarts.append(True))
+    monkeypatch.setattr(deploy, 'send_message_to_admins', lambda text: None)
+    origin = tmp_path / 'origin'
+    origin.mkdir()
+    git('init', '-b', 'main', cwd=origin)
+    git('commit', '--allow-empty', '-m', 'init', cwd=origin)
+    git('clone', str(origin), 'service', cwd=tmp_path)
+    payload = dict(
+        branch='main', repository_name='service', user='user', path=str(tmp_path / 'service'))
+
+    await update_repository(payload)
+    assert not restarts
+
+    git('commit', '--allow-empty', '-m', 'new', cwd=origin)
+    await update_repository(payload)
+    assert restarts == [True]
+
+
+async def test_schedule_restart_stops_server(monkeypatch):
+    signals: list = []
+    monkeypatch.setattr(restart.os, 'kill', lambda pid, sig: signals.append((pid, sig)))
+    monkeypatch.setattr(settings, 'SERVER_WORKERS', 1)
+
+    restart.schedule_restart(delay=0)
+    await asyncio.sleep(0.01)
+
+    assert signals == [(os.getpid(), signal.SIGTERM)]
+
+
+def test_progress_message_per_job(payload, monkeypatch):
+    keys: list = []
+    monkeypatch.setattr(deploy, 'send_message_to_admins', lambda text, key='': keys.append(key))
+    first = Docker(job_id='job-1', **payload)
+    first._send_progress()
+    first._send_progress()
+    Docker(job_id='job-2', **payload)._send_progress()
+    Docker(**payload)._send_progress()
+    Docker(**payload)._send_progress()
+
+    assert keys[:3] == ['deploy-job-1', 'deploy-job-1', 'deploy-job-2']
+    assert len(set(keys[3:])) == 2
@@ -0,0 +1,221 @@
+import asyncio
+import io
+import json
+import tarfile
+from itertools import count
+
+import pytest
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from services import deploy
+from services.deploy import Docker
+from services.engine import DockerEngine, make_build_context
+
+
+class FakeDaemon:
+    """Docker Engine API subset: build, containers create/start/logs/wait/delete"""
+
+    def __init__(self):
+        self.containers: dict = {}
+        self.context: list = []
+        self.removed: list = []
+        self._ids = count(1)
+        self.app = FastAPI()
+        self.app.get('/v1.41/_ping')(self.ping)
+        self.app.post('/v1.41/build')(self.build)
+        self.app.post('/v1.41/containers/create')(self.create)
+        self.app.post('/v1.41/containers/{name}/start')(self.start)
+        self.app.get('/v1.41/containers/{name}/logs')(self.logs)
+        self.app.post('/v1.41/containers/{name}/wait')(self.wait)
+        self.app.delete('/v1.41/containers/{name}')(self.delete)
+
+    def find(self, name: str) -> str:
+        for container_id, container in self.containers.items():
+            if name in (container_id, container['name']):
+                return container_id
+        return ''
+
+    async def ping(self):
+        return Response('OK')
+
+    async def build(self, request: Request, t: str):
+        with tarfile.open(fileobj=io.BytesIO(await request.body())) as tar:
+            self.context = sorted(tar.getnames())
+        lines = [{'stream': 'Step 1/2 : FROM python:3.8\n'}, {'status': 'Pulling', 'id': 'abc'}]
+        if t.startswith('broken'):
+            lines.append({'error': 'The command /bin/sh -c exit 1 returned a non-zero code: 1'})
+        else:
+            lines.append({'stream': f'Successfully tagged {t}\n'})
+        return StreamingResponse(json.dumps(line) + '\r\n' for line in lines)
+
+    async def create(self, request: Request, name: str = ''):
+        if name and self.find(name):
+            return JSONResponse({'message': 'Conflict'}, status_code=409)
+        container_id = f'{next(self._ids):064d}'
+        self.containers[container_id] = dict(name=name, body=await request.json(), started=False)
+        return JSONResponse({'Id': container_id}, status_code=201)
+
+    async def start(self, name: str):
+        self.containers[self.find(name)]['started'] = True
+        return Response(status_code=204)
+
+    async def logs(self, name: str):
+        command = ' '.join(self.containers[self.find(name)]['body']['Cmd'])
+        frames = [(1, f'running {command}\n'), (2, 'warning\n')]
+        return StreamingResponse(
+            bytes([stream, 0, 0, 0]) + len(text).to_bytes(4, 'big') + text.encode()
+            for stream, text in frames
+        )
+
+    async def wait(self, name: str):
+        return {'StatusCode': 1 if 'fail' in self.containers[self.find(name)]['body']['Cmd'] else 0}
+
+    async def delete(self, name: str):
+        container_id = self.find(name)
+        if not container_id:
+            return JSONResponse({'message': f'No such container: {name}'}, status_code=404)
+        self.removed.append(self.containers.pop(container_id)['name'] or container_id)
+        return Response(status_code=204)
+
+
+@pytest.fixture
+async def daemon(tmp_path):
+    fake = FakeDaemon()
+    fake.socket = str(tmp_path / 'docker.sock')
+    server = uvicorn.Server(
+        uvicorn.Config(fake.app, uds=fake.socket, log_level='error', lifespan='off'))
+    server.install_signal_handlers = lambda: None
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    yield fake
+    server.should_exit = True
+    await task
+
+
+@pytest.fixture
+async def engine(daemon):
+    engine = DockerEngine(socket=daemon.socket)
+    yield engine
+    await engine.close()
+
+
+async def test_build_streams_progress(engine, daemon, tmp_path):
+    context = tmp_path / 'app'
+    (context / '.git').mkdir(parents=True)
+    (context / '.git' / 'config').write_text('')
+    (context / 'secrets').mkdir()
+    (context / 'secrets' / 'key').write_text('')
+    (context / 'Dockerfile').write_text('FROM python:3.8\n')
+    (context / 'app.py').write_text('')
+    (context / 'app.pyc').write_text('')
+    (context / '.dockerignore').write_text('# comment\nsecrets/\n*.pyc\n')
+    log = io.StringIO()
+
+    result = await engine.build(str(context), 'app:dev-1', log)
+
+    assert result.returncode == 0
+    assert daemon.context == ['.dockerignore', 'Dockerfile', 'app.py']
+    assert log.getvalue().splitlines() == [
+        '$ engine build app:dev-1', 'Step 1/2 : FROM python:3.8', 'abc: Pulling ',
+        'Successfully tagged app:dev-1'
+    ]
+
+
+def test_build_context_negation(tmp_path):
+    (tmp_path / 'docs').mkdir()
+    (tmp_path / 'docs' / 'README.md').write_text('')
+    (tmp_path / 'docs' / 'guide.md').write_text('')
+    (tmp_path / 'Dockerfile').write_text('FROM python:3.8\n')
+    (tmp_path / 'app.py').write_text('')
+    (tmp_path / 'app.pyc').write_text('')
+    (tmp_path / '.dockerignore').write_text('*\n!Dockerfile\n!*.py\n!docs/README.md\n*.pyc\n')
+
+    with tarfile.open(fileobj=io.BytesIO(make_build_context(str(tmp_path)))) as tar:
+        names = sorted(tar.getnames())
+
+    assert names == ['Dockerfile', 'app.py', 'docs/README.md']
+
+
+async def test_build_error(engine, tmp_path):
+    result = await engine.build(str(tmp_path), 'broken:1', io.StringIO())
+
+    assert result.returncode == 1
+    assert result.tail[-1] == 'The command /bin/sh -c exit 1 returned a non-zero code: 1'
+
+
+async def test_one_off_container(engine, daemon):
+    log = io.StringIO()
+    config = {
+        'ExposedPorts': {'80/tcp': {}},
+        'HostConfig': {'PortBindings': {'80/tcp': [{'HostPort': '8080'}]}, 'Binds': ['/data:/data']}
+    }
+
+    result = await engine.run('app:dev-1', ['pytest', 'tests/'], log, env=['A=1'], config=config)
+    failed = await engine.run('app:dev-1', ['fail'], io.StringIO())
+
+    assert result.returncode == 0
+    assert failed.returncode == 1
+    assert 'running pytest tests/\nwarning\n' in log.getvalue()
+    assert not daemon.containers
+    assert len(daemon.removed) == 2
+
+
+async def test_recreate_service(engine, daemon):
+    config = {'HostConfig': {'PortBindings': {'80/tcp': [{'HostPort': '8080'}]}}}
+
+    first = await engine.recreate('app-dev', 'app:dev-1', io.StringIO(), config=config)
+    second = await engine.recreate('app-dev', 'app:dev-2', io.StringIO(), config=config)
+
+    assert first.returncode == second.returncode == 0
+    assert daemon.removed == ['app-dev']
+    [container] = daemon.containers.values()
+    assert container['started']
+    assert container['body']['Image'] == 'app:dev-2'
+    assert container['body']['HostConfig'] == {
+        'RestartPolicy': {'Name': 'unless-stopped'}, **config['HostConfig']}
+
+
+async def test_daemon_not_available(tmp_path):
+    engine = DockerEngine(socket=str(tmp_path / 'missing.sock'))
+
+    assert not await engine.available()
+    result = await engine.run('app:dev-1', ['pytest'], io.StringIO())
+    assert result.returncode == 1
+    assert result.tail[-1].startswith('Docker Engine error')
+    await engine.close()
+
+
+def get_docker(tmp_path, **options) -> Docker:
+    path = tmp_path / 'deploy'
+    (path / 'App').mkdir(parents=True)
+    (path / 'App' / '.env').write_text('# settings\nDB_URL="postgres://db"\n')
+    return Docker(
+        path=str(path), full_path=str(path / 'App'), repository_name='App', user='user',
+        branch='dev', stage='dev', version='1', build='1', ssh_url='', options=options
+    )
+
+
+async def test_docker_stages_use_engine(engine, daemon, tmp_path, monkeypatch):
+    monkeypatch.setattr(deploy, 'docker_engine', engine)
+    docker = get_docker(tmp_path, docker_backend='engine')
+
+    await docker._testing_container()
+    await docker._running_container()
+
+    assert 'Тесты: ОК' in docker.report
+    assert 'Развертывание: ОК' in docker.report
+    [container] = daemon.containers.values()
+    assert container['name'] == 'app-dev'
+    assert container['body']['Env'] == ['DB_URL=postgres://db', 'VERSION=dev-1', 'APPNAME=app']
+    assert [result.command[:2] for result in docker.results] == [
+        ['engine', 'run'], ['engine', 'recreate']]
+
+
+async def test_engine_falls_back_to_compose(tmp_path, monkeypatch):
+    monkeypatch.setattr(deploy, 'docker_engine', DockerEngine(socket=str(tmp_path / 'missing.sock')))
+    docker = get_docker(tmp_path, docker_backend='engine')
+
+    assert await docker._get_backend() == 'shell'
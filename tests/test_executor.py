@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from services.executor import CommandExecutor
+
+
+@pytest.fixture
+def executor(tmp_path) -> CommandExecutor:
+    return CommandExecutor(path=str(tmp_path))
+
+
+async def test_run_command_streams_output(executor, tmp_path):
+    status = await executor.run_command('sh', '-c', 'echo out; echo err >&2')
+
+    assert status == 0
+    log = (tmp_path / 'subprocess.log').read_text()
+    assert 'out\n' in log
+    assert 'err\n' in log
+    assert executor.results[-1].returncode == 0
+
+
+async def test_run_command_exit_code_and_env(executor):
+    assert await executor.run_command('sh', '-c', 'exit $CODE', env={'CODE': '3'}) == 3
+
+
+async def test_run_command_timeout(executor):
+    status = await executor.run_command('sleep', '5', timeout=0.1)
+
+    assert status != 0
+    assert executor.results[-1].timed_out
+    assert executor.results[-1].duration < 5
+
+
+async def test_run_command_not_found(executor):
+    assert await executor.run_command('no-such-command-here') == 127
+
+
+async def test_run_command_cancel_kills_process(executor):
+    task = asyncio.ensure_future(executor.run_command('sleep', '5'))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+async def test_read_command(executor):
+    assert await executor.read_command('sh', '-c', 'echo one; echo two') == ['one', 'two']
+    assert await executor.read_command('sh', '-c', 'exit 1') is None
@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+from config import settings
+from services.images import ImageGC, ImageInfo, parse_size, touch_image
+from services.utils import load_json
+
+
+def image(tag: str, last_used: float, size: int = 100) -> ImageInfo:
+    return ImageInfo(
+        repository='app', tag=tag, id=f'id-{tag}', created=last_used, size=size, last_used=last_used)
+
+
+def test_parse_size():
+    assert parse_size('1.5GB') == 1_500_000_000
+    assert parse_size('120MB') == 120_000_000
+    assert parse_size('?') == 0
+
+
+def test_keep_last_images_per_stage():
+    images = [image(f'prod-1.{i}', i) for i in range(4)] + [image('dev-1.0', 0)]
+    gc = ImageGC(keep=2, disk_budget=0)
+
+    removed = gc.select(images, used=set())
+
+    assert [item.tag for item in removed] == ['prod-1.0', 'prod-1.1']
+
+
+def test_used_images_kept():
+    images = [image(f'prod-1.{i}', i) for i in range(3)]
+    gc = ImageGC(keep=1, disk_budget=0)
+
+    removed = gc.select(images, used={'app:prod-1.0'})
+
+    assert [item.tag for item in removed] == ['prod-1.1']
+
+
+def test_lru_eviction_within_budget():
+    images = [image(f'prod-1.{i}', i) for i in range(5)]
+    gc = ImageGC(keep=1, disk_budget=300)
+
+    removed = gc.select(images, used=set())
+
+    assert [item.tag for item in removed] == ['prod-1.0', 'prod-1.1']
+
+
+async def test_concurrent_touches_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'IMAGES_STATE_FILE', str(tmp_path / 'images.json'))
+
+    await asyncio.gather(*(touch_image(f'repo:dev-{number}') for number in range(10)))
+
+    assert sorted(load_json(settings.IMAGES_STATE_FILE)) == [f'repo:dev-{n}' for n in range(10)]
+    assert sorted(os.listdir(tmp_path)) == ['images.json', 'locks']
@@ -0,0 +1,171 @@
+import asyncio
+import os
+
+import pytest
+
+from config import settings
+from handlers.logs_handlers import parse_range
+from services.executor import CommandExecutor
+from services.job_logs import JobLog, JobLogStore, job_logs
+
+
+@pytest.fixture
+def store(tmp_path) -> JobLogStore:
+    return JobLogStore(path=str(tmp_path / 'logs'), keep=2, max_bytes=100, chunk_size=16)
+
+
+async def read_all(store: JobLogStore, job_id: str, start: int = 0, end: int = None) -> bytes:
+    return b''.join([chunk async for chunk in store.read(job_id, start, end)])
+
+
+async def test_executor_writes_job_log(store, tmp_path):
+    log = store.open('job1')
+    executor = CommandExecutor(path=str(tmp_path), log=log)
+    await executor.run_command('sh', '-c', 'echo out; echo err >&2')
+    await store.close('job1')
+
+    text = (await read_all(store, 'job1')).decode()
+    assert text.startswith('$ sh -c')
+    assert 'out\n' in text and 'err\n' in text
+    assert not (tmp_path / 'subprocess.log').exists()
+
+
+async def test_rotation(tmp_path):
+    log = JobLog(str(tmp_path / 'job.log'), max_bytes=10, backups=1)
+    for text in ('a' * 8, 'b' * 8, 'c' * 8):
+        log.write(text)
+        await log.flush_buffer()
+
+    assert (tmp_path / 'job.log').read_text() == 'c' * 8
+    assert (tmp_path / 'job.log.1').read_text() == 'b' * 8
+    assert not (tmp_path / 'job.log.2').exists()
+
+
+async def test_retention(store):
+    for job_id in ('job1', 'job2', 'job3'):
+        log = store.open(job_id)
+        log.write('line\n')
+        await store.close(job_id)
+        await asyncio.sleep(0.01)
+    store.open('job4')
+
+    assert not store.exists('job1')
+    assert not store.exists('job2')
+    assert store.exists('job3')
+    await store.close('job4')
+
+
+async def test_ranged_read(store):
+    log = store.open('job1')
+    log.write('0123456789' * 5)
+    await store.close('job1')
+
+    assert await read_all(store, 'job1', 5, 24) == b'56789012345678901234'
+    assert store.get_size('job1') == 50
+
+
+async def test_follow_running_job(store):
+    log = store.open('job1')
+    log.write('first\npart')
+
+    async def finish():
+        await asyncio.sleep(0.05)
+        log.write('ial\nlast')
+        await store.close('job1')
+
+    task = asyncio.ensure_future(finish())
+    lines = [line async for _, chunk in store.follow('job1', keepalive=1) for line in chunk]
+    await task
+
+    assert lines == ['first', 'partial', 'last']
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-9', (0, 9)),
+    ('bytes=40-', (40, 49)),
+    ('bytes=-5', (45, 49)),
+    ('bytes=45-100', (45, 49)),
+    ('bytes=50-', None),
+    ('items=0-1', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 50) == expected
+
+
+@pytest.fixture
+def finished_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'API_TOKEN', 'secret-token')
+    monkeypatch.setattr(job_logs, '_path', str(tmp_path))
+    (tmp_path / 'job1.log').write_text('line 1\nline 2\n')
+    return {'Authorization': 'Bearer secret-token'}
+
+
+def test_log_endpoint_range(client, finished_log):
+    response = client.get('/deploy/jobs/job1/log', headers={**finished_log, 'Range': 'bytes=7-'})
+
+    assert response.status_code == 206
+    assert response.text == 'line 2\n'
+    assert response.headers['Content-Range'] == 'bytes 7-13/14'
+
+    assert client.get('/deploy/jobs/job1/log', headers=finished_log).text == 'line 1\nline 2\n'
+    assert client.get('/deploy/jobs/job2/log', headers=finished_log).status_code == 404
+    assert client.get('/deploy/jobs/job1/log').status_code == 401
+
+
+def test_log_stream_finished_job(client, finished_log):
+    response = client.get('/deploy/jobs/job1/log/stream', headers=finished_log)
+
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert response.text == 'id: 14\ndata: line 1\ndata: line 2\n\nevent: end\ndata: \n\n'
+
+
+async def test_follow_job_of_another_worker(store):
+    path = store.get_path('job1')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write('line 1\n')
+    active: list = [True]
+
+    async def finish():
+        await asyncio.sleep(0.05)
+        with open(path, 'a') as f:
+            f.write('line 2\n')
+        active[0] = False
+
+    task = asyncio.ensure_future(finish())
+    lines = [
+        line async for _, chunk in store.follow(
+            'job1', is_active=lambda: active[0], poll_interval=0.01)
+        for line in chunk
+    ]
+    await task
+
+    assert lines == ['line 1', 'line 2']
+
+
+async def test_follow_across_rotation(store):
+    path = store.get_path('job1')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write('line 1\nline 2\n')
+    active: list = [True]
+
+    async def rotate():
+        await asyncio.sleep(0.05)
+        with open(path, 'a') as f:
+            f.write('line 3\n')
+        os.replace(path, f'{path}.1')
+        with open(path, 'w') as f:
+            f.write('line 4\nline 5\nline 6\n')
+        await asyncio.sleep(0.05)
+        active[0] = False
+
+    task = asyncio.ensure_future(rotate())
+    lines = [
+        line async for _, chunk in store.follow(
+            'job1', is_active=lambda: active[0], poll_interval=0.01)
+        for line in chunk
+    ]
+    await task
+
+    assert lines == [f'line {number}' for number in range(1, 7)]
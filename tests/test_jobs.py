@@ -0,0 +1,115 @@
+import asyncio
+
+from services import jobs
+from services.exceptions import DeployCancelledError
+from services.jobs import DeployJob, JobQueue, JobStatus, get_job_info
+from services.ledger import DeployLedger
+
+
+async def _wait(queue: JobQueue, *jobs: DeployJob):
+    while any(job.status in (JobStatus.queued, JobStatus.running) for job in jobs):
+        await asyncio.sleep(0.01)
+
+
+async def test_same_key_jobs_run_one_by_one():
+    running: list = []
+    overlaps: list = []
+
+    async def runner(job):
+        overlaps.append(bool(running))
+        running.append(job.id)
+        await asyncio.sleep(0.03)
+        running.remove(job.id)
+
+    queue = JobQueue(runner=runner, max_parallel=4)
+    first = queue.submit(DeployJob(repository_name='app', stage='dev'))
+    await asyncio.sleep(0.01)
+    second = queue.submit(DeployJob(repository_name='app', stage='dev'))
+    jobs = [first, second]
+    await _wait(queue, *jobs)
+
+    assert not any(overlaps)
+    assert all(job.status == JobStatus.done for job in jobs)
+
+
+async def test_different_keys_run_in_parallel_up_to_limit():
+    running: list = []
+    peak: list = [0]
+
+    async def runner(job):
+        running.append(job.id)
+        peak[0] = max(peak[0], len(running))
+        await asyncio.sleep(0.02)
+        running.remove(job.id)
+
+    queue = JobQueue(runner=runner, max_parallel=2)
+    jobs = [queue.submit(DeployJob(repository_name=f'app{i}', stage='dev')) for i in range(4)]
+    await _wait(queue, *jobs)
+
+    assert peak[0] == 2
+
+
+async def test_failed_job_status():
+    async def runner(job):
+        raise ValueError('boom')
+
+    queue = JobQueue(runner=runner)
+    job = queue.submit(DeployJob(repository_name='app', stage='dev'))
+    await _wait(queue, job)
+
+    assert job.status == JobStatus.failed
+    assert job.error == 'boom'
+    assert queue.get(job.id) is job
+
+
+async def test_newer_job_supersedes_queued_one():
+    started: list = []
+
+    async def runner(job):
+        started.append(job.id)
+        await asyncio.sleep(0.02)
+
+    queue = JobQueue(runner=runner)
+    first = queue.submit(DeployJob(repository_name='app', stage='dev'))
+    await asyncio.sleep(0)
+    second = queue.submit(DeployJob(repository_name='app', stage='dev'))
+    third = queue.submit(DeployJob(repository_name='app', stage='dev'))
+    await _wait(queue, first, second, third)
+
+    assert started == [first.id, third.id]
+    assert second.status == JobStatus.superseded
+    assert second.superseded_by == third.id
+
+
+async def test_newer_job_cancels_running_one():
+    async def runner(job):
+        while not job.is_cancelled():
+            await asyncio.sleep(0.01)
+        raise DeployCancelledError
+
+    queue = JobQueue(runner=runner, supersede_running=True)
+    first = queue.submit(DeployJob(repository_name='app', stage='dev'))
+    await asyncio.sleep(0.02)
+    second = queue.submit(DeployJob(repository_name='app', stage='dev'))
+    await _wait(queue, first)
+
+    assert first.status == JobStatus.cancelled
+    assert first.superseded_by == second.id
+
+
+async def test_job_of_another_worker_from_ledger(tmp_path, monkeypatch):
+    shared = DeployLedger(path=str(tmp_path / 'ledger.sqlite3'))
+    shared.open()
+    monkeypatch.setattr(jobs, 'ledger', shared)
+    job = DeployJob(repository_name='app', stage='dev', status=JobStatus.running)
+    shared.record_job(job)
+    shared.record_step(job.id, 'build', 'started')
+    await shared.flush()
+
+    info = get_job_info(job.id)
+
+    assert info['status'] == 'running'
+    assert info['repository_name'] == 'app'
+    assert info['steps'] == [{'step': 'build', 'status': 'started'}]
+    assert get_job_info('unknown') is None
+    await shared.stop()
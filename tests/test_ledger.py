@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from config import settings
+from services import jobs
+from services.jobs import DeployJob, JobQueue, JobStatus, recover_jobs
+from services.ledger import DeployLedger
+
+
+@pytest.fixture
+async def ledger(tmp_path):
+    ledger = DeployLedger(path=str(tmp_path / 'ledger.sqlite3'), flush_interval=60)
+    await ledger.start()
+    yield ledger
+    await ledger.stop()
+
+
+def get_job(status: JobStatus = JobStatus.queued) -> DeployJob:
+    return DeployJob(
+        repository_name='app', stage='dev', status=status, payload={'version': '1.0', 'user': 'u'})
+
+
+async def test_writes_are_batched(ledger):
+    job = get_job()
+    ledger.record_job(job)
+    job.status = JobStatus.running
+    ledger.record_job(job)
+    ledger.record_step(job.id, 'build', 'started')
+
+    assert ledger.history('app', 'dev') == []
+
+    await ledger.flush()
+
+    [row] = ledger.history('app', 'dev', '1.0')
+    assert row['status'] == 'running'
+    assert [step['step'] for step in ledger.steps(job.id)] == ['build']
+
+
+async def test_queue_reports_status_changes(ledger):
+    async def runner(job):
+        await asyncio.sleep(0)
+
+    queue = JobQueue(runner=runner, listener=ledger.record_job)
+    job = queue.submit(get_job())
+    while job.status != JobStatus.done:
+        await asyncio.sleep(0.01)
+    await ledger.flush()
+
+    assert ledger.history('app', 'dev')[0]['status'] == 'done'
+
+
+async def test_recover_interrupted_jobs(ledger, monkeypatch):
+    submitted: list = []
+    monkeypatch.setattr(jobs, 'ledger', ledger)
+    monkeypatch.setattr(jobs.job_queue, 'submit', lambda job: submitted.append(job) or job)
+    monkeypatch.setattr(settings, 'LEDGER_MAX_RECOVERIES', 1)
+    running = get_job(JobStatus.running)
+    done = get_job(JobStatus.done)
+    ledger.record_job(running)
+    ledger.record_job(done)
+    await ledger.flush()
+
+    await recover_jobs()
+
+    assert [job.id for job in submitted] == [running.id]
+    assert submitted[0].payload == running.payload
+
+    await recover_jobs()
+
+    assert len(submitted) == 1
+    statuses = {row['id']: row['status'] for row in ledger.history('app', 'dev', '1.0')}
+    assert statuses == {running.id: 'failed', done.id: 'done'}
+    assert not ledger.interrupted()
@@ -0,0 +1,48 @@
+import asyncio
+import sys
+
+from services.locks import FileLock, get_lock
+from services.metrics import LOCK_WAIT
+
+
+async def test_lock_is_exclusive(tmp_path):
+    order: list = []
+
+    async def deploy(name: str):
+        async with FileLock(str(tmp_path / 'app.lock'), kind='test', poll_interval=0.01):
+            order.append(f'{name} start')
+            await asyncio.sleep(0.05)
+            order.append(f'{name} end')
+
+    count = LOCK_WAIT.count('test')
+    await asyncio.gather(deploy('first'), deploy('second'))
+
+    assert order == ['first start', 'first end', 'second start', 'second end']
+    assert LOCK_WAIT.count('test') == count + 2
+
+
+async def test_lock_held_by_other_process(tmp_path):
+    path = str(tmp_path / 'app.lock')
+    script = (
+        'import fcntl, sys, time\n'
+        f'f = open({path!r}, "w")\n'
+        'fcntl.flock(f, fcntl.LOCK_EX)\n'
+        'print("locked", flush=True)\n'
+        'time.sleep(0.3)\n'
+    )
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-c', script, stdout=asyncio.subprocess.PIPE)
+    await process.stdout.readline()
+    lock = FileLock(path, poll_interval=0.01)
+
+    assert lock.is_locked()
+    await lock.acquire()
+    assert process.returncode is not None or await process.wait() == 0
+    lock.release()
+    assert not lock.is_locked()
+
+
+def test_lock_file_name(locks_dir):
+    lock = get_lock('clients', '/home/user/clients/repo')
+
+    assert lock.path == f'{locks_dir}/clients-home_user_clients_repo.lock'
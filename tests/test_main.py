@@ -0,0 +1,18 @@
+import main
+from services.locks import get_lock
+
+
+async def test_startup_message_sent_by_one_worker(monkeypatch):
+    sent: list = []
+    monkeypatch.setattr(main, 'send_message_to_admins', sent.append)
+    monkeypatch.setattr(main, '_startup_lock', get_lock('startup', 'notification'))
+    other_worker = get_lock('startup', 'notification')
+
+    await main.notify_started()
+    other_worker_sent = other_worker.try_acquire()
+    main._startup_lock.release()
+
+    assert len(sent) == 1
+    assert 'started' in sent[0]
+    assert not other_worker_sent
+
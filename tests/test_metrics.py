@@ -0,0 +1,44 @@
+from services.metrics import Counter, Histogram, HOOK_REJECTIONS, REQUEST_LATENCY, registry
+
+
+def test_histogram_render():
+    histogram = Histogram('test_seconds', 'Test', labels=('step',), buckets=(1, 5))
+    histogram.observe(0.5, 'build')
+    histogram.observe(3, 'build')
+    histogram.observe(10, 'build')
+
+    lines = histogram.render()
+
+    assert 'test_seconds_bucket{step="build",le="1"} 1' in lines
+    assert 'test_seconds_bucket{step="build",le="5"} 2' in lines
+    assert 'test_seconds_bucket{step="build",le="+Inf"} 3' in lines
+    assert 'test_seconds_sum{step="build"} 13.5' in lines
+    assert 'test_seconds_count{step="build"} 3' in lines
+
+
+def test_counter_escapes_labels():
+    counter = Counter('test_total', 'Test', labels=('reason',))
+    counter.inc('Wrong "json"')
+
+    assert 'test_total{reason="Wrong \\"json\\""} 1' in counter.render()
+
+
+def test_metrics_endpoint(client, hook_request, push_data):
+    rejected = HOOK_REJECTIONS.get('Wrong content')
+    observed = REQUEST_LATENCY.count('push')
+    client.post(
+        '/deploy/', json=push_data,
+        headers={
+            'X-Hub-Signature-256': 'sha256=wrong',
+            'User-Agent': 'GitHub-Hookshot/test',
+            'X-GitHub-Event': 'push'
+        }
+    )
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert HOOK_REJECTIONS.get('Wrong content') == rejected + 1
+    assert REQUEST_LATENCY.count('push') == observed + 1
+    assert 'deploy_queue_depth' in response.text
+    assert response.text == registry.render()
@@ -0,0 +1,41 @@
+import pytest
+
+from services.mirror import GitMirror
+
+
+@pytest.fixture
+def origin(tmp_path, git) -> str:
+    path = tmp_path / 'origin'
+    (path / 'archive').mkdir(parents=True)
+    (path / 'archive' / 'client.zip').write_text('v1')
+    (path / 'README.md').write_text('readme')
+    (path / 'src.py').write_text('')
+    git('init', '-b', 'main', cwd=path)
+    git('add', '.', cwd=path)
+    git('commit', '-m', 'init', cwd=path)
+    return str(path)
+
+
+@pytest.fixture
+def mirror(tmp_path, origin) -> GitMirror:
+    return GitMirror(
+        path=str(tmp_path), ssh_url=origin, repository_name='app',
+        mirrors_path=str(tmp_path / 'mirrors')
+    )
+
+
+async def test_mirror_fetches_new_commits(mirror, origin, git, tmp_path):
+    destination = tmp_path / 'out'
+    destination.mkdir()
+
+    assert await mirror.update() == 0
+    (tmp_path / 'origin' / 'archive' / 'client.zip').write_text('v2')
+    git('commit', '-am', 'v2', cwd=origin)
+    assert await mirror.update() == 0
+    assert await mirror.extract('refs/heads/main', str(destination), 'archive', 'README.md') == 0
+
+    assert (destination / 'archive' / 'client.zip').read_text() == 'v2'
+    assert (destination / 'README.md').exists()
+    assert not (destination / 'src.py').exists()
+    assert mirror.results[0].command[:3] == ['git', 'clone', '--mirror']
+    assert mirror.results[1].command[3] == 'fetch'
@@ -0,0 +1,71 @@
+import json
+
+import httpx
+import pytest
+
+from services.notifier import TelegramNotifier
+
+
+@pytest.fixture
+def requests_log() -> list:
+    return []
+
+
+@pytest.fixture
+def transport(requests_log) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        data: dict = json.loads(request.content)
+        requests_log.append((request.url.path.split('/')[-1], data))
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": data['chat_id'] * 10}})
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.fixture
+def notifier(transport) -> TelegramNotifier:
+    return TelegramNotifier(
+        token='token', admins=[1, 2], transport=transport, chat_interval=0, global_interval=0)
+
+
+async def test_send_fans_out_to_admins(notifier, requests_log):
+    notifier.send('started')
+    await notifier.start()
+    await notifier.stop()
+
+    assert sorted(data['chat_id'] for _, data in requests_log) == [1, 2]
+    assert all(method == 'sendMessage' for method, _ in requests_log)
+
+
+async def test_messages_with_key_are_edited_in_place(notifier, requests_log):
+    await notifier.start()
+    notifier.send('step 1', key='app-dev-1')
+    await notifier.stop()
+    await notifier.start()
+    notifier.send('step 2', key='app-dev-1')
+    notifier.send('step 3', key='app-dev-1')
+    await notifier.stop()
+
+    edits = [data for method, data in requests_log if method == 'editMessageText']
+    assert len(edits) == 2
+    assert {data['message_id'] for data in edits} == {10, 20}
+    assert all(data['text'] == 'step 3' for data in edits)
+
+
+async def test_retry_after_rate_limit(requests_log):
+    responses = [
+        httpx.Response(429, json={"ok": False, "parameters": {"retry_after": 0}}),
+        httpx.Response(200, json={"ok": True, "result": {}}),
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_log.append(request)
+        return responses.pop(0)
+
+    notifier = TelegramNotifier(
+        token='token', admins=[1], transport=httpx.MockTransport(handler),
+        chat_interval=0, global_interval=0)
+    await notifier.start()
+
+    assert await notifier.send_to_chat(1, 'text') == 200
+    assert len(requests_log) == 2
+    await notifier.stop()
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import shutil
+
+import pytest
+
+from config import settings
+from services import prefetch as prefetch_module
+from services.images import get_cached_build
+from services.locks import get_lock
+from services.prefetch import Prefetch, Prefetcher, parse_base_images
+from services.routing import DeployTarget
+
+
+@pytest.fixture
+def checkout(tmp_path, git) -> dict:
+    """Working copy behind the origin by one commit"""
+
+    origin = tmp_path / 'origin'
+    origin.mkdir()
+    (origin / 'Dockerfile').write_text('FROM python:3.8 AS base\nFROM base\n')
+    git('init', '-b', 'main', cwd=origin)
+    git('add', '.', cwd=origin)
+    git('commit', '-m', 'init', cwd=origin)
+    path = tmp_path / 'deploy'
+    path.mkdir()
+    git('clone', str(origin), 'app', cwd=path)
+    (origin / 'docker-compose.yml').write_text('services:\n  redis:\n    image: redis:6\n')
+    git('add', '.', cwd=origin)
+    git('commit', '-m', 'compose', cwd=origin)
+    sha = git('rev-parse', 'HEAD', cwd=origin)
+    return dict(path=str(path), full_path=str(path / 'app'), sha=sha)
+
+
+def test_parse_base_images():
+    dockerfile = [
+        'FROM --platform=linux/amd64 python:3.8-slim AS builder',
+        'FROM builder as tests',
+        'FROM scratch',
+        'ARG BASE',
+        'FROM ${BASE}',
+        'FROM nginx:1.21',
+    ]
+    compose = ['services:', '  db:', '    image: "postgres:13"', '  app:', '    image: app:${VERSION}']
+
+    assert parse_base_images(dockerfile, compose) == ['python:3.8-slim', 'nginx:1.21', 'postgres:13']
+
+
+async def test_prefetch_fetches_and_pulls(checkout, fake_docker, git):
+    prefetch = Prefetch(repository_name='app', stage='dev', **checkout)
+
+    await prefetch.run()
+
+    with open(fake_docker) as f:
+        assert f.read().splitlines() == ['docker pull python:3.8', 'docker pull redis:6']
+    # the commit is fetched but not checked out
+    assert git('rev-parse', 'HEAD', cwd=checkout['full_path']) != checkout['sha']
+    assert not os.path.exists(os.path.join(checkout['full_path'], 'docker-compose.yml'))
+
+
+async def test_prefetch_build(checkout, fake_docker, git, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'BUILD_CACHE_FILE', str(tmp_path / 'cache.json'))
+    (tmp_path / 'deploy' / '.env').write_text('DEBUG=1')
+    prefetch = Prefetch(repository_name='App', stage='dev', build=True, **checkout)
+
+    await prefetch.run()
+
+    with open(fake_docker) as f:
+        assert f.read().splitlines()[-1] == 'docker-compose build'
+    assert not os.path.exists(prefetch.worktree)
+    git('checkout', checkout['sha'], cwd=checkout['full_path'])
+    shutil.copy(tmp_path / 'deploy' / '.env', checkout['full_path'])
+    key = prefetch_module.get_build_cache_key(checkout['sha'], checkout['full_path'])
+    assert get_cached_build(key) == prefetch.image
+
+    await prefetch.discard()
+    assert not get_cached_build(key)
+
+
+async def test_prefetch_skipped_when_target_is_busy(checkout, fake_docker):
+    lock = get_lock('deploy', 'app-dev')
+    assert lock.try_acquire()
+    try:
+        await Prefetch(repository_name='app', stage='dev', **checkout).run()
+    finally:
+        lock.release()
+
+    assert not os.path.exists(fake_docker)
+
+
+def workflow_event(sha: str = 'abc') -> dict:
+    return {
+        'action': 'queued',
+        'repository': {'owner': {'login': 'Org'}},
+        'workflow_job': {'run_id': 1, 'head_sha': sha}
+    }
+
+
+async def test_prefetcher_start_and_discard(monkeypatch):
+    started: list = []
+
+    async def run(self):
+        started.append(self)
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(Prefetch, 'run', run)
+    prefetcher = Prefetcher()
+    target = DeployTarget(repository='app', branch='dev', stage='dev', pipeline='docker')
+
+    prefetcher.start(target, workflow_event())
+    prefetcher.start(target, workflow_event())
+    prefetcher.start(target, workflow_event(sha=''))
+    prefetcher.start(target.copy(update=dict(pipeline='update')), workflow_event('def'))
+    prefetcher.start(target.copy(update=dict(options={'prefetch': False})), workflow_event('def'))
+    await asyncio.sleep(0)
+
+    assert len(started) == 1
+    assert started[0].sha == 'abc'
+    assert started[0].full_path == os.path.join(target.get_path('org'), 'app')
+
+    prefetcher.discard(target, 'abc')
+    await asyncio.wait_for(prefetcher.wait('app', 'abc'), timeout=1)
+    assert not prefetcher._tasks
@@ -0,0 +1,73 @@
+import pytest
+
+from services.executor import CommandExecutor, CommandResult
+from services.retry import RetryPolicy, get_retry_policy, is_transient
+
+
+def get_result(*tail: str, timed_out: bool = False) -> CommandResult:
+    return CommandResult(
+        command=['docker-compose', 'build'], returncode=1, duration=1,
+        timed_out=timed_out, tail=list(tail)
+    )
+
+
+@pytest.mark.parametrize('line', [
+    'Get https://registry-1.docker.io/v2/: net/http: TLS handshake timeout',
+    'fatal: unable to access: Could not resolve host: github.com',
+    'toomanyrequests: You have reached your pull rate limit',
+    'Cannot connect to the Docker daemon at unix:///var/run/docker.sock',
+    'fatal: the remote end hung up unexpectedly',
+])
+def test_transient_failures(line):
+    assert is_transient(get_result('Step 3/7', line))
+
+
+@pytest.mark.parametrize('line', [
+    'failed to solve: dockerfile parse error line 3: unknown instruction: RUNN',
+    'SyntaxError: invalid syntax',
+    '2 failed, 10 passed in 3.1s',
+])
+def test_permanent_failures(line):
+    assert not is_transient(get_result(line))
+
+
+def test_timeout_is_transient():
+    assert is_transient(get_result(timed_out=True))
+
+
+def test_step_attempts_override():
+    assert get_retry_policy('build').attempts == 3
+    assert get_retry_policy('build', {'build': 1}).attempts == 1
+    assert get_retry_policy('unknown').attempts == 1
+
+
+async def test_transient_failure_retried(tmp_path):
+    executor = CommandExecutor(path=str(tmp_path))
+    flag = tmp_path / 'failed'
+    script = f'if [ ! -f {flag} ]; then touch {flag}; echo "i/o timeout" >&2; exit 1; fi'
+
+    status = await RetryPolicy(attempts=3, delay=0).run(executor, 'sh', '-c', script)
+
+    assert status == 0
+    assert len(executor.results) == 2
+    assert executor.results[0].tail == ['i/o timeout']
+
+
+async def test_permanent_failure_not_retried(tmp_path):
+    executor = CommandExecutor(path=str(tmp_path))
+
+    status = await RetryPolicy(attempts=3, delay=0).run(
+        executor, 'sh', '-c', 'echo "unknown instruction: RUNN"; exit 1')
+
+    assert status == 1
+    assert len(executor.results) == 1
+
+
+async def test_retry_budget(tmp_path):
+    executor = CommandExecutor(path=str(tmp_path))
+
+    status = await RetryPolicy(attempts=3, delay=10, budget=1).run(
+        executor, 'sh', '-c', 'echo "connection reset" >&2; exit 1')
+
+    assert status == 1
+    assert len(executor.results) == 1
@@ -0,0 +1,50 @@
+import pytest
+
+from config import settings
+from services.jobs import job_queue
+
+
+@pytest.fixture
+def token(monkeypatch) -> str:
+    monkeypatch.setattr(settings, 'API_TOKEN', 'secret-token')
+    return 'secret-token'
+
+
+@pytest.fixture
+def submitted(monkeypatch) -> list:
+    jobs: list = []
+    monkeypatch.setattr(job_queue, 'submit', lambda job: jobs.append(job) or job)
+    return jobs
+
+
+def test_rollback_unauthorized(client, token, submitted):
+    response = client.post(
+        '/deploy/rollback/',
+        json={"owner": "tester", "repository": "repo", "stage": "dev", "version": "1.0"},
+        headers={'Authorization': 'Bearer wrong'}
+    )
+
+    assert response.status_code == 401
+    assert not submitted
+
+
+def test_rollback_queued(client, token, submitted):
+    response = client.post(
+        '/deploy/rollback/',
+        json={"owner": "tester", "repository": "repo", "stage": "dev", "version": "1.0"},
+        headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.status_code == 202
+    job = submitted[0]
+    assert response.json()['job_id'] == job.id
+    assert job.kind == 'rollback'
+    assert job.payload['version'] == '1.0'
+    assert job.payload['path'] == '/home/tester/deploy/repo/dev'
+
+
+def test_rollback_unknown_target(client, token, submitted):
+    response = client.get(
+        '/deploy/rollback/tester/unknown/dev', headers={'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == 404
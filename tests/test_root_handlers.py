@@ -1,6 +1,91 @@
 import pytest
 
+from services.jobs import job_queue
+from services.routing import DeployTarget, routing_table
+from tests.conftest import get_hook_headers
 
-@pytest.mark.skip
-def test_deploy():
-    assert False
+
+@pytest.fixture
+def submitted(monkeypatch) -> list:
+    jobs: list = []
+    monkeypatch.setattr(job_queue, 'submit', lambda job: jobs.append(job) or job)
+    return jobs
+
+
+def test_deploy(hook_request, push_data, submitted):
+    response = hook_request(push_data, delivery='delivery-deploy')
+
+    assert response.status_code == 202
+    assert response.json()['job_id'] == submitted[0].id
+
+
+def test_duplicate_delivery_answered_from_cache(hook_request, push_data, submitted):
+    first = hook_request(push_data, delivery='delivery-duplicate')
+    second = hook_request(push_data, delivery='delivery-duplicate')
+
+    assert second.json() == first.json()
+    assert len(submitted) == 1
+
+
+def test_wrong_signature(client, push_data, submitted):
+    response = client.post(
+        '/deploy/', json=push_data,
+        headers={
+            'X-Hub-Signature-256': 'sha256=wrong',
+            'User-Agent': 'GitHub-Hookshot/test',
+            'X-GitHub-Event': 'push'
+        }
+    )
+
+    assert response.json() == {"result": "ok"}
+    assert not submitted
+
+
+def test_wrong_json(client, submitted):
+    body = b'{"repository":'
+    response = client.post('/deploy/', data=body, headers=get_hook_headers(body))
+
+    assert response.json() == {"result": "ok"}
+    assert not submitted
+
+
+def test_unroutable_event_rejected(hook_request, push_data, submitted):
+    push_data['ref'] = 'refs/heads/unknown'
+    response = hook_request(push_data, delivery='delivery-unroutable')
+
+    assert response.json() == {"result": "ok"}
+    assert not submitted
+
+
+@pytest.fixture
+def update_target(monkeypatch) -> DeployTarget:
+    target = DeployTarget(repository='webhook_api', branch='main', stage='main', pipeline='update')
+    monkeypatch.setattr(routing_table, 'resolve', lambda owner, repository, branch: target)
+    return target
+
+
+def test_workflow_event_does_not_update_service(hook_request, update_target, submitted):
+    data = {
+        'action': 'completed',
+        'repository': {'name': 'webhook_api', 'owner': {'login': 'tester'}},
+        'workflow_job': {
+            'run_id': 1, 'name': 'test', 'head_branch': 'main', 'conclusion': 'success'}
+    }
+
+    response = hook_request(data, event='workflow_job', delivery='delivery-update-ci')
+
+    assert response.status_code == 202
+    assert response.json() == {"result": "ok"}
+    assert not submitted
+
+
+def test_push_updates_service(hook_request, update_target, submitted):
+    data = {
+        'ref': 'refs/heads/main',
+        'repository': {'name': 'webhook_api', 'owner': {'login': 'tester', 'name': 'tester'}}
+    }
+
+    hook_request(data, delivery='delivery-update-push')
+
+    assert submitted[0].kind == 'update'
+    assert submitted[0].payload['user'] == 'tester'
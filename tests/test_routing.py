@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+
+from services.routing import RoutingTable, get_route_key
+
+
+@pytest.fixture
+def routes_file(tmp_path) -> str:
+    path = tmp_path / 'routes.json'
+    path.write_text(json.dumps([
+        {"owner": "Deskent", "repository": "app", "branches": {"main": "prod"},
+         "path": "/srv/{repository}/{stage}", "options": {"blue_green": True}},
+        {"repository": "app_client", "pipeline": "clients"}
+    ]))
+    return str(path)
+
+
+def test_routes_from_settings():
+    table = RoutingTable()
+    table.load()
+
+    target = table.resolve('anyone', 'repo', 'deskent')
+    assert target.stage == 'dev'
+    assert target.pipeline == 'docker'
+    assert target.get_path('tester') == '/home/tester/deploy/repo/dev'
+    assert table.resolve('anyone', 'repo', 'unknown') is None
+    assert table.resolve('anyone', 'unknown', 'deskent') is None
+
+
+def test_routes_from_file(routes_file):
+    table = RoutingTable(path=routes_file)
+    table.load()
+
+    target = table.resolve('deskent', 'app', 'main')
+    assert target.get_path('deskent') == '/srv/app/prod'
+    assert target.options == {"blue_green": True}
+    assert table.resolve('other', 'app', 'main') is None
+    assert table.resolve('other', 'app_client', 'deskent').pipeline == 'clients'
+
+
+def test_reload_on_change_keeps_old_routes_on_error(routes_file):
+    table = RoutingTable(path=routes_file)
+    table.load()
+    with open(routes_file, 'w') as f:
+        f.write('[{"repository": ')
+    os.utime(routes_file, (0, 1))
+    table.reload_if_changed()
+
+    assert table.resolve('deskent', 'app', 'main')
+
+    with open(routes_file, 'w') as f:
+        json.dump([{"repository": "new", "branches": {"main": "prod"}}], f)
+    os.utime(routes_file, (0, 2))
+    table.reload_if_changed()
+
+    assert table.resolve('deskent', 'app', 'main') is None
+    assert table.resolve('deskent', 'new', 'main').stage == 'prod'
+
+
+def test_get_route_key():
+    push = {"ref": "refs/heads/main", "repository": {"name": "app", "owner": {"name": "Deskent"}}}
+    job = {
+        "workflow_job": {"head_branch": "dev"},
+        "repository": {"name": "app", "owner": {"login": "Deskent"}}
+    }
+
+    assert get_route_key(push) == ('deskent', 'app', 'main')
+    assert get_route_key(job) == ('deskent', 'app', 'dev')
@@ -0,0 +1,196 @@
+import asyncio
+
+import pytest
+
+from services import runs
+from services.ledger import DeployLedger
+from services.routing import DeployTarget
+from services.runs import RunAggregator
+
+
+@pytest.fixture
+def reports(monkeypatch) -> list:
+    sent: list = []
+    monkeypatch.setattr(runs, 'send_message_to_admins', lambda text, key='': sent.append(text))
+    return sent
+
+
+@pytest.fixture
+def deploys() -> list:
+    return []
+
+
+@pytest.fixture
+def aggregator(deploys) -> RunAggregator:
+    return RunAggregator(
+        on_success=lambda data, target: deploys.append(data) or 'job', settle_delay=0.05)
+
+
+def get_target(**options) -> DeployTarget:
+    return DeployTarget(repository='app', branch='dev', stage='dev', options=options)
+
+
+def job_event(name: str, action: str = 'completed', conclusion: str = 'success', run_id: int = 1):
+    return {
+        'action': action,
+        'workflow_job': {
+            'run_id': run_id, 'run_attempt': 1, 'name': name, 'head_branch': 'dev',
+            'head_sha': 'abc', 'conclusion': conclusion if action == 'completed' else None
+        }
+    }
+
+
+async def test_matrix_deployed_once_after_settle(aggregator, deploys, reports):
+    target = get_target()
+    for name in ('test (3.8)', 'test (3.9)', 'test (3.10)'):
+        await aggregator.add(job_event(name, 'queued'), target)
+    for name in ('test (3.8)', 'test (3.9)', 'test (3.10)'):
+        assert await aggregator.add(job_event(name), target) is None
+
+    await asyncio.sleep(0.1)
+    await aggregator.add(job_event('test (3.8)'), target)
+
+    assert len(deploys) == 1
+    assert len(reports) == 1
+    assert 'Workflow run: success' in reports[0]
+
+
+async def test_failed_job_stops_run(aggregator, deploys, reports):
+    target = get_target()
+    await aggregator.add(job_event('lint', 'queued'), target)
+    await aggregator.add(job_event('test'), target)
+    await aggregator.add(job_event('lint', conclusion='failure'), target)
+    await asyncio.sleep(0.1)
+
+    assert not deploys
+    assert len(reports) == 1
+    assert 'lint: failure' in reports[0]
+
+
+async def test_required_jobs(aggregator, deploys, reports):
+    target = get_target(required_jobs=['build', 'test'])
+    assert await aggregator.add(job_event('build'), target) is None
+    assert await aggregator.add(job_event('docs', conclusion='failure'), target) is None
+
+    assert await aggregator.add(job_event('test'), target) == 'job'
+    assert len(deploys) == 1
+
+
+async def test_workflow_run_completed(aggregator, deploys, reports):
+    target = get_target()
+    await aggregator.add(job_event('test'), target)
+    event = {
+        'action': 'completed',
+        'workflow_run': {'id': 1, 'run_attempt': 1, 'head_branch': 'dev', 'conclusion': 'success'}
+    }
+
+    assert await aggregator.add(event, target) == 'job'
+    assert deploys[0] == job_event('test')
+    await asyncio.sleep(0.1)
+    assert len(deploys) == 1
+
+
+async def test_incomplete_run_expires(deploys, reports):
+    aggregator = RunAggregator(
+        on_success=lambda data, target: deploys.append(data), ttl=0, expire_interval=0.01)
+    await aggregator.add(job_event('test', 'in_progress'), get_target())
+    await aggregator.start()
+    await asyncio.sleep(0.05)
+    await aggregator.stop()
+    assert len(aggregator) == 0
+
+    # events do not expire runs themselves
+    await aggregator.add(job_event('test', 'in_progress', run_id=2), get_target())
+    assert len(aggregator) == 1
+    assert not reports
+
+
+async def test_start_and_failure_callbacks(deploys, reports):
+    calls: list = []
+    aggregator = RunAggregator(
+        on_success=lambda data, target: deploys.append(data),
+        on_start=lambda target, data: calls.append(('start', data['action'])),
+        on_failure=lambda target, sha: calls.append(('failure', sha))
+    )
+    target = get_target()
+    await aggregator.add(job_event('test', 'queued'), target)
+    await aggregator.add(job_event('lint', 'queued'), target)
+    await aggregator.add(job_event('test', conclusion='failure'), target)
+
+    assert calls == [('start', 'queued'), ('failure', 'abc')]
+    assert not deploys
+
+
+def run_event(action: str, conclusion: str = None) -> dict:
+    return {
+        'action': action,
+        'workflow_run': {
+            'id': 1, 'run_attempt': 1, 'head_branch': 'dev', 'head_sha': 'abc',
+            'conclusion': conclusion
+        }
+    }
+
+
+async def test_run_without_jobs_is_not_settled(aggregator, deploys, reports):
+    target = get_target()
+    await aggregator.add(run_event('requested'), target)
+    await aggregator.add(run_event('in_progress'), target)
+    await asyncio.sleep(0.1)
+
+    assert not reports
+    assert await aggregator.add(run_event('completed', 'success'), target) == 'job'
+    assert len(deploys) == 1
+    assert 'Workflow run: success' in reports[0]
+
+
+@pytest.fixture
+def shared_ledgers(tmp_path) -> list:
+    """Ledgers of two workers on one database"""
+
+    ledgers = [DeployLedger(path=str(tmp_path / 'ledger.sqlite3')) for _ in range(2)]
+    for ledger in ledgers:
+        ledger.open()
+    yield ledgers
+    for ledger in ledgers:
+        ledger._connection.close()
+
+
+def get_workers(deploys: list, ledgers: list) -> list:
+    return [
+        RunAggregator(
+            on_success=lambda data, target: deploys.append(data) or 'job',
+            settle_delay=0.05, ledger=ledger
+        )
+        for ledger in ledgers
+    ]
+
+
+async def test_workers_share_failed_job(shared_ledgers, deploys, reports):
+    first, second = get_workers(deploys, shared_ledgers)
+    target = get_target()
+    await first.add(job_event('lint', 'queued'), target)
+    await second.add(job_event('test'), target)
+    await first.add(job_event('lint', conclusion='failure'), target)
+    await asyncio.sleep(0.1)
+
+    assert not deploys
+    assert len(reports) == 1
+    assert 'lint: failure' in reports[0]
+
+
+async def test_workers_wait_for_pending_job(shared_ledgers, deploys, reports):
+    first, second = get_workers(deploys, shared_ledgers)
+    target = get_target()
+    await first.add(job_event('lint', 'in_progress'), target)
+    await second.add(job_event('test'), target)
+    await asyncio.sleep(0.1)
+    assert not deploys
+
+    await first.add(job_event('lint'), target)
+    await asyncio.sleep(0.1)
+    # a redelivered event of the finished run
+    await second.add(job_event('test'), target)
+    await asyncio.sleep(0.1)
+
+    assert len(deploys) == 1
+    assert len(reports) == 1
@@ -1,11 +1,11 @@
-import pytest
+from services import utils
+from services.utils import send_message_to_admins
 
 
-@pytest.mark.skip
-def test_send_message_to_user():
-    assert False
+def test_send_message_to_admins(monkeypatch):
+    sent: list = []
+    monkeypatch.setattr(utils.notifier, 'send', lambda text, key='': sent.append((text, key)))
 
+    send_message_to_admins('text', key='app-dev-1')
 
-@pytest.mark.skip
-def test_send_message_to_admins():
-    assert False
+    assert sent == [('[Slarti][test]: text', 'app-dev-1')]